@@ -1,34 +1,98 @@
 # Import the chat router that handles /chat endpoint
 from FinDeep_backend.app.chatbot_route import router
-# Import the workflow builder for the original complex AI pipeline
-from FinDeep_backend.pipeline.workflow import build_graph
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
 load_dotenv()
 
 # Import required modules for FastAPI server
-import os, uvicorn
-from fastapi import FastAPI
+import os, time, resource, uvicorn
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware  # For handling cross-origin requests
 from contextlib import asynccontextmanager  # For application lifecycle management
 
+# Source dataset used to build the in-process exact-match fact store
+DEFAULT_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data_setup", "sources", "FinDeep_data (cleaned).csv"
+)
+# Embeddings written by data_setup/miniLM_embeddings.py, used by the FAISS retrieval backend
+DEFAULT_EMBEDDINGS_PATH = os.path.join(os.path.dirname(DEFAULT_DATA_PATH), "financial_embeddings.npy")
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4o-mini")
+
+# Set when this module is first imported; with a preloading server that is the master, before any fork
+BOOT_TIME = time.time()
+
+# Load the embedding model into this process. Called in the server master before workers are forked,
+# so every worker shares the weights copy-on-write and build_graph reuses them instead of reloading.
+# The dataset snapshot is (re)built here too, once, instead of by every worker at the same time
+def preload_models():
+    from FinDeep_backend.pipeline.utils.encoder import load_encoder
+    from FinDeep_backend.pipeline.store.snapshot import load_snapshot
+    start_time = time.perf_counter()
+    load_snapshot(os.getenv("FINDEEP_DATA_PATH", DEFAULT_DATA_PATH))
+    load_encoder(EMBEDDING_MODEL, backend = os.getenv("EMBEDDING_BACKEND", "torch"))
+    print(f"Preloaded {EMBEDDING_MODEL} in {time.perf_counter() - start_time:.1f}s (pid {os.getpid()})")
+
+# Resident memory of this process in MB; shared pages are the ones still common with the master after fork
+def memory_usage():
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty"):
+                    usage[key] = int(value.split()[0]) / 1024
+        return {
+            "rss_mb": round(usage["Rss"], 1),
+            "pss_mb": round(usage["Pss"], 1),
+            "shared_mb": round(usage["Shared_Clean"] + usage["Shared_Dirty"], 1)
+        }
+    except (OSError, KeyError, ValueError):
+        # No /proc (e.g. macOS): fall back to the peak RSS
+        return {"max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
 # Application lifecycle manager - handles startup and shutdown events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup phase - initialize AI pipeline
+    router.ready = False
+    start_time = time.perf_counter()
     try:
         print("Initializing FinDeep AI pipeline...")
+        # Imported lazily so the app module stays cheap to import (and to preload in a server master)
+        from FinDeep_backend.pipeline.workflow import build_graph
         # Build the complex LangGraph workflow (original implementation)
-        graph = build_graph(model_name = 'gpt-4o-mini',
-                            embedding_model = "sentence-transformers/all-MiniLM-L6-v2")
+        graph = build_graph(model_name = MODEL_NAME,
+                            embedding_model = EMBEDDING_MODEL,
+                            data_path = os.getenv("FINDEEP_DATA_PATH", DEFAULT_DATA_PATH),
+                            embedding_backend = os.getenv("EMBEDDING_BACKEND", "torch"),
+                            retrieval_backend = os.getenv("RETRIEVAL_BACKEND", "qdrant"),
+                            embeddings_path = os.getenv("FINDEEP_EMBEDDINGS_PATH", DEFAULT_EMBEDDINGS_PATH),
+                            faiss_index_path = os.getenv("FAISS_INDEX_PATH"),
+                            checkpoint_path = os.getenv("FINDEEP_CHECKPOINT_PATH"),
+                            cache_generation_path = os.getenv(
+                                "FINDEEP_CACHE_GENERATION_PATH",
+                                f"{os.getenv('FINDEEP_EMBEDDINGS_PATH', DEFAULT_EMBEDDINGS_PATH)}.generation"
+                            ))
         # Store the graph in the router for use in chat endpoint
         router.graph = graph
         print("FinDeep AI pipeline initialized successfully!")
+        # First encode and first LLM/Qdrant connection happen here, not on the first user request
+        await graph.qdrant_retrieval.awarm_up()
+        await graph.message_analysis.awarm_up()
+        await graph.message_synthesis.awarm_up()
+        router.ready = True
     except Exception as e:
         # If pipeline initialization fails, set graph to None and continue
         print(f"Failed to initialize AI pipeline: {e}")
         router.graph = None
+    print(
+        f"Worker {os.getpid()} ready={router.ready} in {time.perf_counter() - start_time:.1f}s "
+        f"({time.time() - BOOT_TIME:.1f}s since boot), memory {memory_usage()}"
+    )
     yield  # Application runs here
     
     # Shutdown phase (currently empty, but could add cleanup code)
@@ -68,14 +132,27 @@ async def health_check():
         "graph_initialized": hasattr(router, 'graph') and router.graph is not None  # AI pipeline status
     }
 
-# Main entry point for running the server directly
+# Readiness probe - 200 only once the pipeline is built and warmed up, so load balancers wait for it
+@app.get("/ready")
+async def readiness_check(response: Response):
+    ready = getattr(router, "ready", False) and getattr(router, "graph", None) is not None
+    if not ready:
+        response.status_code = 503
+    return {
+        "ready": ready,
+        "pid": os.getpid(),
+        "uptime_sec": round(time.time() - BOOT_TIME, 1),
+        "memory": memory_usage()
+    }
+
+# Main entry point for running the server directly (development; use app/gunicorn_conf.py for production)
 if __name__ == "__main__":
     # Get port from environment variable
-    chatbot_service_port = int(os.getenv("CHATBOT_SERVICE_PORT"))
+    chatbot_service_port = int(os.getenv("CHATBOT_SERVICE_PORT", 8001))
     # Start the server with uvicorn
     uvicorn.run(
-        "services.chatbot.app.main:app",  # App location (this might need updating)
+        "FinDeep_backend.app.chatbot_api:app",  # App location
         host = "0.0.0.0",  # Listen on all interfaces
         port = chatbot_service_port,  # Use configured port
-        reload = True  # Auto-reload on code changes (development mode)
+        reload = os.getenv("CHATBOT_RELOAD", "0") == "1"  # Auto-reload on code changes, opt-in for development
     )
\ No newline at end of file
@@ -1,45 +1,341 @@
 # Import request/response schemas for type safety
-from FinDeep_backend.app.request_schema import ChatRequest, ChatResponse
+from FinDeep_backend.app.request_schema import ChatRequest, ChatResponse, BatchChatRequest, BatchChatItem, BatchChatResponse
+from FinDeep_backend.pipeline.constant.schema import GraphState
+from FinDeep_backend.pipeline.utils.metrics import REGISTRY, REQUEST_LATENCY, REQUEST_ERRORS, request_timings
+from FinDeep_backend.pipeline.utils.llm_scheduler import LLMOverloaded, request_deadline, PRIORITY_INTERACTIVE, PRIORITY_BATCH
 
 # Import FastAPI components for API routing and error handling
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
 # Import LangChain components (legacy - not used in simplified version)
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk
 # Import OpenAI integration for direct AI calls
 from langchain_openai import ChatOpenAI
-import os  # For environment variable access
+import os, hmac, json, time, math, asyncio  # For environment variable access, SSE payloads, timing and batch concurrency
+from typing import Optional, Annotated
 
 # Create API router for chat endpoints
 router = APIRouter()
 
+# Seconds a request may take end to end; clients can ask for less with an X-Request-Timeout header, never more
+CHAT_REQUEST_TIMEOUT = float(os.getenv("CHAT_REQUEST_TIMEOUT", 30))
+CHAT_BATCH_TIMEOUT = float(os.getenv("CHAT_BATCH_TIMEOUT", 120))
+# Shared secret for /cache/invalidate (X-Admin-Token header); the endpoint is disabled while it is unset
+CACHE_INVALIDATE_TOKEN = os.getenv("CACHE_INVALIDATE_TOKEN")
+
+def request_timeout(header: Optional[float], limit: float):
+    return min(header, limit) if header and header > 0 else limit
+
+# Shed or rate-limited LLM calls become a fast 429/503 the client can retry
+def overloaded_response(e: LLMOverloaded):
+    return HTTPException(
+        status_code = e.status_code,
+        detail = str(e),
+        headers = {"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
+# One structured log line per request, with the per-node breakdown the agents recorded
+def log_request(endpoint: str, session_id: str, start_time: float, timings: dict, error: str = None):
+    elapsed = time.perf_counter() - start_time
+    REQUEST_LATENCY.observe(elapsed, endpoint)
+    if error:
+        REQUEST_ERRORS.inc(endpoint)
+    print(json.dumps({
+        "event": "request",
+        "endpoint": endpoint,
+        "session_id": session_id,
+        "total_ms": round(elapsed * 1e3, 2),
+        **timings,
+        **({"error": error} if error else {})
+    }, default=str))
+
 # Main chat endpoint - receives messages from frontend and returns AI responses
 @router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(req: ChatRequest):
+async def chat_endpoint(req: ChatRequest, x_request_timeout: Annotated[Optional[float], Header()] = None):
     init_state = {"user_message": req.message}
     reply_text = "Sorry, I didn't understand that."  # default fallback
+    start_time = time.perf_counter()
+    error = None
+    overloaded = None
 
-    try:
-        # Make sure the AI pipeline exists
-        if router.graph is None:
-            raise RuntimeError("AI pipeline is not initialized.")
+    # The deadline reaches the LLM scheduler through a context variable
+    with request_timings() as timings, request_deadline(request_timeout(x_request_timeout, CHAT_REQUEST_TIMEOUT), PRIORITY_INTERACTIVE):
+        try:
+            # Make sure the AI pipeline exists
+            if router.graph is None:
+                raise RuntimeError("AI pipeline is not initialized.")
 
-        # Try invoking the AI pipeline
-        result = router.graph.invoke(
-            input=init_state,
-            config={"configurable": {"thread_id": req.session_id}}
-        )
+            # Run the AI pipeline without blocking the event loop
+            result = await router.graph.ainvoke(
+                input=init_state,
+                config={"configurable": {"thread_id": req.session_id}}
+            )
 
-        # Extract the last AI message
-        ai_msg = result.get("chat_history", [])[-1] if result.get("chat_history") else None
-        if isinstance(ai_msg, AIMessage):
-            reply_text = ai_msg.content
+            # Extract the last AI message
+            ai_msg = result.get("chat_history", [])[-1] if result.get("chat_history") else None
+            if isinstance(ai_msg, AIMessage):
+                reply_text = ai_msg.content
 
-    except Exception as e:
-        # Log the error but still return a valid response
-        print(f"Error during AI invocation: {e}")
+        except LLMOverloaded as e:
+            overloaded = e
+            error = f"{e.status_code}: {e}"
+        except Exception as e:
+            # Log the error but still return a valid response
+            print(f"Error during AI invocation: {e}")
+            error = str(e)
+    log_request("/chat", req.session_id, start_time, timings, error)
+    if overloaded is not None:
+        raise overloaded_response(overloaded)
 
     # Always return a response, even if AI fails
     return ChatResponse(
         session_id=req.session_id,
         response=reply_text
-    )
\ No newline at end of file
+    )
+
+# Format one Server-Sent Event frame
+def sse_event(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Streaming chat endpoint - progress events per pipeline stage, then synthesis tokens as they arrive
+@router.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest, x_request_timeout: Annotated[Optional[float], Header()] = None):
+    init_state = {"user_message": req.message}
+    timeout = request_timeout(x_request_timeout, CHAT_REQUEST_TIMEOUT)
+
+    async def event_stream():
+        reply_text = ""
+        start_time = time.perf_counter()
+        error = None
+        with request_timings() as timings, request_deadline(timeout, PRIORITY_INTERACTIVE):
+            try:
+                if router.graph is None:
+                    raise RuntimeError("AI pipeline is not initialized.")
+
+                # The graph itself appends the final AIMessage to the session's chat_history
+                async for mode, chunk in router.graph.astream(
+                    input=init_state,
+                    config={"configurable": {"thread_id": req.session_id}},
+                    stream_mode=["updates", "messages"]
+                ):
+                    if mode == "updates":
+                        for stage in chunk:
+                            yield sse_event("progress", {"stage": stage})
+                        # A coalesced synthesis streams no tokens of its own; send the shared reply in one piece
+                        if "message_synthesis" in chunk and not reply_text:
+                            history = chunk["message_synthesis"].get("chat_history") or []
+                            if history and isinstance(history[-1], AIMessage) and history[-1].content:
+                                timings["first_token_ms"] = round((time.perf_counter() - start_time) * 1e3, 2)
+                                reply_text = history[-1].content
+                                yield sse_event("token", {"content": reply_text})
+                    else:
+                        # Only token chunks; full messages from the node output are skipped
+                        message, metadata = chunk
+                        if (
+                            isinstance(message, AIMessageChunk)
+                            and metadata.get("langgraph_node") == "message_synthesis"
+                            and message.content
+                        ):
+                            if not reply_text:
+                                timings["first_token_ms"] = round((time.perf_counter() - start_time) * 1e3, 2)
+                            reply_text += message.content
+                            yield sse_event("token", {"content": message.content})
+
+            except LLMOverloaded as e:
+                # The status is already sent, so the overload goes out as an error event the client can retry on
+                error = f"{e.status_code}: {e}"
+                yield sse_event("error", {"detail": str(e), "status": e.status_code, "retry_after": e.retry_after})
+                reply_text = reply_text or "Sorry, I didn't understand that."
+            except Exception as e:
+                print(f"Error during AI streaming: {e}")
+                error = str(e)
+                yield sse_event("error", {"detail": str(e)})
+                reply_text = reply_text or "Sorry, I didn't understand that."
+        log_request("/chat/stream", req.session_id, start_time, timings, error)
+
+        yield sse_event("done", ChatResponse(session_id=req.session_id, response=reply_text).model_dump())
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+# Run deduplicated questions stage by stage: concurrent analysis, one batched retrieval, concurrent synthesis
+async def run_batch(graph, messages: list, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    states = {message: GraphState(chat_history=[], user_message=message) for message in messages}
+    errors = {}
+
+    async def run_stage(stage, agent, message, method = "ainvoke"):
+        async with semaphore:
+            try:
+                await getattr(agent, method)(states[message])
+            except Exception as e:
+                errors[message] = f"{stage}: {e}"
+
+    await asyncio.gather(*[run_stage("message_analysis", graph.message_analysis, m) for m in messages])
+
+    retrievable = [m for m in messages if m not in errors]
+    # Comparison questions fan out per sub-query; everything else shares one batched retrieval
+    fan_out = [m for m in retrievable if states[m].sub_queries]
+    try:
+        await graph.qdrant_retrieval.abatch_invoke([states[m] for m in retrievable if m not in fan_out])
+    except Exception as e:
+        for m in retrievable:
+            if m not in fan_out:
+                errors[m] = f"qdrant_retrieval: {e}"
+    await asyncio.gather(*[run_stage("retrieval_branch", graph.retrieval_branch, m, "aretrieve_all") for m in fan_out])
+
+    await asyncio.gather(*[
+        run_stage("message_synthesis", graph.message_synthesis, m)
+        for m in messages if m not in errors
+    ])
+    return states, errors
+
+# Batch chat endpoint - many questions in one call, answers returned in request order with per-item errors
+@router.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch_endpoint(req: BatchChatRequest, x_request_timeout: Annotated[Optional[float], Header()] = None):
+    if router.graph is None:
+        raise HTTPException(status_code = 503, detail = "AI pipeline is not initialized.")
+
+    # Identical questions are answered once
+    start_time = time.perf_counter()
+    messages = list(dict.fromkeys(item.message.strip() for item in req.requests))
+    # Batch LLM calls queue behind interactive chats; items that cannot make the deadline fail individually
+    with request_deadline(request_timeout(x_request_timeout, CHAT_BATCH_TIMEOUT), PRIORITY_BATCH):
+        states, errors = await run_batch(router.graph, messages, req.concurrency)
+    log_request(
+        "/chat/batch", None, start_time,
+        {"requests": len(req.requests), "unique": len(messages), "failed": len(errors)},
+        f"{len(errors)} items failed" if errors else None
+    )
+
+    responses = []
+    for item in req.requests:
+        message = item.message.strip()
+        if message in errors:
+            responses.append(BatchChatItem(session_id=item.session_id, error=errors[message]))
+            continue
+        reply_text = states[message].chat_history[-1].content
+        responses.append(BatchChatItem(session_id=item.session_id, response=reply_text))
+        try:
+            # Each session still gets the exchange appended to its own chat_history
+            await router.graph.aupdate_state(
+                {"configurable": {"thread_id": item.session_id}},
+                {
+                    "user_message": item.message,
+                    "chat_history": [HumanMessage(content=item.message), AIMessage(content=reply_text)]
+                },
+                as_node="message_synthesis"
+            )
+        except Exception as e:
+            print(f"Error saving batch history for {item.session_id}: {e}")
+
+    print(f"Batch: {len(req.requests)} requests, {len(messages)} unique, {len(errors)} failed")
+    return BatchChatResponse(responses=responses)
+
+# Drop cached search results in every worker, e.g. after the collection is re-ingested
+@router.post("/cache/invalidate")
+async def invalidate_cache(x_admin_token: Annotated[Optional[str], Header()] = None):
+    if not CACHE_INVALIDATE_TOKEN:
+        raise HTTPException(status_code = 404, detail = "Cache invalidation is disabled (CACHE_INVALIDATE_TOKEN is not set).")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, CACHE_INVALIDATE_TOKEN):
+        raise HTTPException(status_code = 403, detail = "Invalid admin token.")
+    if router.graph is None:
+        raise HTTPException(status_code = 503, detail = "AI pipeline is not initialized.")
+    router.graph.qdrant_retrieval.invalidate_cache()
+    return {"status": "invalidated"}
+
+# Transport settings and circuit breaker state of the Qdrant client
+@router.get("/qdrant/stats")
+async def qdrant_stats():
+    if router.graph is None:
+        raise HTTPException(status_code = 503, detail = "AI pipeline is not initialized.")
+    if not hasattr(router.graph.qdrant_retrieval, "transport_stats"):
+        raise HTTPException(status_code = 404, detail = "The retrieval backend does not use Qdrant.")
+    return router.graph.qdrant_retrieval.transport_stats()
+
+# Hit/miss counters for the retrieval caches
+@router.get("/cache/stats")
+async def cache_stats():
+    if router.graph is None:
+        raise HTTPException(status_code = 503, detail = "AI pipeline is not initialized.")
+    return router.graph.qdrant_retrieval.cache_stats()
+
+# Size and eviction counters for the conversation checkpointer
+@router.get("/sessions/stats")
+async def session_stats():
+    if router.graph is None:
+        raise HTTPException(status_code = 503, detail = "AI pipeline is not initialized.")
+    return router.graph.checkpointer.stats()
+
+# Single-flight counters per pipeline stage: followers shared an identical in-flight call instead of making their own
+def coalesce_stats(graph):
+    return {
+        "message_analysis": graph.message_analysis.coalesce_stats(),
+        "qdrant_retrieval": graph.qdrant_retrieval.coalesce_stats(),
+        "message_synthesis": graph.message_synthesis.coalesce_stats()
+    }
+
+@router.get("/coalesce/stats")
+async def coalesce_stats_endpoint():
+    if router.graph is None:
+        raise HTTPException(status_code = 503, detail = "AI pipeline is not initialized.")
+    return coalesce_stats(router.graph)
+
+# Rate limits, queue depth and shed/429 counters of the shared LLM scheduler
+@router.get("/llm/stats")
+async def llm_stats():
+    if router.graph is None:
+        raise HTTPException(status_code = 503, detail = "AI pipeline is not initialized.")
+    return router.graph.llm_scheduler.stats()
+
+# Cache and session numbers owned by the retrieval agent and the checkpointer, read at scrape time
+def collect_pipeline_metrics():
+    graph = getattr(router, "graph", None)
+    if graph is None:
+        return []
+    metrics = []
+    cache_stats = graph.qdrant_retrieval.cache_stats()
+    for kind in ("hits", "misses", "evictions"):
+        metrics.append((
+            f"findeep_cache_{kind}_total", "counter", f"Retrieval cache {kind}",
+            [({"cache": cache}, stats[kind]) for cache, stats in cache_stats.items()]
+        ))
+    metrics.append((
+        "findeep_cache_size", "gauge", "Entries in each retrieval cache",
+        [({"cache": cache}, stats["size"]) for cache, stats in cache_stats.items()]
+    ))
+    session_stats = graph.checkpointer.stats()
+    metrics.append(("findeep_sessions", "gauge", "Sessions held in memory", [({}, session_stats["sessions"])]))
+    metrics.append(("findeep_session_bytes", "gauge", "Approximate bytes of session state in memory", [({}, session_stats["bytes"])]))
+    metrics.append(("findeep_session_evictions_total", "counter", "Sessions evicted from memory", [({}, session_stats["evictions"])]))
+    # Only the Qdrant backend has a remote transport (and so a circuit breaker)
+    if hasattr(graph.qdrant_retrieval, "transport_stats"):
+        circuit = graph.qdrant_retrieval.transport_stats()["circuit"]
+        metrics.append((
+            "findeep_qdrant_circuit_open", "gauge", "1 while the Qdrant circuit breaker rejects calls",
+            [({}, int(circuit["state"] == "open"))]
+        ))
+        metrics.append(("findeep_qdrant_circuit_opened_total", "counter", "Times the Qdrant circuit breaker opened", [({}, circuit["opened"])]))
+    stage_stats = coalesce_stats(graph)
+    metrics.append((
+        "findeep_coalesce_ratio", "gauge", "Share of calls per stage served by an identical in-flight call",
+        [({"stage": stage}, stats["coalesce_ratio"]) for stage, stats in stage_stats.items()]
+    ))
+    metrics.append((
+        "findeep_coalesce_in_flight", "gauge", "Single-flight calls currently running per stage",
+        [({"stage": stage}, stats["in_flight"]) for stage, stats in stage_stats.items()]
+    ))
+    llm_stats = graph.llm_scheduler.stats()
+    metrics.append(("findeep_llm_queue_depth", "gauge", "LLM calls waiting in the scheduler queue", [({}, llm_stats["queued"])]))
+    metrics.append(("findeep_llm_active", "gauge", "LLM calls currently running", [({}, llm_stats["active"])]))
+    metrics.append((
+        "findeep_llm_service_seconds", "gauge", "Moving average LLM call duration used for admission control",
+        [({}, llm_stats["service_time_sec"])]
+    ))
+    return metrics
+
+REGISTRY.register_collector(collect_pipeline_metrics)
+
+# Prometheus-style metrics; each worker process reports its own values
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
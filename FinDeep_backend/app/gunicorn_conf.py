@@ -0,0 +1,26 @@
+# Production launch: gunicorn master + uvicorn workers
+#   gunicorn -c FinDeep_backend/app/gunicorn_conf.py FinDeep_backend.app.chatbot_api:app
+# The embedding model is loaded once in the master and shared copy-on-write by the forked workers.
+# Each worker then builds its own clients, warms up and reports ready on /ready.
+import os, gc
+
+bind = f"0.0.0.0:{os.getenv('CHATBOT_SERVICE_PORT', 8001)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import the app (and preload the model) in the master before forking
+preload_app = True
+# Model load and warm-up can take a while on a cold machine
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+
+def on_starting(server):
+    from FinDeep_backend.app.chatbot_api import preload_models
+    preload_models()
+
+def when_ready(server):
+    # Move everything loaded so far out of the GC's reach, so collections in the workers
+    # do not write to (and un-share) the pages holding the model
+    gc.freeze()
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked")
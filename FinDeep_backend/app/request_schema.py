@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from typing import List, Optional
+from pydantic import BaseModel, Field
 
 class ChatRequest(BaseModel):
     session_id: str
@@ -6,4 +7,16 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     session_id: str
-    response: str
\ No newline at end of file
+    response: str
+
+class BatchChatRequest(BaseModel):
+    requests: List[ChatRequest]
+    concurrency: int = Field(default = 8, ge = 1, le = 64)
+
+class BatchChatItem(BaseModel):
+    session_id: str
+    response: str = ""
+    error: Optional[str] = None
+
+class BatchChatResponse(BaseModel):
+    responses: List[BatchChatItem]
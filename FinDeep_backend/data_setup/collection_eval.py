@@ -0,0 +1,187 @@
+from FinDeep_backend.pipeline.utils.encoder import load_encoder, ENCODER_BACKENDS
+from FinDeep_backend.pipeline.utils.qdrant_transport import QdrantTransport
+from FinDeep_backend.pipeline.utils.collection_profiles import (
+    COLLECTION_PROFILES, collection_config, search_params, estimate_memory
+)
+from FinDeep_backend.data_setup.encoder_benchmark import normalize, build_queries
+from FinDeep_backend.pipeline.store.snapshot import load_snapshot
+
+import json, time, argparse
+import numpy as np
+from qdrant_client.http import models
+
+def exact_top_k(queries, embeddings, top_k: int, block_size: int = 100000):
+    # Ground truth: brute-force cosine over the float32 embeddings, block by block to bound memory
+    best_scores = np.full((len(queries), 0), -np.inf, dtype = np.float32)
+    best_ids = np.empty((len(queries), 0), dtype = np.int64)
+    for lo in range(0, len(embeddings), block_size):
+        block = normalize(embeddings[lo:lo + block_size])
+        scores = np.concatenate([best_scores, queries @ block.T], axis = 1)
+        ids = np.concatenate([best_ids, np.broadcast_to(np.arange(lo, lo + len(block)), (len(queries), len(block)))], axis = 1)
+        keep = np.argpartition(-scores, min(top_k, scores.shape[1] - 1), axis = 1)[:, :top_k]
+        best_scores = np.take_along_axis(scores, keep, axis = 1)
+        best_ids = np.take_along_axis(ids, keep, axis = 1)
+    return [set(row) for row in best_ids.tolist()]
+
+def create_eval_collection(transport, name: str, profile: str, embeddings, hnsw_m, hnsw_ef_construct, batch_size: int = 1024):
+    client = transport.client
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name = name,
+        **collection_config(profile, embeddings.shape[1], hnsw_m = hnsw_m, hnsw_ef_construct = hnsw_ef_construct)
+    )
+    start_time = time.perf_counter()
+    for lo in range(0, len(embeddings), batch_size):
+        hi = min(lo + batch_size, len(embeddings))
+        transport.call(
+            "upsert",
+            collection_name = name,
+            points = models.Batch(
+                ids = list(range(lo, hi)),
+                vectors = np.asarray(embeddings[lo:hi], dtype = np.float32).tolist(),
+                payloads = [{"position": position} for position in range(lo, hi)]
+            ),
+            wait = True
+        )
+    return time.perf_counter() - start_time
+
+def wait_until_indexed(client, name: str, timeout: float = 600):
+    # Searches before the optimizer has built the HNSW graph would measure a brute-force scan
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < timeout:
+        info = client.get_collection(name)
+        if info.status == models.CollectionStatus.GREEN:
+            return info, time.perf_counter() - start_time
+        time.sleep(1)
+    raise TimeoutError(f"{name} was not indexed after {timeout}s")
+
+def evaluate_profile(transport, name: str, profile: str, query_embeddings, truth, top_k: int, hnsw_ef: int = None, warm_up: int = 10):
+    params = search_params(profile, hnsw_ef)
+
+    def search(vector):
+        return transport.call(
+            "search",
+            collection_name = name,
+            query_vector = vector.tolist(),
+            limit = top_k,
+            search_params = params,
+            with_payload = False,
+            with_vectors = False
+        )
+
+    for vector in query_embeddings[:warm_up]:
+        search(vector)
+    latencies = []
+    recalls = []
+    for vector, expected in zip(query_embeddings, truth):
+        start_time = time.perf_counter()
+        results = search(vector)
+        latencies.append((time.perf_counter() - start_time) * 1e3)
+        recalls.append(len({point.id for point in results} & expected) / top_k)
+    return {
+        f"recall@{top_k}": float(np.mean(recalls)),
+        f"recall@{top_k}_min": float(np.min(recalls)),
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+        "latency_ms_p99": float(np.percentile(latencies, 99))
+    }
+
+def run_eval(
+        embedding_model: str,
+        csv_path: str,
+        embeddings_path: str,
+        profiles: list,
+        query_count: int = 200,
+        top_k: int = 10,
+        max_points: int = None,
+        hnsw_m: int = None,
+        hnsw_ef_construct: int = None,
+        hnsw_ef: int = None,
+        encoder_backend: str = "torch",
+        keep: bool = False,
+        seed: int = 0
+    ):
+    embeddings = np.load(embeddings_path, mmap_mode = "r")
+    if max_points:
+        embeddings = embeddings[:max_points]
+    df = load_snapshot(csv_path).frame(stop = len(embeddings))
+
+    # Questions shaped like the ones the chatbot sends, about facts that are in the collection
+    encoder = load_encoder(embedding_model, backend = encoder_backend)
+    queries = build_queries(df.sample(n = min(query_count, len(df)), random_state = seed))
+    query_embeddings = normalize(encoder.encode(queries))
+    start_time = time.perf_counter()
+    truth = exact_top_k(query_embeddings, embeddings, top_k)
+    print(f"Exact float32 top-{top_k} for {len(queries)} queries over {len(embeddings)} points in {time.perf_counter() - start_time:.2f}s")
+
+    # Ingestion of a large collection needs more than the chatbot's per-call deadline
+    transport = QdrantTransport(timeout = 120)
+    results = {}
+    for profile in profiles:
+        name = f"FinDeep_eval_{profile}"
+        upload_time = create_eval_collection(transport, name, profile, embeddings, hnsw_m, hnsw_ef_construct)
+        info, index_time = wait_until_indexed(transport.client, name)
+        stats = {
+            "points": info.points_count,
+            "upload_sec": upload_time,
+            "index_sec": index_time,
+            # estimated_ram_mb / estimated_disk_mb: computed from the profile, not read from Qdrant
+            **{
+                f"{key.replace('_bytes', '')}_mb": value / 2**20
+                for key, value in estimate_memory(profile, len(embeddings), embeddings.shape[1], hnsw_m).items()
+            },
+            **evaluate_profile(transport, name, profile, query_embeddings, truth, top_k, hnsw_ef)
+        }
+        results[profile] = stats
+        print(profile, json.dumps(stats, indent = 2))
+        if not keep:
+            transport.client.delete_collection(name)
+    transport.close()
+    return results
+
+def recommend(results: dict, top_k: int, min_recall: float):
+    # Cheapest profile (by estimated RAM) that still finds the exact neighbours often enough
+    eligible = [profile for profile, stats in results.items() if stats[f"recall@{top_k}"] >= min_recall]
+    if not eligible:
+        return None
+    return min(eligible, key = lambda profile: (results[profile]["estimated_ram_mb"], results[profile]["latency_ms_p95"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Recall, latency and estimated memory of the FinDeep collection profiles against exact float32 search")
+    parser.add_argument("--model", default = "sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--csv", default = "data_setup/sources/FinDeep_data (cleaned).csv")
+    parser.add_argument("--embeddings", default = "data_setup/sources/financial_embeddings.npy")
+    parser.add_argument("--profiles", nargs = "+", default = list(COLLECTION_PROFILES), choices = list(COLLECTION_PROFILES))
+    parser.add_argument("--queries", type = int, default = 200)
+    parser.add_argument("--top-k", type = int, default = 10)
+    parser.add_argument("--max-points", type = int, default = None, help = "Only the first N embeddings")
+    parser.add_argument("--hnsw-m", type = int, default = None)
+    parser.add_argument("--hnsw-ef-construct", type = int, default = None)
+    parser.add_argument("--hnsw-ef", type = int, default = None, help = "Search-time ef")
+    parser.add_argument("--encoder-backend", default = "torch", choices = ENCODER_BACKENDS)
+    parser.add_argument("--min-recall", type = float, default = 0.95)
+    parser.add_argument("--keep", action = "store_true", help = "Keep the FinDeep_eval_* collections")
+    parser.add_argument("--output", default = None, help = "Optional JSON file for the results")
+    args = parser.parse_args()
+
+    results = run_eval(
+        args.model,
+        args.csv,
+        args.embeddings,
+        args.profiles,
+        query_count = args.queries,
+        top_k = args.top_k,
+        max_points = args.max_points,
+        hnsw_m = args.hnsw_m,
+        hnsw_ef_construct = args.hnsw_ef_construct,
+        hnsw_ef = args.hnsw_ef,
+        encoder_backend = args.encoder_backend,
+        keep = args.keep
+    )
+    choice = recommend(results, args.top_k, args.min_recall)
+    print(f"Cheapest profile (by estimated RAM) with recall@{args.top_k} >= {args.min_recall}: {choice}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "recommended": choice}, f, indent = 2)
@@ -0,0 +1,111 @@
+from FinDeep_backend.pipeline.utils.encoder import Encoder, ENCODER_BACKENDS
+from FinDeep_backend.pipeline.constant.prompt import QDRANT_RETRIEVAL_PROMPT
+from FinDeep_backend.data_setup.miniLM_embeddings import create_prompt_text
+from FinDeep_backend.pipeline.store.snapshot import load_snapshot
+
+import json, time, argparse
+import numpy as np
+
+def normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype = np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis = 1, keepdims = True)
+
+def build_queries(df):
+    # Queries shaped like the ones QdrantRetrieval sends: a filled-in prompt with only a few fields set
+    return [
+        QDRANT_RETRIEVAL_PROMPT.format(
+            start = "", end = "", value = "", accn = "", form = "",
+            fp = row["fp"], fy = row["fy"], metric = row["metric"],
+            CIK = "", CompanyName = row["CompanyName"]
+        )
+        for row in df.to_dict("records")
+    ]
+
+def benchmark_backend(encoder, documents, queries, batch_size):
+    start_time = time.perf_counter()
+    document_embeddings = encoder.encode(documents, batch_size = batch_size)
+    throughput = len(documents) / (time.perf_counter() - start_time)
+
+    latencies = []
+    query_embeddings = []
+    for query in queries:
+        start_time = time.perf_counter()
+        query_embeddings.append(encoder.encode(query))
+        latencies.append((time.perf_counter() - start_time) * 1e3)
+
+    return normalize(document_embeddings), normalize(query_embeddings), {
+        "throughput_docs_per_sec": throughput,
+        "query_latency_ms_p50": float(np.percentile(latencies, 50)),
+        "query_latency_ms_p95": float(np.percentile(latencies, 95))
+    }
+
+def parity(baseline, candidate, top_k):
+    base_documents, base_queries = baseline
+    documents, queries = candidate
+    cosine = np.sum(base_documents * documents, axis = 1)
+    base_top = np.argsort(-(base_queries @ base_documents.T), axis = 1)[:, :top_k]
+    top = np.argsort(-(queries @ documents.T), axis = 1)[:, :top_k]
+    recall = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(base_top, top)])
+    return {
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        f"recall@{top_k}": float(recall)
+    }
+
+def run_benchmark(
+        embedding_model: str,
+        csv_path: str,
+        backends: list,
+        sample_size: int = 2000,
+        query_count: int = 200,
+        batch_size: int = 64,
+        num_threads: int = None,
+        top_k: int = 10
+    ):
+    df = load_snapshot(csv_path).frame()
+    df = df.sample(n = min(sample_size, len(df)), random_state = 0)
+    documents = create_prompt_text(df).tolist()
+    queries = build_queries(df.head(query_count))
+
+    results = {}
+    baseline = None
+    for backend in ["torch"] + [b for b in backends if b != "torch"]:
+        start_time = time.perf_counter()
+        encoder = Encoder(embedding_model, backend = backend, num_threads = num_threads)
+        load_time = time.perf_counter() - start_time
+        document_embeddings, query_embeddings, stats = benchmark_backend(encoder, documents, queries, batch_size)
+        stats["load_time_sec"] = load_time
+        if baseline is None:
+            baseline = (document_embeddings, query_embeddings)
+        stats.update(parity(baseline, (document_embeddings, query_embeddings), top_k))
+        results[backend] = stats
+        print(backend, json.dumps(stats, indent = 2))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Throughput, latency and parity of the encoder backends")
+    parser.add_argument("--model", default = "sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--csv", default = "data_setup/sources/FinDeep_data (cleaned).csv")
+    parser.add_argument("--backends", nargs = "+", default = ENCODER_BACKENDS, choices = ENCODER_BACKENDS)
+    parser.add_argument("--sample-size", type = int, default = 2000)
+    parser.add_argument("--queries", type = int, default = 200)
+    parser.add_argument("--batch-size", type = int, default = 64)
+    parser.add_argument("--threads", type = int, default = None)
+    parser.add_argument("--top-k", type = int, default = 10)
+    parser.add_argument("--output", default = None, help = "Optional JSON file for the results")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        args.model,
+        args.csv,
+        args.backends,
+        sample_size = args.sample_size,
+        query_count = args.queries,
+        batch_size = args.batch_size,
+        num_threads = args.threads,
+        top_k = args.top_k
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
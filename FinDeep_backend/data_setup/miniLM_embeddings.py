@@ -1,31 +1,93 @@
-import os, uuid, pytz, torch
-import pandas as pd
+from FinDeep_backend.pipeline.utils.encoder import Encoder
+from FinDeep_backend.pipeline.store.snapshot import load_snapshot
+from FinDeep_backend.pipeline.utils.qdrant_transport import QdrantTransport
+from FinDeep_backend.pipeline.utils.collection_profiles import collection_config, get_profile
+from FinDeep_backend.pipeline.utils.cache import GenerationMarker
+
+import os, uuid, json, time, contextlib, urllib.request, torch
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from dotenv import load_dotenv
 load_dotenv()
 
+PROMPT_KEYS = [
+    "start",
+    "end",
+    "value",
+    "accn",
+    "fp",
+    "fy",
+    "form",
+    "metric",
+    "CIK",
+    "CompanyName"
+]
+
+def create_prompt_text(df):
+    # "start:...,end:...,CompanyName:..." built column-wise instead of row by row
+    prompt_text = f"{PROMPT_KEYS[0]}:" + df[PROMPT_KEYS[0]].astype(str)
+    for key in PROMPT_KEYS[1:]:
+        prompt_text = prompt_text + f",{key}:" + df[key].astype(str)
+    return prompt_text
+
 class MiniLM_Embeddings:
     def __init__(
             self, 
             embedding_model: str, 
             csv_path: str,
-            save_path: str
+            save_path: str,
+            upload_batch_size: int = 256,
+            upload_workers: int = 4,
+            streaming: bool = False,
+            chunk_size: int = 10000,
+            encode_batch_size: int = 64,
+            incremental: bool = False,
+            encoder_backend: str = "torch",
+            encoder_threads: int = None,
+            transport: QdrantTransport = None,
+            collection_profile: str = None,
+            hnsw_m: int = None,
+            hnsw_ef_construct: int = None
         ):
+        # The CSV (or its .arrow snapshot); all reads go through the memory-mapped snapshot
         self.__csv_path = csv_path
         self.__save_path = save_path
+        self.__upload_batch_size = upload_batch_size
+        self.__upload_workers = upload_workers
+        self.__upload_checkpoint_path = f"{save_path}.upload.json"
+        self.__streaming = streaming
+        self.__chunk_size = chunk_size
+        self.__encode_batch_size = encode_batch_size
+        self.__embed_checkpoint_path = f"{save_path}.embed.json"
+        self.__manifest_path = f"{save_path}.manifest.json"
+        # Watched by every chatbot worker on this host (FINDEEP_CACHE_GENERATION_PATH defaults to the same file)
+        self.__generation_path = os.getenv("FINDEEP_CACHE_GENERATION_PATH", f"{save_path}.generation")
+        self.__incremental = incremental
+        # Vector storage layout (quantization, on-disk storage) and HNSW build parameters of a new collection
+        self.__collection_profile = get_profile(collection_profile)
+        self.__hnsw_m = hnsw_m
+        self.__hnsw_ef_construct = hnsw_ef_construct
         self.__hashed_namespace = uuid.UUID(os.getenv("UUID_NAMESPACE"))
 
         self.__device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.__model = SentenceTransformer(embedding_model)
-        self.__model.to(self.__device)
-        print(f"Using device: {self.__device}")
+        self.__model = Encoder(
+            embedding_model,
+            backend = encoder_backend,
+            num_threads = encoder_threads,
+            device = str(self.__device) if encoder_backend == "torch" else None
+        )
+        print(f"Using device: {self.__device if encoder_backend == 'torch' else 'cpu'}")
 
         self.__collection_name = "FinDeep"
+        self.__natural_keys = [
+            "accn",
+            "metric",
+            "start",
+            "end",
+            "CIK"
+        ]
         self.__collection_keys_str = [
             "start", 
             "end",
@@ -33,40 +95,89 @@ class MiniLM_Embeddings:
             "fp",
             "form", 
             "metric",
+            "CIK",
             "CompanyName"
         ]
         self.__collection_keys_int = [
             "value",
-            "fy",
-            "CIK"
+            "fy"
         ]
-        self.__qdrant_client = QdrantClient(
-            url = os.getenv("QDRANT_URL"),
-            api_key = os.getenv("QDRANT_API_KEY")
-        )
+        self.__prompt_keys = PROMPT_KEYS
+        # Same QDRANT_* client settings as the chatbot; upserts and deletes go through its retries.
+        # A transport passed in belongs to the caller and is left open
+        self.__owns_transport = transport is None
+        self.__transport = transport or QdrantTransport()
+        self.__qdrant_client = self.__transport.client
     
+    def __create_prompt_text(self, df):
+        return create_prompt_text(df)
+
     def __create_embeddings(self):
-        def create_prompt_text(row):
-            return (
-                f"start:{row['start']},"
-                f"end:{row['end']},"
-                f"value:{row['value']},"
-                f"accn:{row['accn']},"
-                f"fp:{row['fp']},"
-                f"fy:{row['fy']},"
-                f"form:{row['form']},"
-                f"metric:{row['metric']},"
-                f"CIK:{row['CIK']},"
-                f"CompanyName:{row['CompanyName']}"
-            )
-        
-        df = pd.read_csv(self.__csv_path)
-        df['prompt_text'] = df.apply(create_prompt_text, axis=1)
-        documents = df['prompt_text'].tolist()
-        embeddings = self.__model.encode(documents)
+        df = load_snapshot(self.__csv_path).frame()
+        documents = self.__create_prompt_text(df).tolist()
+        embeddings = self.__model.encode(documents, batch_size = self.__encode_batch_size)
         np.save(self.__save_path, embeddings)
 
-    def __data_upload(self):
+    def __create_embeddings_streaming(self):
+        # Fixed-memory variant: snapshot slices are encoded and written straight into a preallocated .npy
+        snapshot = load_snapshot(self.__csv_path)
+        total = len(snapshot)
+        dimension = self.__model.get_sentence_embedding_dimension()
+
+        rows_done = 0
+        if os.path.exists(self.__embed_checkpoint_path) and os.path.exists(self.__save_path):
+            with open(self.__embed_checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if checkpoint["total"] == total and checkpoint["chunk_size"] == self.__chunk_size:
+                rows_done = checkpoint["rows_done"]
+            else:
+                print("Embedding checkpoint does not match the current data, starting over")
+
+        if rows_done:
+            embeddings = np.load(self.__save_path, mmap_mode = "r+")
+            print(f"Resuming embeddings from row {rows_done}/{total}")
+        else:
+            embeddings = np.lib.format.open_memmap(
+                self.__save_path,
+                mode = "w+",
+                dtype = np.float32,
+                shape = (total, dimension)
+            )
+
+        start_time = time.time()
+        position = rows_done
+        for lo in range(rows_done, total, self.__chunk_size):
+            chunk = snapshot.frame(start = lo, stop = lo + self.__chunk_size)
+            documents = self.__create_prompt_text(chunk).tolist()
+            embeddings[position:position + len(documents)] = self.__model.encode(
+                documents,
+                batch_size = self.__encode_batch_size,
+                convert_to_numpy = True
+            )
+            position += len(documents)
+            embeddings.flush()
+            self.__save_embed_checkpoint(total, position)
+            elapsed = time.time() - start_time
+            print(f"Embedded {position}/{total} rows ({(position - rows_done) / max(elapsed, 1e-9):.1f} rows/sec)")
+
+        del embeddings
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.__embed_checkpoint_path)
+
+    def __save_embed_checkpoint(self, total, rows_done):
+        tmp_path = f"{self.__embed_checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "total": total,
+                    "chunk_size": self.__chunk_size,
+                    "rows_done": rows_done
+                },
+                f
+            )
+        os.replace(tmp_path, self.__embed_checkpoint_path)
+
+    def __create_collection(self):
         def __create_payload_index_str(key):
             self.__qdrant_client.create_payload_index(
                 collection_name = self.__collection_name,
@@ -84,15 +195,17 @@ class MiniLM_Embeddings:
         # Qdrant collection setup
         try:
             if self.__qdrant_client.get_collection(self.__collection_name):
+                # The profile only applies when the collection is created; recreate it to switch
                 print(f"Collection {self.__collection_name} already exists")
         except Exception as e:
-            collection_config = models.VectorParams(
-                size = 384, # vector dimension
-                distance = models.Distance.COSINE
-            )
             self.__qdrant_client.create_collection(
                 collection_name = self.__collection_name,
-                vectors_config = collection_config
+                **collection_config(
+                    self.__collection_profile,
+                    self.__model.get_sentence_embedding_dimension(),
+                    hnsw_m = self.__hnsw_m,
+                    hnsw_ef_construct = self.__hnsw_ef_construct
+                )
             )
 
             for key in self.__collection_keys_str:
@@ -100,34 +213,230 @@ class MiniLM_Embeddings:
             for key in self.__collection_keys_int:
                 __create_payload_index_int(key)
             
-            print(f"Created collection {self.__collection_name}")
+            print(f"Created collection {self.__collection_name} ({self.__collection_profile})")
+
+    def __upsert_points(self, ids, vectors, records, positions):
+        self.__transport.call(
+            "upsert",
+            collection_name = self.__collection_name,
+            points = models.Batch(
+                ids = ids,
+                vectors = np.asarray(vectors, dtype = np.float32).tolist(),
+                payloads = [
+                    {"metadata": record, "position": position}
+                    for position, record in zip(positions, records)
+                ]
+            ),
+            wait = True
+        )
+
+    def __data_upload(self):
+        self.__create_collection()
 
         # Start uploading
-        embeddings_list = np.load(self.__save_path)
+        embeddings_list = np.load(self.__save_path, mmap_mode = "r")
         print("Shape of embeddings_list:", embeddings_list.shape)
-        points = []
-        df = pd.read_csv(self.__csv_path)
-        for i in range(embeddings_list.shape[0]):
-            vector = embeddings_list[i]
-            unique_id = str(datetime.now(pytz.utc))
-            hashed_id = str(uuid.uuid5(self.__hashed_namespace, unique_id))
-            points = models.PointStruct(
-                    id = hashed_id,
-                    vector = vector.tolist(),
-                    payload = {
-                        "metadata": df.iloc[i].to_dict(),
-                        "position": i
-                    }  # Store entire row
-                )
-            self.__qdrant_client.upsert(
+        snapshot = load_snapshot(self.__csv_path)
+
+        total = embeddings_list.shape[0]
+        batches = range((total + self.__upload_batch_size - 1) // self.__upload_batch_size)
+        completed = self.__load_upload_checkpoint(total)
+        pending = [b for b in batches if b not in completed]
+        print(f"Uploading {total} rows in {len(batches)} batches ({len(completed)} already done)")
+
+        def upload_batch(batch):
+            lo = batch * self.__upload_batch_size
+            hi = min(lo + self.__upload_batch_size, total)
+            # Point ids and payloads of this batch only, never of the whole table
+            self.__upsert_points(
+                self.__create_point_ids(snapshot.frame(columns = self.__prompt_keys, start = lo, stop = hi)),
+                embeddings_list[lo:hi],
+                snapshot.records(range(lo, hi)),
+                range(lo, hi)
+            )
+            return batch, hi - lo
+
+        start_time = time.time()
+        uploaded = 0
+        with ThreadPoolExecutor(max_workers = self.__upload_workers) as pool:
+            futures = [pool.submit(upload_batch, batch) for batch in pending]
+            for future in as_completed(futures):
+                batch, rows = future.result()
+                completed.add(batch)
+                uploaded += rows
+                self.__save_upload_checkpoint(total, completed)
+                elapsed = time.time() - start_time
+                print(f"Uploaded {uploaded} rows ({uploaded / max(elapsed, 1e-9):.1f} rows/sec)")
+
+        # Nothing was pending (e.g. an interrupted run had already uploaded every batch), so none was written
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.__upload_checkpoint_path)
+        manifest = {}
+        for _, chunk in self.__slices(snapshot):
+            manifest.update(zip(self.__create_natural_keys(chunk), self.__create_point_ids(chunk)))
+        self.__save_manifest(manifest)
+        print(f"Upload finished in {time.time() - start_time:.2f}s")
+
+    def __sync(self):
+        # Incremental re-index: only rows whose content changed since the last manifest are embedded and upserted
+        self.__create_collection()
+        start_time = time.time()
+        snapshot = load_snapshot(self.__csv_path)
+        manifest = self.__load_manifest()
+
+        def upload_batch(batch, ids, positions):
+            embeddings = self.__model.encode(
+                self.__create_prompt_text(batch).tolist(),
+                batch_size = self.__encode_batch_size
+            )
+            self.__upsert_points(ids, embeddings, snapshot.records(positions), positions)
+            return len(positions)
+
+        # One snapshot slice at a time: keys, point ids and the changed rows' upserts never span the whole table
+        current = {}
+        stale_ids = []
+        changed_rows = 0
+        with ThreadPoolExecutor(max_workers = self.__upload_workers) as pool:
+            for lo, chunk in self.__slices(snapshot):
+                natural_keys = self.__create_natural_keys(chunk)
+                point_ids = self.__create_point_ids(chunk)
+                current.update(zip(natural_keys, point_ids))
+                changed = [
+                    i for i, (key, point_id) in enumerate(zip(natural_keys, point_ids))
+                    if manifest.get(key) != point_id
+                ]
+                stale_ids += [manifest[natural_keys[i]] for i in changed if natural_keys[i] in manifest]
+                changed_rows += len(changed)
+                futures = [
+                    pool.submit(
+                        upload_batch,
+                        chunk.iloc[rows],
+                        [point_ids[i] for i in rows],
+                        [lo + i for i in rows]
+                    )
+                    for rows in (changed[b:b + self.__upload_batch_size] for b in range(0, len(changed), self.__upload_batch_size))
+                ]
+                for future in as_completed(futures):
+                    future.result()
+        stale_ids += [point_id for key, point_id in manifest.items() if key not in current]
+        print(f"Sync: {changed_rows} new or changed rows, {len(stale_ids)} stale points, {len(snapshot) - changed_rows} unchanged")
+
+        for lo in range(0, len(stale_ids), self.__upload_batch_size):
+            self.__transport.call(
+                "delete",
                 collection_name = self.__collection_name,
-                points=[points]
+                points_selector = models.PointIdsList(points = stale_ids[lo:lo + self.__upload_batch_size]),
+                wait = True
+            )
+
+        self.__save_manifest(current)
+        print(f"Sync finished in {time.time() - start_time:.2f}s")
+
+    def __slices(self, snapshot):
+        # (first row, DataFrame) of the key columns, chunk_size rows at a time
+        for lo in range(0, len(snapshot), self.__chunk_size):
+            yield lo, snapshot.frame(columns = self.__prompt_keys, start = lo, stop = lo + self.__chunk_size)
+
+    def __create_natural_keys(self, df):
+        natural_keys = df[self.__natural_keys[0]].astype(str)
+        for key in self.__natural_keys[1:]:
+            natural_keys = natural_keys + "|" + df[key].astype(str)
+        return natural_keys.tolist()
+
+    def __load_manifest(self):
+        if not os.path.exists(self.__manifest_path):
+            return {}
+        with open(self.__manifest_path) as f:
+            return json.load(f)
+
+    def __save_manifest(self, manifest):
+        tmp_path = f"{self.__manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.__manifest_path)
+
+    def __create_point_ids(self, df):
+        # Same row content -> same UUID, so re-runs overwrite points instead of duplicating them
+        content = df[self.__prompt_keys[0]].astype(str)
+        for key in self.__prompt_keys[1:]:
+            content = content + "|" + df[key].astype(str)
+        return [str(uuid.uuid5(self.__hashed_namespace, row)) for row in content]
+
+    def __load_upload_checkpoint(self, total):
+        if not os.path.exists(self.__upload_checkpoint_path):
+            return set()
+        with open(self.__upload_checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint["total"] != total or checkpoint["batch_size"] != self.__upload_batch_size:
+            print("Upload checkpoint does not match the current data, starting over")
+            return set()
+        return set(checkpoint["completed"])
+
+    def __save_upload_checkpoint(self, total, completed):
+        tmp_path = f"{self.__upload_checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "total": total,
+                    "batch_size": self.__upload_batch_size,
+                    "completed": sorted(completed)
+                },
+                f
+            )
+        os.replace(tmp_path, self.__upload_checkpoint_path)
+
+    def __invalidate_chatbot_cache(self):
+        # Tell the running chatbot that cached search results are stale: workers on this host watch the
+        # generation file, a chatbot elsewhere is reached through its /cache/invalidate endpoint
+        try:
+            GenerationMarker(self.__generation_path).bump()
+        except OSError as e:
+            print(f"[WARNING] Could not bump {self.__generation_path}: {e}")
+        invalidate_url = os.getenv("FINDEEP_CACHE_INVALIDATE_URL")
+        if not invalidate_url:
+            return
+        try:
+            request = urllib.request.Request(
+                invalidate_url,
+                method = "POST",
+                headers = {"X-Admin-Token": os.getenv("CACHE_INVALIDATE_TOKEN", "")}
             )
-        self.__qdrant_client.close()
+            urllib.request.urlopen(request, timeout = 5)
+            print("Invalidated chatbot retrieval cache")
+        except Exception as e:
+            print(f"[WARNING] Could not invalidate chatbot cache: {e}")
+
+    def __can_resume_upload(self):
+        # An interrupted upload left its checkpoint next to a fully written .npy of the current data:
+        # embedding again would only reproduce the same vectors
+        if not os.path.exists(self.__upload_checkpoint_path) or not os.path.exists(self.__save_path):
+            return False
+        if os.path.exists(self.__embed_checkpoint_path):
+            # The streaming embedder had not finished this file
+            return False
+        total = len(load_snapshot(self.__csv_path))
+        try:
+            rows = np.load(self.__save_path, mmap_mode = "r").shape[0]
+        except (OSError, ValueError):
+            return False
+        return rows == total and bool(self.__load_upload_checkpoint(total))
 
     def executor(self):
-        self.__create_embeddings()
-        self.__data_upload()
+        try:
+            if self.__incremental and os.path.exists(self.__manifest_path):
+                self.__sync()
+            else:
+                if self.__can_resume_upload():
+                    print(f"Reusing {self.__save_path} and resuming the interrupted upload")
+                elif self.__streaming:
+                    self.__create_embeddings_streaming()
+                else:
+                    self.__create_embeddings()
+                self.__data_upload()
+        finally:
+            if self.__owns_transport:
+                self.__transport.close()
+        self.__invalidate_chatbot_cache()
 
 
 if __name__ == "__main__":
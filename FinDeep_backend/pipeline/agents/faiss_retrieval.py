@@ -0,0 +1,195 @@
+from FinDeep_backend.pipeline.agents.vector_retrieval import VectorRetrieval
+from FinDeep_backend.pipeline.store.snapshot import load_snapshot, CATEGORICAL_COLUMNS
+from FinDeep_backend.pipeline.utils.metrics import timed, SEARCH_LATENCY
+
+import os
+import numpy as np
+import pandas as pd
+import faiss
+from qdrant_client.http import models
+
+class FaissRetrieval(VectorRetrieval):
+    retrieval_path = "faiss"
+
+    def __init__(
+            self,
+            embedding_model,
+            csv_path: str,
+            embeddings_path: str,
+            index_path: str = None,
+            index_type: str = "flat",
+            nlist: int = 256,
+            nprobe: int = 16,
+            fact_store = None,
+            time_series_store = None,
+            encode_workers: int = 2,
+            embedding_cache_size: int = 4096,
+            result_cache_size: int = 1024,
+            result_cache_ttl: float = 300,
+            min_top_k: int = 10,
+            default_top_k: int = 100,
+            max_top_k: int = 1000,
+            exact_search_limit: int = 20000,
+            encoder_backend: str = "torch",
+            encoder_threads: int = None,
+            generation_marker = None
+        ):
+        super().__init__(
+            embedding_model,
+            fact_store = fact_store,
+            time_series_store = time_series_store,
+            encode_workers = encode_workers,
+            embedding_cache_size = embedding_cache_size,
+            result_cache_size = result_cache_size,
+            result_cache_ttl = result_cache_ttl,
+            min_top_k = min_top_k,
+            default_top_k = default_top_k,
+            max_top_k = max_top_k,
+            encoder_backend = encoder_backend,
+            encoder_threads = encoder_threads,
+            generation_marker = generation_marker
+        )
+        self.__bitmap_keys = ["CIK", "CompanyName", "metric", "fy", "fp", "form"]
+        self.__nprobe = nprobe
+        # Filters this narrow are scored exactly against the memory-mapped vectors instead of through the index
+        self.__exact_search_limit = exact_search_limit
+
+        self.__snapshot = load_snapshot(csv_path)
+        self.__accn = self.__snapshot.column("accn").astype(str)
+        self.__value = self.__snapshot.column("value")
+
+        self.__embeddings = np.load(embeddings_path, mmap_mode = "r")
+        if self.__embeddings.shape[0] != len(self.__snapshot):
+            raise ValueError(f"{embeddings_path} has {self.__embeddings.shape[0]} rows, {csv_path} has {len(self.__snapshot)}")
+        self.__index = self.__load_index(index_path, index_type, nlist)
+
+        # One packed bitmap per distinct value of each filterable column
+        self.__size = len(self.__snapshot)
+        self.__bitmaps = {}
+        for key in self.__bitmap_keys:
+            if key in CATEGORICAL_COLUMNS:
+                codes, categories = self.__snapshot.codes(key)
+            else:
+                codes, categories = pd.factorize(self.__snapshot.column(key))
+            self.__bitmaps[key] = {
+                str(category): np.packbits(codes == code, bitorder = "little")
+                for code, category in enumerate(categories)
+            }
+        print(f"FaissRetrieval ready: {self.__index.ntotal} vectors, {index_type} index")
+
+    def __load_index(self, index_path, index_type, nlist):
+        if index_path and os.path.exists(index_path):
+            index = faiss.read_index(index_path)
+            if index.ntotal == self.__embeddings.shape[0]:
+                return index
+            print(f"{index_path} is stale, rebuilding")
+
+        dimension = self.__embeddings.shape[1]
+        if index_type == "ivf":
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+            sample = self.__embeddings[np.random.default_rng(0).choice(
+                self.__embeddings.shape[0], size = min(self.__embeddings.shape[0], nlist * 64), replace = False
+            )]
+            index.train(self.__normalize(sample))
+        else:
+            index = faiss.IndexFlatIP(dimension)
+
+        # Cosine similarity, like the Qdrant collection: inner product over L2-normalized vectors
+        for lo in range(0, self.__embeddings.shape[0], 65536):
+            index.add(self.__normalize(self.__embeddings[lo:lo + 65536]))
+        if index_path:
+            faiss.write_index(index, index_path)
+        return index
+
+    @staticmethod
+    def __normalize(vectors):
+        vectors = np.array(vectors, dtype = np.float32, ndmin = 2)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def __candidates(self, filter_dict: dict):
+        # None means unfiltered; otherwise the row ids passing every filter
+        bitmap = None
+        for key in self.__bitmap_keys:
+            if filter_dict.get(key, "") == "":
+                continue
+            value_bitmap = self.__bitmaps[key].get(str(filter_dict[key]))
+            if value_bitmap is None:
+                return np.empty(0, dtype = np.int64)
+            bitmap = value_bitmap if bitmap is None else np.bitwise_and(bitmap, value_bitmap)
+
+        if bitmap is None and filter_dict.get("accn", "") == "" and filter_dict.get("value", "") == "":
+            return None
+        if bitmap is None:
+            rows = np.arange(self.__size)
+        else:
+            rows = np.flatnonzero(np.unpackbits(bitmap, count = self.__size, bitorder = "little"))
+        if filter_dict.get("accn", "") != "":
+            rows = rows[self.__accn[rows] == filter_dict["accn"]]
+        if filter_dict.get("value", "") != "":
+            rows = rows[self.__value[rows] == float(filter_dict["value"])]
+        return rows
+
+    def __search(self, embedded_query, filter_dict: dict, top_k: int, offset: int):
+        query = self.__normalize(embedded_query)
+        rows = self.__candidates(filter_dict)
+        if rows is not None and len(rows) == 0:
+            return []
+        if top_k is None:
+            top_k = self._choose_top_k(None if rows is None else len(rows))
+        limit = top_k + offset
+
+        if rows is not None and len(rows) <= self.__exact_search_limit:
+            scores = self.__normalize(self.__embeddings[rows]) @ query[0]
+            order = np.argsort(-scores)[offset:limit]
+            hits = zip(rows[order], scores[order])
+        else:
+            params = None
+            if rows is not None:
+                mask = np.zeros(self.__size, dtype = bool)
+                mask[rows] = True
+                # Keep the packed bitmap referenced while FAISS reads it through the raw pointer
+                bitmap = np.packbits(mask, bitorder = "little")
+                params = faiss.SearchParametersIVF() if isinstance(self.__index, faiss.IndexIVF) else faiss.SearchParameters()
+                params.sel = faiss.IDSelectorBitmap(self.__size, faiss.swig_ptr(bitmap))
+            elif isinstance(self.__index, faiss.IndexIVF):
+                params = faiss.SearchParametersIVF()
+            if isinstance(params, faiss.SearchParametersIVF):
+                params.nprobe = self.__nprobe
+            scores, ids = self.__index.search(query, limit, params = params)
+            hits = [(row, score) for row, score in zip(ids[0][offset:], scores[0][offset:]) if row >= 0]
+
+        hits = list(hits)
+        records = self.__snapshot.records([row for row, _ in hits])
+        return [
+            models.ScoredPoint(
+                id = int(row),
+                version = 0,
+                score = float(score),
+                payload = {
+                    "metadata": metadata,
+                    "position": int(row)
+                }
+            )
+            for (row, score), metadata in zip(hits, records)
+        ]
+
+    def __timed_search(self, embedded_query, filter_dict: dict, top_k: int, offset: int):
+        with timed(SEARCH_LATENCY, "faiss", key = "search_ms"):
+            return self.__search(embedded_query, filter_dict, top_k, offset)
+
+    def _retrieve(self, query, filter_dict: dict, top_k: int, offset: int):
+        return self.__timed_search(self._encode(query), filter_dict, top_k, offset)
+
+    async def _aretrieve(self, query, filter_dict: dict, top_k: int, offset: int):
+        # Scoring and index.search are CPU-bound like encoding, so they also run off the event loop
+        embedded_query = await self._aencode(query)
+        with timed(SEARCH_LATENCY, "faiss", key = "search_ms"):
+            return await self._run_blocking(self.__search, embedded_query, filter_dict, top_k, offset)
+
+    async def _asearch_batch(self, pending: list, embeddings: dict):
+        with timed(SEARCH_LATENCY, "faiss_batch"):
+            return await self._run_blocking(
+                lambda: [self.__search(embeddings[query], filter_dict, None, 0) for query, filter_dict in pending]
+            )
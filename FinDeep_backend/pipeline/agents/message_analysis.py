@@ -1,5 +1,9 @@
-from FinDeep_backend.pipeline.constant.schema import GraphState, FinancialSchema
+from FinDeep_backend.pipeline.constant.schema import GraphState, FinancialSchema, FinancialQueries
 from FinDeep_backend.pipeline.constant.prompt import MESSAGE_ANALYSIS_PROMPT
+from FinDeep_backend.pipeline.utils.metrics import timed, record, record_llm_usage, NODE_LATENCY, LLM_LATENCY, ANALYSIS_PATH
+from FinDeep_backend.pipeline.utils.single_flight import SingleFlight, normalize_message
+from FinDeep_backend.pipeline.utils.llm_scheduler import LLMScheduler, usage_tokens
+from FinDeep_backend.pipeline.utils.context_builder import count_tokens
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -7,19 +11,81 @@ load_dotenv()
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_core.runnables import Runnable
+import time
 
 class MessageAnalysis(Runnable):
-    def __init__(self, model_name: str, temperature:int = 0):
-        self.__llm = ChatOpenAI(model = model_name, temperature = temperature).with_structured_output(FinancialSchema)
+    def __init__(
+            self,
+            model_name: str,
+            temperature:int = 0,
+            entity_extractor = None,
+            chat_model = None,
+            max_sub_queries: int = 16,
+            llm_scheduler = None,
+            completion_tokens: int = 256
+        ):
+        # chat_model replaces ChatOpenAI, e.g. with the offline stub used by pipeline/benchmark.py.
+        # The client does not retry 429s itself: the scheduler backs off within the request deadline
+        self.__chat_model = chat_model or ChatOpenAI(model = model_name, temperature = temperature, max_retries = 0)
+        # include_raw keeps the AIMessage around so its token usage can be recorded
+        self.__llm = self.__chat_model.with_structured_output(FinancialQueries, include_raw = True)
         self.__message_analysis_prompt = MESSAGE_ANALYSIS_PROMPT
+        self.__entity_extractor = entity_extractor
+        self.__max_sub_queries = max_sub_queries
+        # Concurrent LLM extractions of the same (normalized) message share one call
+        self.__single_flight = SingleFlight("message_analysis")
+        # Rate limits, priority queue and deadlines shared with the other LLM-calling nodes
+        self.__scheduler = llm_scheduler or LLMScheduler()
+        self.__completion_tokens = completion_tokens
 
-    def invoke(self, state: GraphState, config = None):
-        prompt = [
+    async def awarm_up(self):
+        # Opens the pooled HTTPS connection to the LLM provider without spending tokens
+        try:
+            await self.__chat_model.root_async_client.models.list()
+        except Exception as e:
+            print(f"[MessageAnalysis] warm-up could not reach the LLM provider: {e}")
+
+    def coalesce_stats(self):
+        return self.__single_flight.stats()
+
+    def __extract_with_rules(self, state: GraphState):
+        # Closed-vocabulary extraction; the LLM call is skipped when it is confident enough
+        if self.__entity_extractor is None:
+            return None
+        start_time = time.perf_counter()
+        response, confidence = self.__entity_extractor.extract_all(state.user_message, self.__max_sub_queries)
+        elapsed = (time.perf_counter() - start_time) * 1e3
+        if not self.__entity_extractor.is_confident(confidence):
+            print(f"[MessageAnalysis] rules: confidence {confidence:.2f} in {elapsed:.2f}ms, falling back to LLM")
+            return None
+        print(f"[MessageAnalysis] rules: confidence {confidence:.2f} in {elapsed:.2f}ms")
+        state.analysis_path = "rules"
+        return response
+
+    def __build_prompt(self, state: GraphState):
+        return [
             SystemMessage(content = self.__message_analysis_prompt),
             HumanMessage(content = f"USER MESSAGE: {state.user_message}")
         ]
-        response = self.__llm.invoke(prompt)
-            
+
+    def __estimate_tokens(self, prompt: list):
+        return sum(count_tokens(message.content) for message in prompt) + self.__completion_tokens
+
+    def __update_state(self, state: GraphState, queries: list):
+        # Duplicate sub-queries would only repeat the same retrieval
+        queries = list({tuple(query.model_dump().items()): query for query in queries}.values())
+        queries = queries[:self.__max_sub_queries] or [FinancialSchema(
+            start = "", end = "", value = "", accn = "", fp = "", fy = "",
+            form = "", metric = "", cik = "", companyname = ""
+        )]
+        # Several companies/metrics/periods fan out to one retrieval branch each
+        state.sub_queries = queries if len(queries) > 1 else []
+        state.branch_results = None
+        # The top-level fields keep what all sub-queries agree on, blank where they differ
+        response = FinancialSchema(**{
+            key: value if all(getattr(query, key) == value for query in queries) else ""
+            for key, value in queries[0].model_dump().items()
+        })
         state.start = response.start
         state.end = response.end
         state.value = response.value
@@ -30,4 +96,61 @@ class MessageAnalysis(Runnable):
         state.metric = response.metric
         state.cik = response.cik
         state.companyname = response.companyname
-        return state
\ No newline at end of file
+        return state
+
+    def __parse_llm_response(self, response: dict):
+        record_llm_usage("message_analysis", response["raw"])
+        if response["parsed"] is None:
+            raise response["parsing_error"] or ValueError("LLM returned no FinancialQueries")
+        return response["parsed"].queries
+
+    async def __aextract_with_llm(self, state: GraphState):
+        prompt = self.__build_prompt(state)
+
+        async def call():
+            with timed(LLM_LATENCY, "message_analysis", key = "message_analysis_llm_ms"):
+                return await self.__llm.ainvoke(prompt)
+
+        async def extract():
+            response = await self.__scheduler.run(
+                "message_analysis", call,
+                estimated_tokens = self.__estimate_tokens(prompt),
+                usage = lambda response: usage_tokens(response["raw"])
+            )
+            return self.__parse_llm_response(response)
+        return await self.__single_flight.run(normalize_message(state.user_message), extract)
+
+    def __record_path(self, state: GraphState):
+        ANALYSIS_PATH.inc(state.analysis_path)
+        record("analysis_path", state.analysis_path)
+
+    def invoke(self, state: GraphState, config = None):
+        with timed(NODE_LATENCY, "message_analysis", key = "message_analysis_ms"):
+            response = self.__extract_with_rules(state)
+            if response is None:
+                prompt = self.__build_prompt(state)
+
+                def call():
+                    with timed(LLM_LATENCY, "message_analysis", key = "message_analysis_llm_ms"):
+                        return self.__llm.invoke(prompt)
+                response = self.__parse_llm_response(self.__scheduler.run_sync(
+                    "message_analysis", call,
+                    estimated_tokens = self.__estimate_tokens(prompt),
+                    usage = lambda response: usage_tokens(response["raw"])
+                ))
+                state.analysis_path = "llm"
+            self.__record_path(state)
+            state = self.__update_state(state, response)
+            record("sub_queries", len(state.sub_queries))
+            return state
+
+    async def ainvoke(self, state: GraphState, config = None, **kwargs):
+        with timed(NODE_LATENCY, "message_analysis", key = "message_analysis_ms"):
+            response = self.__extract_with_rules(state)
+            if response is None:
+                response = await self.__aextract_with_llm(state)
+                state.analysis_path = "llm"
+            self.__record_path(state)
+            state = self.__update_state(state, response)
+            record("sub_queries", len(state.sub_queries))
+            return state
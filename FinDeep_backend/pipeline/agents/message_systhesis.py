@@ -1,5 +1,9 @@
 from FinDeep_backend.pipeline.constant.schema import GraphState
-from FinDeep_backend.pipeline.constant.prompt import MESSAGE_SYNTHESIS_PROMPT
+from FinDeep_backend.pipeline.constant.prompt import MESSAGE_SYNTHESIS_PROMPT, RETRIEVAL_UNAVAILABLE_ANSWER
+from FinDeep_backend.pipeline.utils.context_builder import ContextBuilder, count_tokens
+from FinDeep_backend.pipeline.utils.metrics import timed, record, record_llm_usage, NODE_LATENCY, LLM_LATENCY
+from FinDeep_backend.pipeline.utils.single_flight import SingleFlight
+from FinDeep_backend.pipeline.utils.llm_scheduler import LLMScheduler, usage_tokens
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -9,19 +13,98 @@ from langchain_core.runnables import Runnable
 from langchain_core.messages import HumanMessage, AIMessage
 
 class MessageSynthesis(Runnable):
-    def __init__(self, model_name:str, temperature:int = 0):
-        self.__llm = ChatOpenAI(model = model_name, temperature = temperature)
+    def __init__(
+            self,
+            model_name:str,
+            temperature:int = 0,
+            context_token_budget:int = 4000,
+            chat_model = None,
+            llm_scheduler = None,
+            completion_tokens:int = 512
+        ):
+        # stream_usage keeps token counts available when the reply is streamed over /chat/stream;
+        # 429s are retried by the scheduler, not by the client
+        self.__llm = chat_model or ChatOpenAI(model = model_name, temperature = temperature, stream_usage = True, max_retries = 0)
         self.__message_synthesis_prompt = MESSAGE_SYNTHESIS_PROMPT
+        self.__context_builder = ContextBuilder(token_budget = context_token_budget)
+        # Concurrent requests that render the same prompt (same question, same data) share one LLM call
+        self.__single_flight = SingleFlight("message_synthesis")
+        self.__scheduler = llm_scheduler or LLMScheduler()
+        self.__completion_tokens = completion_tokens
 
-    def invoke(self, state:GraphState, config = None):
-        data = []
-        for i in state.retrieved_data:
-            data.append(i.payload["metadata"])
-        prompt = self.__message_synthesis_prompt.format(
+    async def awarm_up(self):
+        try:
+            await self.__llm.root_async_client.models.list()
+        except Exception as e:
+            print(f"[MessageSynthesis] warm-up could not reach the LLM provider: {e}")
+
+    def coalesce_stats(self):
+        return self.__single_flight.stats()
+
+    def __build_prompt(self, state:GraphState):
+        data, stats = self.__context_builder.build(
+            state.retrieved_data,
+            fy = state.fy,
+            fp = state.fp,
+            trend_series = state.trend_series
+        )
+        print(
+            f"[MessageSynthesis] context: {stats['rows_used']}/{stats['rows_in']} rows, "
+            f"{stats['trend_series']} trend series, {stats['context_tokens']} tokens ({stats['tokens_saved']} saved)"
+        )
+        record("context_rows", stats["rows_used"])
+        record("context_tokens", stats["context_tokens"])
+        return self.__message_synthesis_prompt.format(
             user_message = state.user_message,
             data = data
         )
-        response = self.__llm.invoke(prompt)
+
+    @staticmethod
+    def __unavailable(state:GraphState):
+        # Vector store down and nothing precomputed to answer from: a fixed reply, no LLM call
+        return state.retrieval_path == "degraded" and not state.retrieved_data and not state.trend_series
+
+    def __update_state(self, state:GraphState, content:str):
         state.chat_history.append(HumanMessage(content = state.user_message))
-        state.chat_history.append(AIMessage(content = response.content))
-        return state
\ No newline at end of file
+        state.chat_history.append(AIMessage(content = content))
+        return state
+
+    def invoke(self, state:GraphState, config = None):
+        with timed(NODE_LATENCY, "message_synthesis", key = "message_synthesis_ms"):
+            if self.__unavailable(state):
+                return self.__update_state(state, RETRIEVAL_UNAVAILABLE_ANSWER.strip())
+            prompt = self.__build_prompt(state)
+
+            def call():
+                with timed(LLM_LATENCY, "message_synthesis", key = "message_synthesis_llm_ms"):
+                    return self.__llm.invoke(prompt)
+            response = self.__scheduler.run_sync(
+                "message_synthesis", call,
+                estimated_tokens = count_tokens(prompt) + self.__completion_tokens,
+                usage = usage_tokens
+            )
+            record_llm_usage("message_synthesis", response)
+            return self.__update_state(state, response.content)
+
+    async def ainvoke(self, state:GraphState, config = None, **kwargs):
+        with timed(NODE_LATENCY, "message_synthesis", key = "message_synthesis_ms"):
+            if self.__unavailable(state):
+                return self.__update_state(state, RETRIEVAL_UNAVAILABLE_ANSWER.strip())
+            prompt = self.__build_prompt(state)
+
+            async def call():
+                # Passing the node config through lets graph.astream(stream_mode = "messages") see the tokens;
+                # only the leader streams, followers get the finished reply
+                with timed(LLM_LATENCY, "message_synthesis", key = "message_synthesis_llm_ms"):
+                    return await self.__llm.ainvoke(prompt, config = config)
+
+            async def synthesize():
+                response = await self.__scheduler.run(
+                    "message_synthesis", call,
+                    estimated_tokens = count_tokens(prompt) + self.__completion_tokens,
+                    usage = usage_tokens
+                )
+                record_llm_usage("message_synthesis", response)
+                return response
+            response = await self.__single_flight.run(prompt, synthesize)
+            return self.__update_state(state, response.content)
@@ -1,39 +1,95 @@
-from FinDeep_backend.pipeline.constant.schema import GraphState
-from FinDeep_backend.pipeline.constant.prompt import QDRANT_RETRIEVAL_PROMPT
+from FinDeep_backend.pipeline.agents.vector_retrieval import VectorRetrieval, build_filter_dict, build_query
+from FinDeep_backend.pipeline.utils.qdrant_transport import QdrantTransport
+from FinDeep_backend.pipeline.utils.collection_profiles import search_params
+from FinDeep_backend.pipeline.utils.metrics import timed, SEARCH_LATENCY
 
 from dotenv import load_dotenv
 load_dotenv()
 
-import os
-from sentence_transformers import SentenceTransformer
-from qdrant_client import QdrantClient
+import asyncio
 from qdrant_client.http import models
-from langchain_core.runnables import Runnable
 
-class QdrantRetrieval(Runnable):
-    def __init__(self, embedding_model):
+# Filters down to one company or filing match few enough points for an exact count to be worth its round trip;
+# broader ones (a metric, a year) are searched with the default top_k straight away
+NARROW_FILTER_KEYS = ("accn", "CIK", "CompanyName")
+
+class QdrantRetrieval(VectorRetrieval):
+    retrieval_path = "qdrant"
+
+    def __init__(
+            self,
+            embedding_model,
+            fact_store = None,
+            time_series_store = None,
+            encode_workers: int = 2,
+            embedding_cache_size: int = 4096,
+            result_cache_size: int = 1024,
+            result_cache_ttl: float = 300,
+            min_top_k: int = 10,
+            default_top_k: int = 100,
+            max_top_k: int = 1000,
+            score_threshold: float = None,
+            relative_cutoff: float = None,
+            payload_fields: list = None,
+            encoder_backend: str = "torch",
+            encoder_threads: int = None,
+            generation_marker = None,
+            transport: QdrantTransport = None,
+            collection_profile: str = None,
+            hnsw_ef: int = None
+        ):
+        super().__init__(
+            embedding_model,
+            fact_store = fact_store,
+            time_series_store = time_series_store,
+            encode_workers = encode_workers,
+            embedding_cache_size = embedding_cache_size,
+            result_cache_size = result_cache_size,
+            result_cache_ttl = result_cache_ttl,
+            min_top_k = min_top_k,
+            default_top_k = default_top_k,
+            max_top_k = max_top_k,
+            encoder_backend = encoder_backend,
+            encoder_threads = encoder_threads,
+            generation_marker = generation_marker
+        )
         self.__collection_name = "FinDeep"
         self.__collection_keys = [
-            "start", 
-            "end", 
-            "value", 
-            "accn", 
-            "fp", 
-            "fy", 
-            "form", 
-            "metric", 
-            "CIK", 
+            "start",
+            "end",
+            "value",
+            "accn",
+            "fp",
+            "fy",
+            "form",
+            "metric",
+            "CIK",
             "CompanyName"
         ]
-        self.__qdrant_client = QdrantClient(
-            url = os.getenv("QDRANT_URL"),
-            api_key = os.getenv("QDRANT_API_KEY")
-        )
-        self.__model = SentenceTransformer(embedding_model)
-        self.__qdrant_retrieval_prompt = QDRANT_RETRIEVAL_PROMPT
-    
-    def __retrieve_query(self, query, filter_dict: dict, top_k: int = 1000):
-        embedded_query = self.__model.encode(query)
+        # Pooled clients with deadlines, retries, hedging and a circuit breaker (QDRANT_* settings)
+        self.__transport = transport or QdrantTransport()
+
+        # Low scores are dropped early
+        self.__score_threshold = score_threshold
+        self.__relative_cutoff = relative_cutoff
+        # Only ship the payload fields synthesis renders
+        payload_fields = payload_fields or [f"metadata.{key}" for key in self.__collection_keys] + ["position"]
+        self.__payload_selector = models.PayloadSelectorInclude(include = payload_fields)
+        # Must match the profile the collection was ingested with (QDRANT_COLLECTION_PROFILE): rescoring for quantized vectors
+        self.__search_params_config = search_params(collection_profile, hnsw_ef)
+
+    async def awarm_up(self):
+        await super().awarm_up()
+        # Opens the pooled connection so the first search does not pay for it
+        try:
+            await self.__transport.async_client.get_collection(self.__collection_name)
+        except Exception as e:
+            print(f"[QdrantRetrieval] warm-up could not reach Qdrant: {e}")
+
+    def transport_stats(self):
+        return self.__transport.stats()
+
+    def __build_query_filter(self, filter_dict: dict):
         must_conditions = []
         for key in self.__collection_keys:
             if filter_dict[key] != "":
@@ -43,57 +99,110 @@ class QdrantRetrieval(Runnable):
                         match = models.MatchValue(value = filter_dict[key])
                     )
                 )
-        
-        query_filter = models.Filter(must = must_conditions) if must_conditions else None
-        try:
-            results = self.__qdrant_client.search(
-                collection_name = self.__collection_name,
-                query_vector = embedded_query,
-                query_filter = query_filter,
-                limit = top_k,
-                with_payload = True,
-                with_vectors = False
-            )
+        return models.Filter(must = must_conditions) if must_conditions else None
+
+    def __cut_off(self, results):
+        if self.__relative_cutoff is None or not results:
             return results
-        except Exception as e:
-            print(f"[ERROR] From QdrantRetrieval: {e}")
-            exit(1)
-
-    def invoke(self, state: GraphState, config = None):
-        query = self.__qdrant_retrieval_prompt.format(
-            start = state.start,
-            end = state.end,
-            value = state.value,
-            accn = state.accn,
-            fp = state.fp,
-            fy = state.fy,
-            form = state.form,
-            metric = state.metric,
-            CIK = state.cik,
-            CompanyName = state.companyname
+        floor = results[0].score - self.__relative_cutoff
+        return [point for point in results if point.score >= floor]
+
+    def __search_params(self, embedded_query, query_filter, top_k: int, offset: int):
+        return dict(
+            collection_name = self.__collection_name,
+            query_vector = embedded_query,
+            query_filter = query_filter,
+            limit = top_k,
+            offset = offset,
+            score_threshold = self.__score_threshold,
+            search_params = self.__search_params_config,
+            with_payload = self.__payload_selector,
+            with_vectors = False
         )
-        
-        def safe_convert(value):
-            try:
-                flag = int(value)
-                return True
-            except:
-                return False
-        
-        response = self.__retrieve_query(
-            query,
-            dict (
-                start = "",
-                end = "",
-                value = int(state.value) if safe_convert(state.value) else "",
-                accn = state.accn,
-                fp = state.fp,
-                fy = int(state.fy) if safe_convert(state.fy) else "",
-                form = state.form,
-                metric = state.metric,
-                CIK = int(state.cik) if safe_convert(state.cik) else "",
-                CompanyName = state.companyname
+
+    def __count_params(self, query_filter):
+        return dict(collection_name = self.__collection_name, count_filter = query_filter, exact = True)
+
+    @staticmethod
+    def __is_narrow(filter_dict: dict):
+        return any(filter_dict.get(key, "") != "" for key in NARROW_FILTER_KEYS)
+
+    def _retrieve(self, query, filter_dict: dict, top_k: int, offset: int):
+        query_filter = self.__build_query_filter(filter_dict)
+        if top_k is None:
+            # A cheap filtered count tells us how many points can match at all
+            matching = None
+            if query_filter is not None and self.__is_narrow(filter_dict):
+                with timed(SEARCH_LATENCY, "qdrant_count", key = "count_ms"):
+                    matching = self.__transport.call("count", **self.__count_params(query_filter)).count
+            if matching == 0:
+                return []
+            top_k = self._choose_top_k(matching)
+
+        embedded_query = self._encode(query)
+        with timed(SEARCH_LATENCY, "qdrant", key = "search_ms"):
+            results = self.__transport.call(
+                "search",
+                **self.__search_params(embedded_query, query_filter, top_k, offset)
             )
-        )
-        state.retrieved_data = response
-        return state
\ No newline at end of file
+        return self.__cut_off(results)
+
+    async def _aretrieve(self, query, filter_dict: dict, top_k: int, offset: int):
+        query_filter = self.__build_query_filter(filter_dict)
+        if top_k is None:
+            matching = None
+            if query_filter is not None and self.__is_narrow(filter_dict):
+                with timed(SEARCH_LATENCY, "qdrant_count", key = "count_ms"):
+                    matching = (await self.__transport.acall("count", hedge = True, **self.__count_params(query_filter))).count
+            if matching == 0:
+                return []
+            top_k = self._choose_top_k(matching)
+
+        embedded_query = await self._aencode(query)
+        with timed(SEARCH_LATENCY, "qdrant", key = "search_ms"):
+            results = await self.__transport.acall(
+                "search",
+                hedge = True,
+                **self.__search_params(embedded_query, query_filter, top_k, offset)
+            )
+        return self.__cut_off(results)
+
+    async def _asearch_batch(self, pending: list, embeddings: dict):
+        # Concurrent counts for the narrow filters, then a single search_batch call for every query that can match at all
+        query_filters = [self.__build_query_filter(filter_dict) for _, filter_dict in pending]
+
+        async def count(query_filter, filter_dict):
+            if query_filter is None or not self.__is_narrow(filter_dict):
+                return None
+            return (await self.__transport.acall("count", hedge = True, **self.__count_params(query_filter))).count
+        matching = await asyncio.gather(*[
+            count(query_filter, filter_dict) for query_filter, (_, filter_dict) in zip(query_filters, pending)
+        ])
+
+        batch_results = [[] for _ in pending]
+        searches = [
+            (position, models.SearchRequest(
+                vector = [float(x) for x in embeddings[query]],
+                filter = query_filter,
+                limit = self._choose_top_k(matched),
+                score_threshold = self.__score_threshold,
+                params = self.__search_params_config,
+                with_payload = self.__payload_selector,
+                with_vector = False
+            ))
+            for position, ((query, _), query_filter, matched) in enumerate(zip(pending, query_filters, matching))
+            if matched != 0
+        ]
+        if not searches:
+            return batch_results
+
+        with timed(SEARCH_LATENCY, "qdrant_batch"):
+            results = await self.__transport.acall(
+                "search_batch",
+                hedge = True,
+                collection_name = self.__collection_name,
+                requests = [request for _, request in searches]
+            )
+        for (position, _), points in zip(searches, results):
+            batch_results[position] = self.__cut_off(points)
+        return batch_results
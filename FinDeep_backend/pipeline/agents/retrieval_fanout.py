@@ -0,0 +1,87 @@
+from FinDeep_backend.pipeline.constant.schema import GraphState
+from FinDeep_backend.pipeline.agents.vector_retrieval import build_filter_dict
+from FinDeep_backend.pipeline.utils.metrics import timed, record, NODE_LATENCY
+
+import asyncio
+from langgraph.types import Send
+from langchain_core.runnables import Runnable
+
+def route_retrieval(state: GraphState):
+    # Comparison questions map to one retrieval branch per sub-query, run in parallel by LangGraph
+    if state.sub_queries and len(state.sub_queries) > 1:
+        return [
+            Send("retrieval_branch", {"index": index, "query": query, "user_message": state.user_message})
+            for index, query in enumerate(state.sub_queries)
+        ]
+    return "qdrant_retrieval"
+
+def merge_points(branch_results: dict):
+    # Deduplicate by dataset row (or point id), keep the best score, best first
+    merged = {}
+    for index in sorted(branch_results):
+        for point in branch_results[index] or []:
+            payload = point.payload or {}
+            key = payload.get("position", point.id)
+            if key not in merged or merged[key].score < point.score:
+                merged[key] = point
+    return sorted(merged.values(), key = lambda point: point.score, reverse = True)
+
+class RetrievalBranch(Runnable):
+    def __init__(self, retrieval, merge_retrieval = None):
+        self.__retrieval = retrieval
+        self.__merge_retrieval = merge_retrieval or MergeRetrieval()
+
+    @staticmethod
+    def __branch_state(branch: dict):
+        return GraphState(chat_history = [], user_message = branch["user_message"], **branch["query"].model_dump())
+
+    @staticmethod
+    def __branch_result(branch: dict, state: GraphState):
+        # None marks a branch whose vector store was unavailable
+        points = None if state.retrieval_path == "degraded" else state.retrieved_data or []
+        return {"branch_results": {branch["index"]: points}}
+
+    def invoke(self, branch: dict, config = None):
+        return self.__branch_result(branch, self.__retrieval.invoke(self.__branch_state(branch)))
+
+    async def ainvoke(self, branch: dict, config = None, **kwargs):
+        return self.__branch_result(branch, await self.__retrieval.ainvoke(self.__branch_state(branch)))
+
+    async def aretrieve_all(self, state: GraphState):
+        # The same fan-out outside the graph (e.g. /chat/batch): all branches concurrently, then merged
+        branches = [
+            {"index": index, "query": query, "user_message": state.user_message}
+            for index, query in enumerate(state.sub_queries)
+        ]
+        results = await asyncio.gather(*[self.ainvoke(branch) for branch in branches])
+        state.branch_results = {k: v for result in results for k, v in result["branch_results"].items()}
+        return self.__merge_retrieval.invoke(state)
+
+class MergeRetrieval(Runnable):
+    def __init__(self, time_series_store = None):
+        self.__time_series_store = time_series_store
+
+    def __merge_trends(self, state: GraphState):
+        # One trend series per distinct company/metric across the sub-queries
+        if self.__time_series_store is None:
+            return []
+        merged = {}
+        for query in state.sub_queries or []:
+            for series in self.__time_series_store.lookup(build_filter_dict(query)):
+                merged.setdefault((series["CIK"], series["metric"]), series)
+        return list(merged.values())
+
+    def invoke(self, state: GraphState, config = None):
+        with timed(NODE_LATENCY, "merge_retrieval", key = "merge_retrieval_ms"):
+            state.retrieved_data = merge_points(state.branch_results or {})
+            state.trend_series = self.__merge_trends(state)
+            branch_results = (state.branch_results or {}).values()
+            state.retrieval_path = "degraded" if branch_results and all(points is None for points in branch_results) else "fanout"
+            # The branches already recorded retrieved_rows/trend_series; the deduplicated totals get keys of their own
+            record("retrieval_path", state.retrieval_path)
+            record("merged_rows", len(state.retrieved_data))
+            record("merged_trend_series", len(state.trend_series))
+            return state
+
+    async def ainvoke(self, state: GraphState, config = None, **kwargs):
+        return self.invoke(state, config)
@@ -0,0 +1,294 @@
+from FinDeep_backend.pipeline.constant.schema import GraphState
+from FinDeep_backend.pipeline.constant.prompt import QDRANT_RETRIEVAL_PROMPT
+from FinDeep_backend.pipeline.utils.cache import LRUCache, TTLCache, GenerationMarker
+from FinDeep_backend.pipeline.utils.encoder import load_encoder
+from FinDeep_backend.pipeline.utils.single_flight import SingleFlight
+from FinDeep_backend.pipeline.utils.metrics import (
+    timed, record, payload_bytes,
+    NODE_LATENCY, ENCODE_LATENCY, SEARCH_RESULTS, PAYLOAD_BYTES, RETRIEVAL_PATH
+)
+
+import time, asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.runnables import Runnable
+
+def build_filter_dict(state: GraphState):
+    def safe_convert(value):
+        try:
+            flag = int(value)
+            return True
+        except:
+            return False
+
+    return dict (
+        start = "",
+        end = "",
+        value = int(state.value) if safe_convert(state.value) else "",
+        accn = state.accn,
+        fp = state.fp,
+        fy = int(state.fy) if safe_convert(state.fy) else "",
+        form = state.form,
+        metric = state.metric,
+        # The dataset keeps CIKs as zero-padded 10-digit strings
+        CIK = str(int(state.cik)).zfill(10) if safe_convert(state.cik) else "",
+        CompanyName = state.companyname
+    )
+
+def build_query(state: GraphState):
+    return QDRANT_RETRIEVAL_PROMPT.format(
+        start = state.start,
+        end = state.end,
+        value = state.value,
+        accn = state.accn,
+        fp = state.fp,
+        fy = state.fy,
+        form = state.form,
+        metric = state.metric,
+        CIK = state.cik,
+        CompanyName = state.companyname
+    )
+
+class VectorRetrieval(Runnable):
+    # Everything the retrieval node does around the vector search: fact store shortcut, trend series, query
+    # encoding, result caching, single-flight and metrics. Backends only implement _retrieve / _aretrieve /
+    # _asearch_batch and name themselves through retrieval_path
+    retrieval_path = None
+
+    def __init__(
+            self,
+            embedding_model,
+            fact_store = None,
+            time_series_store = None,
+            encode_workers: int = 2,
+            embedding_cache_size: int = 4096,
+            result_cache_size: int = 1024,
+            result_cache_ttl: float = 300,
+            min_top_k: int = 10,
+            default_top_k: int = 100,
+            max_top_k: int = 1000,
+            encoder_backend: str = "torch",
+            encoder_threads: int = None,
+            generation_marker: GenerationMarker = None
+        ):
+        self.__fact_store = fact_store
+        self.__time_series_store = time_series_store
+        self._model = load_encoder(embedding_model, backend = encoder_backend, num_threads = encoder_threads)
+        # Encoding (and in-process search) is CPU-bound, so async callers run it here instead of on the event loop
+        self.__executor = ThreadPoolExecutor(max_workers = encode_workers)
+        # query text -> embedding, and (query text, filters, page) -> search results
+        self.__embedding_cache = LRUCache(max_size = embedding_cache_size)
+        self.__result_cache = TTLCache(max_size = result_cache_size, ttl = result_cache_ttl)
+        # Shared with the other workers: a re-ingest invalidated anywhere drops this worker's results too
+        self.__generation_marker = generation_marker
+        self.__generation = generation_marker.current() if generation_marker else None
+        # Concurrent misses for the same FinancialSchema (query text, filters, page) share one search
+        self.__single_flight = SingleFlight("qdrant_retrieval")
+
+        # Adaptive search: top_k follows the filtered match count
+        self._min_top_k = min_top_k
+        self._default_top_k = default_top_k
+        self._max_top_k = max_top_k
+
+    async def awarm_up(self):
+        await self._run_blocking(self._model.warm_up)
+
+    def invalidate_cache(self, embeddings: bool = False):
+        # Called after the collection is re-ingested so stale search results are not served, in every worker.
+        # Query embeddings only depend on the model, so they survive a re-ingest unless asked for
+        if self.__generation_marker is not None:
+            self.__generation = self.__generation_marker.bump()
+        self.__result_cache.clear()
+        if embeddings:
+            self.__embedding_cache.clear()
+
+    def __check_generation(self):
+        if self.__generation_marker is None:
+            return
+        generation = self.__generation_marker.current()
+        if generation != self.__generation:
+            self.__generation = generation
+            self.__result_cache.clear()
+
+    def coalesce_stats(self):
+        return self.__single_flight.stats()
+
+    def cache_stats(self):
+        return {
+            "embedding": self.__embedding_cache.stats(),
+            "result": self.__result_cache.stats()
+        }
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__executor, partial(func, *args, **kwargs))
+
+    def _choose_top_k(self, matching: int):
+        # matching is the filtered row count, or None when the query has no filters
+        if matching is None:
+            return self._default_top_k
+        return min(self._max_top_k, max(self._min_top_k, matching))
+
+    def _encode(self, query):
+        embedded_query = self.__embedding_cache.get(query)
+        record("embedding_cache_hit", embedded_query is not None)
+        if embedded_query is None:
+            with timed(ENCODE_LATENCY, self._model.backend, key = "encode_ms"):
+                embedded_query = self._model.encode(query)
+            self.__embedding_cache.put(query, embedded_query)
+        return embedded_query
+
+    async def _aencode(self, query):
+        embedded_query = self.__embedding_cache.get(query)
+        record("embedding_cache_hit", embedded_query is not None)
+        if embedded_query is None:
+            with timed(ENCODE_LATENCY, self._model.backend, key = "encode_ms"):
+                embedded_query = await self._run_blocking(self._model.encode, query)
+            self.__embedding_cache.put(query, embedded_query)
+        return embedded_query
+
+    async def __aencode_batch(self, queries: list, encode_batch_size: int):
+        embeddings = {query: self.__embedding_cache.get(query) for query in queries}
+        missing = [query for query, vector in embeddings.items() if vector is None]
+        if missing:
+            with timed(ENCODE_LATENCY, self._model.backend):
+                vectors = await self._run_blocking(self._model.encode, missing, batch_size = encode_batch_size)
+            for query, vector in zip(missing, vectors):
+                embeddings[query] = vector
+                self.__embedding_cache.put(query, vector)
+        return embeddings
+
+    def _retrieve(self, query, filter_dict: dict, top_k: int, offset: int):
+        # Backend search for one query; top_k None means "size it from the filtered match count"
+        raise NotImplementedError
+
+    async def _aretrieve(self, query, filter_dict: dict, top_k: int, offset: int):
+        raise NotImplementedError
+
+    async def _asearch_batch(self, pending: list, embeddings: dict):
+        # pending: (query, filter_dict) pairs; returns one result list per pair, in order
+        raise NotImplementedError
+
+    @staticmethod
+    def __result_key(query, filter_dict: dict, page):
+        return (query, tuple(sorted(filter_dict.items())), page)
+
+    def __retrieve_query(self, query, filter_dict: dict, top_k: int = None, offset: int = 0):
+        self.__check_generation()
+        result_key = self.__result_key(query, filter_dict, (top_k, offset))
+        results = self.__result_cache.get(result_key)
+        record("result_cache_hit", results is not None)
+        if results is None:
+            results = self._retrieve(query, filter_dict, top_k, offset)
+            self.__result_cache.put(result_key, results)
+        return results
+
+    async def __aretrieve_query(self, query, filter_dict: dict, top_k: int = None, offset: int = 0):
+        self.__check_generation()
+        result_key = self.__result_key(query, filter_dict, (top_k, offset))
+        results = self.__result_cache.get(result_key)
+        record("result_cache_hit", results is not None)
+        if results is not None:
+            return results
+
+        async def search():
+            results = await self._aretrieve(query, filter_dict, top_k, offset)
+            self.__result_cache.put(result_key, results)
+            return results
+        return await self.__single_flight.run(result_key, search)
+
+    def __search_fact_store(self, state: GraphState, filter_dict: dict):
+        # Fully specified questions are answered from the in-process fact store without an embedding or a search
+        if self.__fact_store is None:
+            return None
+        start_time = time.perf_counter()
+        response = self.__fact_store.search(filter_dict)
+        if response is not None:
+            print(f"[{type(self).__name__}] fact_store: {len(response)} rows in {(time.perf_counter() - start_time) * 1e6:.0f}us")
+            state.retrieval_path = "fact_store"
+            state.retrieved_data = response
+        return response
+
+    def __attach_trends(self, state: GraphState, filter_dict: dict):
+        # Precomputed quarterly series for the company/metric, so synthesis gets the arithmetic done already
+        state.trend_series = self.__time_series_store.lookup(filter_dict) if self.__time_series_store else []
+        record("trend_series", len(state.trend_series))
+
+    def __degrade(self, state: GraphState, error: Exception):
+        # The vector store is unreachable or failing: answer from what is left (trend series) instead of killing the worker
+        print(f"[ERROR] From {type(self).__name__}: {error}")
+        record("retrieval_error", str(error))
+        state.retrieval_path = "degraded"
+        state.retrieved_data = []
+        return state
+
+    @staticmethod
+    def __record_retrieval(state: GraphState):
+        RETRIEVAL_PATH.inc(state.retrieval_path)
+        SEARCH_RESULTS.observe(len(state.retrieved_data or []), state.retrieval_path)
+        size = payload_bytes(state.retrieved_data)
+        PAYLOAD_BYTES.observe(size, state.retrieval_path)
+        record("retrieval_path", state.retrieval_path)
+        record("retrieved_rows", len(state.retrieved_data or []))
+        record("payload_bytes", size)
+        return state
+
+    def invoke(self, state: GraphState, config = None):
+        with timed(NODE_LATENCY, "qdrant_retrieval", key = "qdrant_retrieval_ms"):
+            filter_dict = build_filter_dict(state)
+            self.__attach_trends(state, filter_dict)
+            if self.__search_fact_store(state, filter_dict) is None:
+                try:
+                    state.retrieved_data = self.__retrieve_query(build_query(state), filter_dict)
+                    state.retrieval_path = self.retrieval_path
+                except Exception as e:
+                    self.__degrade(state, e)
+            return self.__record_retrieval(state)
+
+    async def ainvoke(self, state: GraphState, config = None, **kwargs):
+        with timed(NODE_LATENCY, "qdrant_retrieval", key = "qdrant_retrieval_ms"):
+            filter_dict = build_filter_dict(state)
+            self.__attach_trends(state, filter_dict)
+            if self.__search_fact_store(state, filter_dict) is None:
+                try:
+                    state.retrieved_data = await self.__aretrieve_query(build_query(state), filter_dict)
+                    state.retrieval_path = self.retrieval_path
+                except Exception as e:
+                    self.__degrade(state, e)
+            return self.__record_retrieval(state)
+
+    async def abatch_invoke(self, states: list, encode_batch_size: int = 64):
+        # Many questions at once: one batched encode for every uncached query, then the backend's batch search
+        self.__check_generation()
+        pending = []
+        for state in states:
+            filter_dict = build_filter_dict(state)
+            self.__attach_trends(state, filter_dict)
+            if self.__search_fact_store(state, filter_dict) is not None:
+                continue
+            query = build_query(state)
+            result_key = self.__result_key(query, filter_dict, (None, 0))
+            results = self.__result_cache.get(result_key)
+            if results is not None:
+                state.retrieval_path = self.retrieval_path
+                state.retrieved_data = results
+                continue
+            pending.append((state, query, filter_dict, result_key))
+
+        if pending:
+            try:
+                embeddings = await self.__aencode_batch(list(dict.fromkeys(query for _, query, _, _ in pending)), encode_batch_size)
+                batch_results = await self._asearch_batch([(query, filter_dict) for _, query, filter_dict, _ in pending], embeddings)
+            except Exception as e:
+                for state, _, _, _ in pending:
+                    self.__degrade(state, e)
+            else:
+                for (state, _, _, result_key), results in zip(pending, batch_results):
+                    self.__result_cache.put(result_key, results)
+                    state.retrieval_path = self.retrieval_path
+                    state.retrieved_data = results
+
+        # Same path/result metrics as single invocations, so /chat/batch items show up on the dashboards
+        for state in states:
+            self.__record_retrieval(state)
+        return states
@@ -0,0 +1,430 @@
+from FinDeep_backend.pipeline.workflow import build_graph
+from FinDeep_backend.pipeline.constant.schema import FinancialSchema, FinancialQueries
+from FinDeep_backend.pipeline.utils.encoder import load_encoder, ENCODER_BACKENDS
+from FinDeep_backend.pipeline.utils.context_builder import count_tokens
+from FinDeep_backend.pipeline.utils.metrics import request_timings
+from FinDeep_backend.pipeline.utils.llm_scheduler import LLMScheduler, LLMOverloaded, TokenBucket, request_deadline, PRIORITY_BATCH
+from FinDeep_backend.pipeline.store.snapshot import load_snapshot
+from FinDeep_backend.data_setup.miniLM_embeddings import create_prompt_text
+
+import os, io, json, time, random, asyncio, argparse, tempfile, subprocess, contextlib
+import numpy as np
+from langchain_core.messages import AIMessage
+
+DEFAULT_CSV_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data_setup", "sources", "FinDeep_data (cleaned).csv"
+)
+
+# Question templates; the last one has no metric, so it misses the fact store and goes to vector search
+QUESTION_TEMPLATES = [
+    ("What was {CompanyName}'s {metric} for {fp} {fy}?", ("companyname", "metric", "fp", "fy")),
+    ("What is the {metric} of {CompanyName} in {fp} {fy}?", ("companyname", "metric", "fp", "fy")),
+    ("How has {CompanyName}'s {metric} developed?", ("companyname", "metric")),
+    ("What did {CompanyName} report for {fp} {fy}?", ("companyname", "fp", "fy"))
+]
+
+class StubRateLimitError(Exception):
+    # Looks like openai.RateLimitError to the scheduler
+    status_code = 429
+
+class StubChatModel:
+    # Deterministic stand-in for ChatOpenAI: fixed latency (plus optional seeded jitter), no network.
+    # rate_limit_rate is the share of calls answered with a 429, as a provider over its limits would
+    def __init__(self, latency: float = 0.2, jitter: float = 0.0, answers: dict = None, seed: int = 0, rate_limit_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        # user message -> FinancialSchema (or a list of them) the analysis step should "extract"
+        self.answers = answers or {}
+        self.__random = random.Random(seed)
+
+    def __delay(self):
+        return self.latency + (self.__random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+
+    def __maybe_rate_limit(self):
+        # Rejected up front, like the provider does, without the call's latency
+        if self.rate_limit_rate and self.__random.random() < self.rate_limit_rate:
+            raise StubRateLimitError("Stub rate limit exceeded")
+
+    @staticmethod
+    def __prompt_text(prompt):
+        if isinstance(prompt, str):
+            return prompt
+        return "\n".join(str(message.content) for message in prompt)
+
+    def _respond(self, prompt):
+        prompt_text = self.__prompt_text(prompt)
+        content = f"Stub answer over {prompt_text.count(chr(10)) + 1} prompt lines."
+        return AIMessage(
+            content = content,
+            usage_metadata = {
+                "input_tokens": count_tokens(prompt_text),
+                "output_tokens": count_tokens(content),
+                "total_tokens": count_tokens(prompt_text) + count_tokens(content)
+            }
+        )
+
+    def _extract(self, prompt):
+        user_message = self.__prompt_text(prompt).split("USER MESSAGE: ", 1)[-1].strip()
+        return self.answers.get(user_message) or FinancialSchema(
+            start = "", end = "", value = "", accn = "", fp = "", fy = "",
+            form = "", metric = "", cik = "", companyname = ""
+        )
+
+    def invoke(self, prompt, config = None, **kwargs):
+        self.__maybe_rate_limit()
+        time.sleep(self.__delay())
+        return self._respond(prompt)
+
+    async def ainvoke(self, prompt, config = None, **kwargs):
+        self.__maybe_rate_limit()
+        await asyncio.sleep(self.__delay())
+        return self._respond(prompt)
+
+    def with_structured_output(self, schema, include_raw: bool = False):
+        return StubStructuredOutput(self, schema, include_raw)
+
+class StubStructuredOutput:
+    def __init__(self, chat_model: StubChatModel, schema, include_raw: bool):
+        self.__chat_model = chat_model
+        self.__schema = schema
+        self.__include_raw = include_raw
+
+    def __wrap(self, prompt, raw):
+        parsed = self.__chat_model._extract(prompt)
+        if self.__schema is FinancialQueries:
+            parsed = FinancialQueries(queries = parsed if isinstance(parsed, list) else [parsed])
+        if self.__include_raw:
+            return {"raw": raw, "parsed": parsed, "parsing_error": None}
+        return parsed
+
+    def invoke(self, prompt, config = None, **kwargs):
+        return self.__wrap(prompt, self.__chat_model.invoke(prompt))
+
+    async def ainvoke(self, prompt, config = None, **kwargs):
+        return self.__wrap(prompt, await self.__chat_model.ainvoke(prompt))
+
+def build_corpus(df, size: int, seed: int = 0):
+    # (question, expected FinancialSchema) pairs drawn from the sampled rows
+    rng = random.Random(seed)
+    rows = df.to_dict("records")
+    corpus = []
+    for i in range(size):
+        row = rng.choice(rows)
+        template, fields = QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)]
+        known = {
+            "companyname": row["CompanyName"], "metric": row["metric"],
+            "fp": row["fp"], "fy": str(row["fy"])
+        }
+        schema = FinancialSchema(
+            start = "", end = "", value = "", accn = "", form = "", cik = "",
+            **{key: (known[key] if key in fields else "") for key in known}
+        )
+        corpus.append((template.format(**row), schema))
+    return corpus
+
+def percentiles(values):
+    if not values:
+        return {}
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(np.mean(values)),
+        "count": len(values)
+    }
+
+def ingest(csv_path: str, work_dir: str, sample_size: int, embedding_model: str, encoder_backend: str, seed: int):
+    df = load_snapshot(csv_path).frame()
+    df = df.sample(n = min(sample_size, len(df)), random_state = seed).reset_index(drop = True)
+    sample_path = os.path.join(work_dir, "sample.csv")
+    embeddings_path = os.path.join(work_dir, "sample_embeddings.npy")
+    df.to_csv(sample_path, index = False)
+
+    encoder = load_encoder(embedding_model, backend = encoder_backend)
+    encoder.warm_up()
+    start_time = time.perf_counter()
+    embeddings = encoder.encode(create_prompt_text(df).tolist(), batch_size = 64)
+    np.save(embeddings_path, np.asarray(embeddings, dtype = np.float32))
+    elapsed = time.perf_counter() - start_time
+    return df, sample_path, embeddings_path, {
+        "rows": len(df),
+        "seconds": elapsed,
+        "rows_per_sec": len(df) / elapsed
+    }
+
+async def node_breakdown(graph, corpus):
+    # One question at a time through the graph, collecting the per-node timings the agents record
+    breakdown = {}
+    paths = {}
+    status_codes = {}
+    for i, (question, _) in enumerate(corpus):
+        status_code = 200
+        with request_timings() as timings:
+            try:
+                await graph.ainvoke(
+                    {"user_message": question},
+                    config = {"configurable": {"thread_id": f"breakdown-{i}"}}
+                )
+            except LLMOverloaded as e:
+                # Shed or rate-limited after the retries: counted like /chat would answer it, the run goes on
+                status_code = e.status_code
+        status_codes[status_code] = status_codes.get(status_code, 0) + 1
+        for key, value in timings.items():
+            if key.endswith("_ms"):
+                breakdown.setdefault(key, []).append(value)
+            elif key.endswith("_path"):
+                paths.setdefault(key, {}).setdefault(value, 0)
+                paths[key][value] += 1
+    paths["status_codes"] = status_codes
+    return {key: percentiles(values) for key, values in breakdown.items()}, paths
+
+async def load_test(client, corpus, concurrency: int, requests: int, request_timeout: float = None):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    shed_latencies = []
+    status_codes = {}
+    errors = 0
+    headers = {"X-Request-Timeout": str(request_timeout)} if request_timeout else {}
+
+    async def one(i):
+        nonlocal errors
+        question, _ = corpus[i % len(corpus)]
+        async with semaphore:
+            start_time = time.perf_counter()
+            response = await client.post("/chat", json = {"session_id": f"c{concurrency}-{i}", "message": question}, headers = headers)
+            elapsed = (time.perf_counter() - start_time) * 1e3
+            status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+            if response.status_code != 200:
+                errors += 1
+                # Shed requests should fail fast; kept apart so they do not flatter the served latencies
+                shed_latencies.append(elapsed)
+            else:
+                latencies.append(elapsed)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    elapsed = time.perf_counter() - start_time
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "status_codes": status_codes,
+        "throughput_rps": requests / elapsed,
+        "latency_ms": percentiles(latencies),
+        "rejected_latency_ms": percentiles(shed_latencies)
+    }
+
+async def scheduler_check(service_time: float = 0.2):
+    # Offline, seconds-long check of the LLM scheduler's budgets, admission and shedding; fails with AssertionError
+    async def status(scheduler, factory, timeout: float, priority: int = 0):
+        start_time = time.perf_counter()
+        with request_deadline(timeout, priority):
+            try:
+                await scheduler.run("check", factory)
+                code = 200
+            except LLMOverloaded as e:
+                code = e.status_code
+        return code, time.perf_counter() - start_time
+
+    def sleeper(seconds: float, log: list = None, tag: str = None):
+        async def call():
+            if log is not None:
+                log.append(tag)
+            await asyncio.sleep(seconds)
+        return call
+
+    # 60/min refills one per second; a 429 pause pushes the next release back by its length
+    bucket = TokenBucket(per_minute = 60)
+    assert bucket.wait_time(60) == 0.0
+    bucket.take(60)
+    assert 0.9 < bucket.wait_time(1) <= 1.0
+    bucket.pause(2.0)
+    assert 2.9 < bucket.wait_time(1) <= 3.0
+    assert TokenBucket(per_minute = None).wait_time(1e9) == 0.0
+
+    # One slot, calls of service_time, a deadline of 2.5 calls: two fit, the rest are shed at once with a 503
+    scheduler = LLMScheduler(max_concurrency = 1)
+    await status(scheduler, sleeper(service_time), 10)
+    queued = await asyncio.gather(*[status(scheduler, sleeper(service_time), service_time * 2.5) for _ in range(4)])
+    assert [code for code, _ in queued] == [200, 200, 503, 503], queued
+    assert all(elapsed < service_time / 2 for _, elapsed in queued[2:]), queued
+
+    # Request budget spent: a 429 without waiting for it to refill
+    scheduler = LLMScheduler(requests_per_minute = 2)
+    codes = [await status(scheduler, sleeper(0), 5) for _ in range(3)]
+    assert [code for code, _ in codes] == [200, 200, 429] and codes[2][1] < 0.05, codes
+
+    # Admitted, but the call itself outlives the deadline
+    code, _ = await status(LLMScheduler(), sleeper(service_time * 2), service_time / 2)
+    assert code == 504, code
+
+    # Provider 429s are retried within the deadline; without retries they surface as a 429
+    attempts = []
+    async def flaky():
+        attempts.append(None)
+        if len(attempts) < 3:
+            raise StubRateLimitError("Stub rate limit exceeded")
+    scheduler = LLMScheduler(max_retries = 2)
+    assert (await status(scheduler, flaky, 10))[0] == 200 and scheduler.stats()["rate_limited"] == 2
+    attempts.clear()
+    assert (await status(LLMScheduler(max_retries = 0), flaky, 10))[0] == 429
+
+    # Interactive calls queued behind batch ones still run first
+    scheduler = LLMScheduler(max_concurrency = 1)
+    order = []
+    await asyncio.gather(
+        status(scheduler, sleeper(service_time / 4, order, "first"), 10),
+        *[status(scheduler, sleeper(0, order, f"batch-{i}"), 10, PRIORITY_BATCH) for i in range(2)],
+        *[status(scheduler, sleeper(0, order, f"chat-{i}"), 10) for i in range(2)]
+    )
+    assert order == ["first", "chat-0", "chat-1", "batch-0", "batch-1"], order
+    return {"ok": True, "queue_shed": [code for code, _ in queued], "rate_limit": [code for code, _ in codes], "order": order}
+
+async def run_benchmark(
+        csv_path: str = DEFAULT_CSV_PATH,
+        sample_size: int = 2000,
+        questions: int = 200,
+        concurrency_levels: list = (1, 4, 16),
+        requests_per_level: int = 100,
+        llm_latency: float = 0.2,
+        llm_jitter: float = 0.0,
+        llm_rate_limit_rate: float = 0.0,
+        llm_rpm: float = None,
+        llm_tpm: float = None,
+        llm_max_concurrency: int = None,
+        request_timeout: float = None,
+        embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2",
+        encoder_backend: str = "torch",
+        seed: int = 0
+    ):
+    import httpx
+    from FinDeep_backend.app.chatbot_api import app
+    from FinDeep_backend.app.chatbot_route import router
+
+    results = {"config": {
+        "sample_size": sample_size, "questions": questions,
+        "concurrency_levels": list(concurrency_levels), "requests_per_level": requests_per_level,
+        "llm_latency": llm_latency, "llm_jitter": llm_jitter, "llm_rate_limit_rate": llm_rate_limit_rate,
+        "llm_rpm": llm_rpm, "llm_tpm": llm_tpm, "llm_max_concurrency": llm_max_concurrency, "request_timeout": request_timeout,
+        "embedding_model": embedding_model, "encoder_backend": encoder_backend, "seed": seed
+    }}
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Agents print per request; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            df, sample_path, embeddings_path, results["ingestion"] = ingest(
+                csv_path, work_dir, sample_size, embedding_model, encoder_backend, seed
+            )
+            corpus = build_corpus(df, questions, seed)
+
+            start_time = time.perf_counter()
+            graph = build_graph(
+                embedding_model = embedding_model,
+                model_name = "stub",
+                data_path = sample_path,
+                embedding_backend = encoder_backend,
+                retrieval_backend = "faiss",
+                embeddings_path = embeddings_path,
+                chat_model = StubChatModel(
+                    latency = llm_latency, jitter = llm_jitter, answers = dict(corpus), seed = seed,
+                    rate_limit_rate = llm_rate_limit_rate
+                ),
+                llm_scheduler = LLMScheduler(
+                    requests_per_minute = llm_rpm,
+                    tokens_per_minute = llm_tpm,
+                    max_concurrency = llm_max_concurrency
+                )
+            )
+            results["graph_build_sec"] = time.perf_counter() - start_time
+
+            results["nodes_ms"], results["paths"] = await node_breakdown(graph, corpus)
+
+            # /chat through the real FastAPI app, in process; the lifespan is skipped and the graph injected
+            router.graph = graph
+            results["chat"] = []
+            transport = httpx.ASGITransport(app = app)
+            async with httpx.AsyncClient(transport = transport, base_url = "http://benchmark") as client:
+                for concurrency in concurrency_levels:
+                    graph.qdrant_retrieval.invalidate_cache(embeddings = True)
+                    results["chat"].append(await load_test(client, corpus, concurrency, requests_per_level, request_timeout))
+            results["llm_scheduler"] = graph.llm_scheduler.stats()
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd = os.path.dirname(os.path.abspath(__file__)), text = True
+        ).strip()
+    except Exception:
+        return None
+
+def compare(baseline: dict, results: dict):
+    # Relative change per concurrency level against an earlier results file
+    previous = {level["concurrency"]: level for level in baseline.get("chat", [])}
+    for level in results["chat"]:
+        before = previous.get(level["concurrency"])
+        if before is None:
+            continue
+        changes = {
+            key: (level["latency_ms"][key] - before["latency_ms"][key]) / before["latency_ms"][key] * 100
+            for key in ("p50", "p95", "p99")
+        }
+        changes["throughput_rps"] = (level["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100
+        print(f"concurrency {level['concurrency']} vs {baseline.get('commit')}: " + ", ".join(
+            f"{key} {change:+.1f}%" for key, change in changes.items()
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Offline end-to-end benchmark: stub LLM, in-process FAISS store, /chat load test")
+    parser.add_argument("--csv", default = DEFAULT_CSV_PATH)
+    parser.add_argument("--sample-size", type = int, default = 2000)
+    parser.add_argument("--questions", type = int, default = 200)
+    parser.add_argument("--concurrency", type = int, nargs = "+", default = [1, 4, 16])
+    parser.add_argument("--requests", type = int, default = 100, help = "Requests per concurrency level")
+    parser.add_argument("--llm-latency", type = float, default = 0.2, help = "Stub LLM latency in seconds")
+    parser.add_argument("--llm-jitter", type = float, default = 0.0)
+    parser.add_argument("--llm-429-rate", type = float, default = 0.0, help = "Share of stub LLM calls answered with a 429")
+    parser.add_argument("--llm-rpm", type = float, default = None, help = "Scheduler requests/min limit (default: LLM_RPM)")
+    parser.add_argument("--llm-tpm", type = float, default = None, help = "Scheduler tokens/min limit (default: LLM_TPM)")
+    parser.add_argument("--llm-max-concurrency", type = int, default = None)
+    parser.add_argument("--request-timeout", type = float, default = None, help = "X-Request-Timeout sent with every /chat request")
+    parser.add_argument("--model", default = "sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--encoder-backend", default = "torch", choices = ENCODER_BACKENDS)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--output", default = None, help = "JSON file for the results")
+    parser.add_argument("--compare", default = None, help = "Earlier results JSON to compare against")
+    parser.add_argument("--scheduler-check", action = "store_true", help = "Only run the offline LLM scheduler check")
+    args = parser.parse_args()
+
+    if args.scheduler_check:
+        print(json.dumps(asyncio.run(scheduler_check()), indent = 2))
+        raise SystemExit(0)
+
+    results = asyncio.run(run_benchmark(
+        csv_path = args.csv,
+        sample_size = args.sample_size,
+        questions = args.questions,
+        concurrency_levels = args.concurrency,
+        requests_per_level = args.requests,
+        llm_latency = args.llm_latency,
+        llm_jitter = args.llm_jitter,
+        llm_rate_limit_rate = args.llm_429_rate,
+        llm_rpm = args.llm_rpm,
+        llm_tpm = args.llm_tpm,
+        llm_max_concurrency = args.llm_max_concurrency,
+        request_timeout = args.request_timeout,
+        embedding_model = args.model,
+        encoder_backend = args.encoder_backend,
+        seed = args.seed
+    ))
+    results["commit"] = git_commit()
+    results["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    print(json.dumps(results, indent = 2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
@@ -1,9 +1,10 @@
 MESSAGE_ANALYSIS_PROMPT = """
 You are a helpful financial assistant AI. 
-Your task is to extract financial data from the USER MESSAGE and return a single valid JSON object.
+Your task is to extract financial data from the USER MESSAGE and return a single valid JSON object with one key, "queries": a list of query objects.
+Return one query object per company, metric and period the user asks about. For example, "Compare Amazon and CVS net income for Q1 and Q2 2025" needs four: Amazon Q1, Amazon Q2, CVS Q1 and CVS Q2. A question about a single company, metric and period needs exactly one.
 
 ### OUTPUT SCHEMA
-The JSON object must contain exactly 8 keys with these exact names and casing. Each key is explained below:
+Each query object must contain exactly 8 keys with these exact names and casing. Each key is explained below:
 - start: The beginning date provided by the user.
 - end: The end date provided by the user.
 - value: The numeric financial value for the metric.
@@ -18,6 +19,7 @@ The JSON object must contain exactly 8 keys with these exact names and casing. E
 ### STRICT RULES
 1. Only extract information explicitly present in USER_MESSAGE. If a value is missing, set it to an empty string.
 2. Do not invent, infer, or guess any values.
+3. Do not list the same company, metric and period twice.
 """
 
 QDRANT_RETRIEVAL_PROMPT = """
@@ -38,7 +40,11 @@ You are a smart chatbot.
 Your task is to generate an answer strictly based on the provided DATA.
 Do not add extra information or go off-topic.
 First, directly answer the USER MESSAGE based only on the provided DATA. Then, analyze the market trend. Make sure your analysis is strictly relevant to the details mentioned in the user's message.
+When DATA contains a quarterly trend table, use its quarterly values and the precomputed qoq/yoy changes (qoq_pct and yoy_pct are fractions) for the trend analysis instead of computing them yourself; values marked * were derived from year-to-date figures.
 
 USER MESSAGE: {user_message}
 DATA: {data}
-"""
\ No newline at end of file
+"""
+RETRIEVAL_UNAVAILABLE_ANSWER = """
+The financial data service is temporarily unavailable, so I can't look up the filings for this question right now. Please try again in a moment.
+"""
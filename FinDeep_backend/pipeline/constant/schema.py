@@ -3,10 +3,24 @@ from pydantic import BaseModel
 from langchain_core.messages import AnyMessage
 from langgraph.graph.message import add_messages
 
+def merge_branch_results(left: Optional[Dict[int, List[Any]]], right: Optional[Dict[int, List[Any]]]):
+    # Fan-out retrieval branches write {branch index: points}; None clears the results of the previous turn.
+    # Keyed merge, so nodes that hand back the whole state re-write the same entries harmlessly
+    if right is None:
+        return {}
+    return {**(left or {}), **right}
+
 class GraphState(BaseModel):
     chat_history: Annotated[List[AnyMessage], add_messages]
     user_message: str = ""
     retrieved_data: Optional[List[Any]] = None
+    retrieval_path: Optional[str] = ""
+    # Precomputed quarterly series ({CIK, CompanyName, metric, points}) for the companies/metrics in the question
+    trend_series: Optional[List[Dict[str, Any]]] = None
+    analysis_path: Optional[str] = ""
+    # One FinancialSchema per company/metric/period of a comparison question; empty for a single lookup
+    sub_queries: Optional[List["FinancialSchema"]] = None
+    branch_results: Annotated[Optional[Dict[int, List[Any]]], merge_branch_results] = {}
     # Financial Schema
     start: Optional[str] = ""
     end: Optional[str] = ""
@@ -29,4 +43,9 @@ class FinancialSchema(BaseModel):
     form: str
     metric: str
     cik: str
-    companyname: str
\ No newline at end of file
+    companyname: str
+
+class FinancialQueries(BaseModel):
+    queries: List[FinancialSchema]
+
+GraphState.model_rebuild()
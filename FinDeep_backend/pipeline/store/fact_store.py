@@ -0,0 +1,90 @@
+from FinDeep_backend.pipeline.store.snapshot import load_snapshot, CATEGORICAL_COLUMNS
+
+import numpy as np
+import pandas as pd
+from qdrant_client.http import models
+
+class FactStore:
+    def __init__(self, csv_path: str, max_rows: int = 50):
+        self.__max_rows = max_rows
+        self.__index_keys = [
+            "CIK",
+            "CompanyName",
+            "metric",
+            "fy",
+            "fp",
+            "form"
+        ]
+        self.__company_keys = ["CIK", "CompanyName"]
+
+        # Memory-mapped snapshot; payload dicts are only built for the rows a lookup returns
+        self.__snapshot = load_snapshot(csv_path)
+        self.__accn = np.char.lower(np.char.strip(self.__snapshot.column("accn").astype(str)))
+        self.__value = self.__snapshot.column("value")
+
+        # Dictionary-encode each indexed column and keep one sorted row-id array per distinct value
+        self.__indexes = {}
+        for key in self.__index_keys:
+            if key in CATEGORICAL_COLUMNS:
+                codes, categories = self.__snapshot.codes(key)
+            else:
+                codes, categories = pd.factorize(self.__snapshot.column(key))
+            order = np.argsort(codes, kind = "stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+            self.__indexes[key] = {
+                self.__normalize(category): order[bounds[code]:bounds[code + 1]]
+                for code, category in enumerate(categories)
+            }
+        print(f"FactStore loaded {len(self.__snapshot)} rows")
+
+    @staticmethod
+    def __normalize(value):
+        return str(value).strip().lower()
+
+    def lookup(self, filter_dict: dict):
+        # None means "not selective enough", the caller should fall back to vector search
+        given = {
+            key: self.__normalize(value)
+            for key, value in filter_dict.items()
+            if value != "" and value is not None
+        }
+        if "metric" not in given or not any(key in given for key in self.__company_keys):
+            return None
+
+        postings = []
+        for key in self.__index_keys:
+            if key in given:
+                rows = self.__indexes[key].get(given[key])
+                if rows is None:
+                    return None
+                postings.append(rows)
+
+        postings.sort(key = len)
+        rows = postings[0]
+        for other in postings[1:]:
+            rows = np.intersect1d(rows, other, assume_unique = True)
+        if "accn" in given:
+            rows = rows[self.__accn[rows] == given["accn"]]
+        if "value" in given:
+            rows = rows[self.__value[rows] == float(filter_dict["value"])]
+
+        if len(rows) == 0 or len(rows) > self.__max_rows:
+            return None
+        return rows
+
+    def search(self, filter_dict: dict):
+        rows = self.lookup(filter_dict)
+        if rows is None:
+            return None
+        return [
+            models.ScoredPoint(
+                id = int(row),
+                version = 0,
+                score = 1.0,
+                payload = {
+                    "metadata": metadata,
+                    "position": int(row)
+                }
+            )
+            for row, metadata in zip(rows, self.__snapshot.records(rows))
+        ]
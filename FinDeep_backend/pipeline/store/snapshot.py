@@ -0,0 +1,158 @@
+import os, time, uuid, argparse, threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pc
+
+# Dataset columns in CSV order; every consumer gets exactly these back
+DATA_COLUMNS = ["start", "end", "value", "accn", "fy", "fp", "form", "metric", "CIK", "CompanyName"]
+# Low-cardinality columns stored as dictionary (categorical) arrays
+CATEGORICAL_COLUMNS = ["fp", "form", "metric", "CIK", "CompanyName"]
+
+# Explicit CSV dtypes: no inference, so CIK keeps its zero padding ("0001018724") and value is always float
+CSV_DTYPES = {
+    "start": str,
+    "end": str,
+    "value": np.float64,
+    "accn": str,
+    "fy": np.int16,
+    "fp": str,
+    "form": str,
+    "metric": str,
+    "CIK": str,
+    "CompanyName": str
+}
+
+SNAPSHOT_SCHEMA = pa.schema(
+    [
+        pa.field(column, pa.dictionary(pa.int32(), pa.string()))
+        if column in CATEGORICAL_COLUMNS
+        else pa.field(column, {"value": pa.float64(), "fy": pa.int16()}.get(column, pa.string()))
+        for column in DATA_COLUMNS
+    ]
+    # Hash of the row content, for change detection without re-reading the text columns
+    + [pa.field("row_hash", pa.uint64())]
+)
+
+def snapshot_path_for(csv_path: str):
+    return os.path.splitext(csv_path)[0] + ".arrow"
+
+class _DictionaryBuilder:
+    # One dictionary grown across record batches: every batch's dictionary extends the previous one,
+    # so the IPC writer emits deltas instead of (unsupported) replacements
+    def __init__(self):
+        self.__codes = {}
+        self.__values = []
+
+    def encode(self, array):
+        encoded = pc.dictionary_encode(array)
+        remap = []
+        for value in encoded.dictionary.to_pylist():
+            if value not in self.__codes:
+                self.__codes[value] = len(self.__values)
+                self.__values.append(value)
+            remap.append(self.__codes[value])
+        indices = pc.take(pa.array(remap, type = pa.int32()), encoded.indices)
+        return pa.DictionaryArray.from_arrays(indices, pa.array(self.__values, type = pa.string()))
+
+def write_snapshot(csv_path: str, snapshot_path: str = None, block_size: int = 16 * 2**20):
+    # One-time CSV -> Arrow IPC conversion; uncompressed so it can be memory-mapped and read zero-copy.
+    # The CSV is streamed one block at a time, so peak memory does not grow with the dataset
+    snapshot_path = snapshot_path or snapshot_path_for(csv_path)
+    start_time = time.perf_counter()
+    reader = pa_csv.open_csv(
+        csv_path,
+        read_options = pa_csv.ReadOptions(block_size = block_size),
+        convert_options = pa_csv.ConvertOptions(
+            column_types = {column: SNAPSHOT_SCHEMA.field(column).type for column in DATA_COLUMNS if column not in CATEGORICAL_COLUMNS}
+            | {column: pa.string() for column in CATEGORICAL_COLUMNS},
+            include_columns = DATA_COLUMNS,
+            strings_can_be_null = True
+        )
+    )
+    dictionaries = {column: _DictionaryBuilder() for column in CATEGORICAL_COLUMNS}
+
+    # Unique per process: workers that find the snapshot missing at the same time do not write into each other's file
+    tmp_path = f"{snapshot_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    num_rows = 0
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(
+            sink, SNAPSHOT_SCHEMA, options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas = True)
+        ) as writer:
+            for batch in reader:
+                # Row-wise hash, so hashing each batch gives the same values as hashing the whole table
+                row_hash = pd.util.hash_pandas_object(batch.to_pandas()[DATA_COLUMNS], index = False).to_numpy(dtype = np.uint64)
+                arrays = []
+                for field in SNAPSHOT_SCHEMA:
+                    if field.name == "row_hash":
+                        arrays.append(pa.array(row_hash, type = pa.uint64()))
+                    elif field.name in CATEGORICAL_COLUMNS:
+                        arrays.append(dictionaries[field.name].encode(batch.column(field.name)))
+                    else:
+                        arrays.append(batch.column(field.name))
+                writer.write_batch(pa.record_batch(arrays, schema = SNAPSHOT_SCHEMA))
+                num_rows += batch.num_rows
+        os.replace(tmp_path, snapshot_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    print(
+        f"Snapshot {snapshot_path}: {num_rows} rows, {os.path.getsize(snapshot_path) / 2**20:.1f}MB "
+        f"(CSV {os.path.getsize(csv_path) / 2**20:.1f}MB) in {time.perf_counter() - start_time:.2f}s"
+    )
+    return snapshot_path
+
+class DatasetSnapshot:
+    def __init__(self, snapshot_path: str):
+        self.path = snapshot_path
+        # Memory-mapped: pages are read on demand and shared between processes
+        self.table = pa.ipc.open_file(pa.memory_map(snapshot_path, "r")).read_all()
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def frame(self, columns: list = None, start: int = 0, stop: int = None):
+        # Rows [start, stop) as a DataFrame; categorical columns come back as pandas Categorical
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self.table.slice(start, max(stop - start, 0)).select(columns or DATA_COLUMNS).to_pandas()
+
+    def records(self, rows):
+        # Payload dicts for the given row ids, built on demand instead of holding every row as a dict
+        return self.table.select(DATA_COLUMNS).take(pa.array(np.asarray(rows, dtype = np.int64))).to_pylist()
+
+    def column(self, column: str):
+        return self.table.column(column).to_numpy()
+
+    def codes(self, column: str):
+        # (integer codes, categories) of a dictionary column, without decoding the strings per row
+        chunked = self.table.column(column).unify_dictionaries()
+        categories = chunked.chunk(0).dictionary.to_pylist() if chunked.num_chunks else []
+        codes = np.concatenate([chunk.indices.to_numpy(zero_copy_only = False) for chunk in chunked.chunks]) \
+            if chunked.num_chunks else np.empty(0, dtype = np.int32)
+        return codes, categories
+
+# One mapping per snapshot file and process, shared by every consumer
+_SNAPSHOTS = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+
+def load_snapshot(path: str):
+    # Accepts the snapshot itself or the source CSV; a missing or outdated snapshot is (re)built first
+    if not path.endswith(".arrow"):
+        snapshot_path = snapshot_path_for(path)
+        if not os.path.exists(snapshot_path) or os.path.getmtime(snapshot_path) < os.path.getmtime(path):
+            write_snapshot(path, snapshot_path)
+        path = snapshot_path
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    with _SNAPSHOTS_LOCK:
+        if key not in _SNAPSHOTS:
+            _SNAPSHOTS[key] = DatasetSnapshot(path)
+        return _SNAPSHOTS[key]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Convert the dataset CSV into a memory-mappable Arrow snapshot")
+    parser.add_argument("csv", nargs = "?", default = "data_setup/sources/FinDeep_data (cleaned).csv")
+    parser.add_argument("--output", default = None, help = "Snapshot path (default: next to the CSV, .arrow)")
+    args = parser.parse_args()
+    write_snapshot(args.csv, args.output)
@@ -0,0 +1,141 @@
+from FinDeep_backend.pipeline.store.snapshot import load_snapshot
+
+from datetime import date, timedelta
+
+# A period of at most this many days is a discrete quarter; anything longer is year-to-date
+QUARTER_MAX_DAYS = 100
+# Gaps between period ends that count as "previous quarter" and "same quarter last year"
+QOQ_GAP_DAYS = (80, 100)
+YOY_GAP_DAYS = (350, 380)
+
+class TimeSeriesStore:
+    def __init__(self, csv_path: str, max_series: int = 8):
+        self.__max_series = max_series
+        self.__series = {}
+        self.__by_company = {}
+        self.__companies = {}
+
+        df = load_snapshot(csv_path).frame(columns = ["start", "end", "value", "accn", "fy", "fp", "metric", "CIK", "CompanyName"])
+        # A period reported in several filings keeps the latest filing's value
+        df = df.sort_values("accn").drop_duplicates(["CIK", "metric", "start", "end"], keep = "last")
+        groups = {}
+        for row in df.astype({"CIK": str, "metric": str, "CompanyName": str}).to_dict("records"):
+            groups.setdefault((row["CIK"], row["metric"]), []).append(row)
+        for (cik, metric), rows in groups.items():
+            company_name = rows[0]["CompanyName"]
+            self.__companies.setdefault(self.__normalize(cik), cik)
+            self.__companies.setdefault(self.__normalize(company_name), cik)
+            series = {
+                "CIK": cik,
+                "CompanyName": company_name,
+                "metric": metric,
+                "points": self.__build_points(rows)
+            }
+            self.__series[(cik, metric)] = series
+            self.__by_company.setdefault(cik, []).append(series)
+        print(f"TimeSeriesStore loaded {len(self.__series)} series")
+
+    @staticmethod
+    def __normalize(value):
+        return str(value).strip().lower()
+
+    @staticmethod
+    def __quarter_number(fp: str):
+        try:
+            return int(str(fp).lstrip("Q"))
+        except ValueError:
+            return None
+
+    def __build_points(self, rows):
+        quarters = {}
+        ytd = {}
+        for row in rows:
+            start, end = date.fromisoformat(row["start"]), date.fromisoformat(row["end"])
+            if (end - start).days <= QUARTER_MAX_DAYS:
+                quarters[end] = dict(start = start, value = float(row["value"]), fy = int(row["fy"]), fp = row["fp"], source = "reported")
+            # Grouped by start date; the group starting at the fiscal year start holds the YTD figures (Q1 included)
+            ytd.setdefault(start, {})[end] = (float(row["value"]), int(row["fy"]), row["fp"])
+
+        # Only periods running from the start of a fiscal year (a Q1 or a longer period) are cumulative
+        ytd = {
+            start: cumulative for start, cumulative in ytd.items()
+            if any((end - start).days > QUARTER_MAX_DAYS or fp == "Q1" for end, (_, _, fp) in cumulative.items())
+        }
+
+        for fiscal_start, cumulative in ytd.items():
+            ends = sorted(cumulative)
+            # Q(n) = YTD(n) - YTD(n-1)
+            for previous_end, end in zip(ends, ends[1:]):
+                value, fy, fp = cumulative[end]
+                if end not in quarters:
+                    quarters[end] = dict(
+                        start = previous_end + timedelta(days = 1),
+                        value = value - cumulative[previous_end][0],
+                        fy = fy, fp = fp, source = "derived"
+                    )
+            # Q(n-1) = YTD(n) - Q(n), when only the longer period and the last quarter were reported
+            for end in ends:
+                quarter = quarters.get(end)
+                if quarter is None or quarter["start"] == fiscal_start:
+                    continue
+                previous_end = quarter["start"] - timedelta(days = 1)
+                number = self.__quarter_number(quarter["fp"])
+                if previous_end in quarters or (previous_end - fiscal_start).days > QUARTER_MAX_DAYS:
+                    continue
+                value, fy, fp = cumulative[end]
+                quarters[previous_end] = dict(
+                    start = fiscal_start,
+                    value = value - quarter["value"],
+                    fy = fy, fp = f"Q{number - 1}" if number and number > 1 else fp, source = "derived"
+                )
+
+        # Year-to-date value at each quarter end, reported where available
+        ytd_at = {end: value for cumulative in ytd.values() for end, (value, _, _) in cumulative.items()}
+        points = []
+        for end in sorted(quarters):
+            quarter = quarters[end]
+            points.append(dict(
+                fy = quarter["fy"],
+                fp = quarter["fp"],
+                start = quarter["start"].isoformat(),
+                end = end.isoformat(),
+                value = quarter["value"],
+                # A first quarter is its own year-to-date value
+                ytd = ytd_at.get(end, quarter["value"] if quarter["start"] in ytd else None),
+                source = quarter["source"]
+            ))
+        self.__add_deltas(points)
+        return points
+
+    @staticmethod
+    def __add_deltas(points):
+        ends = [date.fromisoformat(point["end"]) for point in points]
+        for i, point in enumerate(points):
+            for name, (low, high) in (("qoq", QOQ_GAP_DAYS), ("yoy", YOY_GAP_DAYS)):
+                previous = next(
+                    (points[j] for j in range(i - 1, -1, -1) if low <= (ends[i] - ends[j]).days <= high),
+                    None
+                )
+                delta = point["value"] - previous["value"] if previous else None
+                point[name] = delta
+                point[f"{name}_pct"] = round(delta / abs(previous["value"]), 4) if previous and previous["value"] else None
+
+    def series(self, cik: str, metric: str):
+        return self.__series.get((str(cik), str(metric)))
+
+    def lookup(self, filter_dict: dict):
+        # Trend series for the company (CIK or name) in the question, one per metric; [] when it is not specific enough
+        cik = None
+        for key in ("CIK", "CompanyName"):
+            value = filter_dict.get(key)
+            if value != "" and value is not None:
+                cik = self.__companies.get(self.__normalize(value))
+                if cik is not None:
+                    break
+        if cik is None:
+            return []
+        metric = filter_dict.get("metric")
+        if metric:
+            found = self.series(cik, metric)
+            return [found] if found else []
+        return self.__by_company.get(cik, [])[:self.__max_series]
@@ -0,0 +1,97 @@
+import os, time, threading
+from collections import OrderedDict
+
+class LRUCache:
+    def __init__(self, max_size: int = 1024):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last = False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _expired(self, entry):
+        return False
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+class TTLCache(LRUCache):
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        super().__init__(max_size = max_size)
+        self._ttl = ttl
+
+    def _expired(self, entry):
+        return time.monotonic() - entry[1] > self._ttl
+
+    def stats(self):
+        return {**super().stats(), "ttl": self._ttl}
+
+class GenerationMarker:
+    # A token in a file shared by every worker on the host and by the ingestion job. Bumping it tells every
+    # process that its cached results are stale; readers look at the file at most once per check_interval
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._generation = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    def current(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at >= self._check_interval:
+                self._checked_at = now
+                self._generation = self._read()
+            return self._generation
+
+    def bump(self):
+        # A fresh timestamp rather than a counter, so two bumps racing can never write the same value twice
+        with self._lock:
+            generation = str(time.time_ns())
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(generation)
+            os.replace(tmp_path, self.path)
+            self._generation = generation
+            self._checked_at = time.monotonic()
+            return generation
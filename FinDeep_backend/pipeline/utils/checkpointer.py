@@ -0,0 +1,243 @@
+import time, pickle, sqlite3, threading
+from collections import OrderedDict
+from langgraph.checkpoint.memory import MemorySaver
+
+class BoundedMemorySaver(MemorySaver):
+    def __init__(
+            self,
+            max_sessions: int = 10000,
+            idle_ttl: float = 3600,
+            max_bytes: int = 256 * 1024 * 1024,
+            excluded_channels: tuple = ("retrieved_data", "trend_series", "branch_results", "sub_queries"),
+            sqlite_path: str = None
+        ):
+        super().__init__()
+        self.__max_sessions = max_sessions
+        self.__idle_ttl = idle_ttl
+        self.__max_bytes = max_bytes
+        # Bulky per-turn fields that are never needed by the next turn
+        self.__excluded_channels = set(excluded_channels)
+        # thread_id -> [last access, approximate serialized bytes], least recently used first
+        self.__sessions = OrderedDict()
+        # thread_id -> {(kind, key): bytes} of its entries in storage / writes / blobs, so pruning and eviction
+        # never scan other threads and the byte count always matches what is held
+        self.__items = {}
+        self.__total_bytes = 0
+        self.__lock = threading.RLock()
+        self.evictions = 0
+
+        # Optional durable copy of every session; evicted or restarted sessions are reloaded from it.
+        # One row per checkpoint, blob and write, so a put only inserts what it added
+        self.__sqlite = None
+        if sqlite_path:
+            self.__sqlite = sqlite3.connect(sqlite_path, check_same_thread = False)
+            self.__sqlite.execute(
+                "CREATE TABLE IF NOT EXISTS session_items ("
+                "thread_id TEXT, kind TEXT, key BLOB, updated_at REAL, data BLOB, PRIMARY KEY (thread_id, kind, key))"
+            )
+            self.__sqlite.commit()
+
+    def __touch(self, thread_id, added_bytes: int = 0):
+        with self.__lock:
+            session = self.__sessions.pop(thread_id, [0.0, 0])
+            session[0] = time.monotonic()
+            session[1] += added_bytes
+            self.__total_bytes += added_bytes
+            self.__sessions[thread_id] = session
+            self.__evict(keep = thread_id)
+
+    def __evict(self, keep):
+        now = time.monotonic()
+        while self.__sessions:
+            thread_id, (last_access, size) = next(iter(self.__sessions.items()))
+            if thread_id == keep:
+                # Every other session is gone and this one alone is still over the byte limit
+                if size > self.__max_bytes:
+                    print(
+                        f"[BoundedMemorySaver] session {thread_id} holds {size} bytes, over max_bytes {self.__max_bytes}; "
+                        "evicting it" + (" (SQLite copy kept)" if self.__sqlite is not None else "")
+                    )
+                    self.__forget(thread_id)
+                    self.evictions += 1
+                break
+            over_limit = (
+                len(self.__sessions) > self.__max_sessions
+                or self.__total_bytes > self.__max_bytes
+                or now - last_access > self.__idle_ttl
+            )
+            if not over_limit:
+                break
+            self.__forget(thread_id)
+            self.evictions += 1
+
+    def __forget(self, thread_id):
+        # Drop from memory only; the SQLite copy (if any) survives eviction
+        _, size = self.__sessions.pop(thread_id, (0.0, 0))
+        self.__total_bytes -= size
+        self.storage.pop(thread_id, None)
+        for kind, key in self.__items.pop(thread_id, {}):
+            if kind == "write":
+                self.writes.pop(key[0], None)
+            elif kind == "blob":
+                self.blobs.pop(key, None)
+
+    def __prune(self, thread_id, checkpoint_ns, checkpoint):
+        # A new checkpoint supersedes the older ones in its namespace: only the latest checkpoint, its writes
+        # and the blobs of the channel versions it points at are needed by the next turn
+        items = self.__items.get(thread_id, {})
+        versions = checkpoint["channel_versions"]
+        stale = []
+        for kind, key in items:
+            if kind == "checkpoint":
+                is_stale = key[0] == checkpoint_ns and key[1] != checkpoint["id"]
+            elif kind == "write":
+                is_stale = key[0][1] == checkpoint_ns and key[0][2] != checkpoint["id"]
+            else:
+                is_stale = key[1] == checkpoint_ns and versions.get(key[2]) != key[3]
+            if is_stale:
+                stale.append((kind, key))
+        removed_bytes = 0
+        for kind, key in stale:
+            removed_bytes += items.pop((kind, key))
+            if kind == "checkpoint":
+                self.storage[thread_id][checkpoint_ns].pop(key[1], None)
+            elif kind == "write":
+                outer_key, inner_key = key
+                self.writes.get(outer_key, {}).pop(inner_key, None)
+                if not self.writes.get(outer_key, True):
+                    self.writes.pop(outer_key, None)
+            else:
+                self.blobs.pop(key, None)
+        return stale, removed_bytes
+
+    def __strip(self, values: dict):
+        return {
+            key: (None if key in self.__excluded_channels else value)
+            for key, value in values.items()
+        }
+
+    def __persist(self, thread_id, items: list, removed: list = ()):
+        # items: (kind, key, value) added by this put / put_writes; removed: (kind, key) pruned by it
+        if self.__sqlite is None or not (items or removed):
+            return
+        now = time.time()
+        with self.__lock:
+            self.__sqlite.executemany(
+                "DELETE FROM session_items WHERE thread_id = ? AND kind = ? AND key = ?",
+                [(thread_id, kind, pickle.dumps(key)) for kind, key in removed]
+            )
+            self.__sqlite.executemany(
+                "INSERT OR REPLACE INTO session_items (thread_id, kind, key, updated_at, data) VALUES (?, ?, ?, ?, ?)",
+                [(thread_id, kind, pickle.dumps(key), now, pickle.dumps(value)) for kind, key, value in items]
+            )
+            self.__sqlite.commit()
+
+    def __load(self, thread_id):
+        # (kind, key, value) rows of a session
+        with self.__lock:
+            rows = self.__sqlite.execute(
+                "SELECT kind, key, data FROM session_items WHERE thread_id = ?", (thread_id,)
+            ).fetchall()
+        return [(kind, pickle.loads(key), pickle.loads(data)) for kind, key, data in rows]
+
+    @staticmethod
+    def __size(kind, value):
+        if kind == "checkpoint":
+            return len(value[0][1]) + len(value[1][1])
+        if kind == "write":
+            return len(value[2][1])
+        return len(value[1])
+
+    def __restore(self, thread_id):
+        if self.__sqlite is None or thread_id in self.__sessions:
+            return
+        rows = self.__load(thread_id)
+        if not rows:
+            return
+        items = self.__items.setdefault(thread_id, {})
+        for kind, key, value in rows:
+            if kind == "checkpoint":
+                checkpoint_ns, checkpoint_id = key
+                self.storage[thread_id][checkpoint_ns][checkpoint_id] = value
+            elif kind == "write":
+                outer_key, inner_key = key
+                self.writes[outer_key][inner_key] = value
+            else:
+                self.blobs[key] = value
+            items[(kind, key)] = self.__size(kind, value)
+        self.__touch(thread_id, sum(items.values()))
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        self.__restore(thread_id)
+        if thread_id in self.__sessions:
+            self.__touch(thread_id)
+        return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        # An evicted session is reloaded first so pruning also clears its superseded SQLite rows
+        self.__restore(thread_id)
+        checkpoint = {**checkpoint, "channel_values": self.__strip(checkpoint["channel_values"])}
+        result = super().put(config, checkpoint, metadata, new_versions)
+
+        # Only what this put added is sized and persisted, never the whole session again
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self.__lock:
+            tracked = self.__items.setdefault(thread_id, {})
+            items = [("checkpoint", (checkpoint_ns, checkpoint["id"]), self.storage[thread_id][checkpoint_ns][checkpoint["id"]])]
+            items += [
+                ("blob", key, self.blobs[key])
+                for key in ((thread_id, checkpoint_ns, channel, version) for channel, version in new_versions.items())
+            ]
+            added_bytes = 0
+            for kind, key, value in items:
+                size = self.__size(kind, value)
+                added_bytes += size - tracked.get((kind, key), 0)
+                tracked[(kind, key)] = size
+            removed, removed_bytes = self.__prune(thread_id, checkpoint_ns, checkpoint)
+            self.__touch(thread_id, added_bytes - removed_bytes)
+        self.__persist(thread_id, items, removed)
+        return result
+
+    def put_writes(self, config, writes, task_id, task_path = ""):
+        writes = [
+            (channel, None if channel in self.__excluded_channels else value)
+            for channel, value in writes
+        ]
+        thread_id = config["configurable"]["thread_id"]
+        outer_key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+        before = set(self.writes.get(outer_key, ()))
+        super().put_writes(config, writes, task_id, task_path)
+
+        # Pending writes count against the memory bound like checkpoints do
+        added = [
+            ("write", (outer_key, inner_key), write)
+            for inner_key, write in self.writes.get(outer_key, {}).items() if inner_key not in before
+        ]
+        if not added:
+            return
+        with self.__lock:
+            tracked = self.__items.setdefault(thread_id, {})
+            for kind, key, value in added:
+                tracked[(kind, key)] = self.__size(kind, value)
+            self.__touch(thread_id, sum(tracked[(kind, key)] for kind, key, _ in added))
+        self.__persist(thread_id, added)
+
+    def delete_thread(self, thread_id):
+        with self.__lock:
+            self.__forget(thread_id)
+            if self.__sqlite is not None:
+                self.__sqlite.execute("DELETE FROM session_items WHERE thread_id = ?", (thread_id,))
+                self.__sqlite.commit()
+
+    def stats(self):
+        return {
+            "sessions": len(self.__sessions),
+            "max_sessions": self.__max_sessions,
+            "bytes": self.__total_bytes,
+            "max_bytes": self.__max_bytes,
+            "idle_ttl": self.__idle_ttl,
+            "evictions": self.evictions,
+            "sqlite": self.__sqlite is not None
+        }
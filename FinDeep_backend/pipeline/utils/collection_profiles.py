@@ -0,0 +1,75 @@
+import os, math
+from qdrant_client.http import models
+
+# Storage layouts for the FinDeep collection, from fastest/most RAM to cheapest.
+# Quantized profiles keep the compressed vectors in RAM and rescore the candidates with the original float32 ones
+COLLECTION_PROFILES = {
+    "float32": dict(quantization = None, on_disk = False, on_disk_payload = False, oversampling = None),
+    "float32-disk": dict(quantization = None, on_disk = True, on_disk_payload = True, oversampling = None),
+    "int8": dict(quantization = "int8", on_disk = False, on_disk_payload = False, oversampling = 2.0),
+    "int8-disk": dict(quantization = "int8", on_disk = True, on_disk_payload = True, oversampling = 2.0),
+    "binary": dict(quantization = "binary", on_disk = False, on_disk_payload = False, oversampling = 4.0),
+    "binary-disk": dict(quantization = "binary", on_disk = True, on_disk_payload = True, oversampling = 4.0)
+}
+DEFAULT_PROFILE = "float32"
+# Qdrant's HNSW defaults, used when no override is given
+DEFAULT_HNSW_M = 16
+DEFAULT_HNSW_EF_CONSTRUCT = 100
+
+def get_profile(profile: str = None):
+    profile = profile or os.getenv("QDRANT_COLLECTION_PROFILE", DEFAULT_PROFILE)
+    if profile not in COLLECTION_PROFILES:
+        raise ValueError(f"Unknown collection profile {profile!r}, expected one of {list(COLLECTION_PROFILES)}")
+    return profile
+
+def collection_config(profile: str, dimension: int, hnsw_m: int = None, hnsw_ef_construct: int = None):
+    # Keyword arguments for create_collection
+    settings = COLLECTION_PROFILES[get_profile(profile)]
+    quantization_config = None
+    if settings["quantization"] == "int8":
+        quantization_config = models.ScalarQuantization(
+            scalar = models.ScalarQuantizationConfig(type = models.ScalarType.INT8, quantile = 0.99, always_ram = True)
+        )
+    elif settings["quantization"] == "binary":
+        quantization_config = models.BinaryQuantization(binary = models.BinaryQuantizationConfig(always_ram = True))
+    return dict(
+        vectors_config = models.VectorParams(
+            size = dimension,
+            distance = models.Distance.COSINE,
+            on_disk = settings["on_disk"]
+        ),
+        hnsw_config = models.HnswConfigDiff(
+            m = hnsw_m or DEFAULT_HNSW_M,
+            ef_construct = hnsw_ef_construct or DEFAULT_HNSW_EF_CONSTRUCT
+        ),
+        quantization_config = quantization_config,
+        on_disk_payload = settings["on_disk_payload"]
+    )
+
+def search_params(profile: str = None, hnsw_ef: int = None):
+    # Query-time counterpart of the profile; None keeps Qdrant's defaults
+    settings = COLLECTION_PROFILES[get_profile(profile)]
+    hnsw_ef = hnsw_ef or int(os.getenv("QDRANT_HNSW_EF", 0)) or None
+    quantization = None
+    if settings["quantization"]:
+        quantization = models.QuantizationSearchParams(rescore = True, oversampling = settings["oversampling"])
+    if quantization is None and hnsw_ef is None:
+        return None
+    return models.SearchParams(hnsw_ef = hnsw_ef, quantization = quantization)
+
+def estimate_memory(profile: str, points: int, dimension: int, hnsw_m: int = None):
+    # Rough vector-index footprint in bytes from the profile's formula, not a measurement of the running
+    # collection (payloads and segment overhead not included), hence the estimated_ prefix on every key
+    settings = COLLECTION_PROFILES[get_profile(profile)]
+    original = points * dimension * 4
+    quantized = {
+        None: 0,
+        "int8": points * dimension,
+        "binary": points * math.ceil(dimension / 8)
+    }[settings["quantization"]]
+    # Level-0 HNSW links dominate: 2 * m neighbours of 4 bytes per point
+    graph = points * 2 * (hnsw_m or DEFAULT_HNSW_M) * 4
+    return {
+        "estimated_ram_bytes": quantized + graph + (0 if settings["on_disk"] else original),
+        "estimated_disk_bytes": original + quantized + graph
+    }
@@ -0,0 +1,128 @@
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+def count_tokens(text: str):
+    if _ENCODING is None:
+        # Rough fallback when tiktoken is unavailable
+        return len(text) // 4 + 1
+    return len(_ENCODING.encode(text))
+
+class ContextBuilder:
+    def __init__(self, token_budget: int = 4000):
+        self.__token_budget = token_budget
+        self.__group_keys = ["CompanyName", "CIK"]
+        self.__row_keys = ["start", "end", "fy", "fp", "form", "accn", "value"]
+        self.__trend_keys = ["fy", "fp", "end", "value", "ytd", "qoq", "qoq_pct", "yoy", "yoy_pct"]
+
+    @staticmethod
+    def __format_value(value):
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    def __render_trends(self, trend_series):
+        # One compact table per company/metric; derived quarters are marked so the model can say so
+        if not trend_series:
+            return ""
+        lines = ["Quarterly trend (year-to-date figures split into quarters, * = derived by subtraction)"]
+        for series in trend_series:
+            lines.append(f"{series['CompanyName']} (CIK {series['CIK']}) {series['metric']}")
+            lines.append("    " + "|".join(self.__trend_keys))
+            for point in series["points"]:
+                cells = ["" if point.get(key) is None else self.__format_value(point[key]) for key in self.__trend_keys]
+                if point.get("source") == "derived":
+                    cells[self.__trend_keys.index("value")] += "*"
+                lines.append("    " + "|".join(cells))
+        return "\n".join(lines)
+
+    def __fit_trends(self, trend_series, token_budget: int):
+        # Whole series while they fit; then the last one kept loses its oldest quarters
+        trend_series = list(trend_series or [])
+        trends = self.__render_trends(trend_series)
+        while trend_series and count_tokens(trends) > token_budget:
+            if len(trend_series) > 1:
+                trend_series.pop()
+            elif len(trend_series[0]["points"]) > 1:
+                trend_series[0] = {**trend_series[0], "points": trend_series[0]["points"][1:]}
+            else:
+                trend_series = []
+            trends = self.__render_trends(trend_series)
+        return trends, trend_series
+
+    def __rank(self, retrieved_data, fy: str, fp: str):
+        # Deduplicate rows, then order by vector score plus a bonus for matching the requested period
+        rows = {}
+        for point in retrieved_data:
+            metadata = point.payload["metadata"]
+            key = tuple(sorted((k, self.__format_value(v)) for k, v in metadata.items()))
+            relevance = point.score
+            relevance += 1.0 if fy and self.__format_value(metadata.get("fy")) == str(fy) else 0.0
+            relevance += 1.0 if fp and metadata.get("fp") == fp else 0.0
+            if key not in rows or rows[key][0] < relevance:
+                rows[key] = (relevance, metadata)
+        return [metadata for _, metadata in sorted(rows.values(), key = lambda row: row[0], reverse = True)]
+
+    def __render(self, rows):
+        groups = {}
+        for metadata in rows:
+            company = tuple(self.__format_value(metadata.get(key, "")) for key in self.__group_keys)
+            groups.setdefault(company, {}).setdefault(metadata.get("metric", ""), []).append(metadata)
+
+        lines = []
+        for (company_name, cik), metrics in groups.items():
+            lines.append(f"{company_name} (CIK {cik})")
+            for metric, metric_rows in metrics.items():
+                # Fields identical for every row of the group are printed once in the header
+                shared = [
+                    key for key in self.__row_keys
+                    if len({self.__format_value(row.get(key, "")) for row in metric_rows}) == 1 and len(metric_rows) > 1
+                ]
+                columns = [key for key in self.__row_keys if key not in shared]
+                header = ", ".join(f"{key}={self.__format_value(metric_rows[0].get(key, ''))}" for key in shared)
+                lines.append(f"  {metric}" + (f" [{header}]" if header else ""))
+                lines.append("    " + "|".join(columns))
+                for row in metric_rows:
+                    lines.append("    " + "|".join(self.__format_value(row.get(key, "")) for key in columns))
+        return "\n".join(lines)
+
+    def build(self, retrieved_data, fy: str = "", fp: str = "", trend_series: list = None):
+        rows = self.__rank(retrieved_data or [], fy, fp)
+
+        # Trend tables are small and already aggregated, so they are charged first; rows fill the rest
+        trends, used_series = self.__fit_trends(trend_series, self.__token_budget)
+        trend_tokens = count_tokens(trends) if trends else 0
+        token_budget = max(self.__token_budget - trend_tokens, 0)
+
+        # Greedy fill by rank; each row costs about one rendered line
+        selected = []
+        used = 0
+        for metadata in rows:
+            line = "|".join(self.__format_value(metadata.get(key, "")) for key in self.__row_keys)
+            cost = count_tokens(line) + 2
+            if used + cost > token_budget:
+                break
+            selected.append(metadata)
+            used += cost
+
+        context = self.__render(selected)
+        while selected and count_tokens(context) > token_budget:
+            selected.pop()
+            context = self.__render(selected)
+        context = "\n\n".join(part for part in (trends, context) if part)
+        # Only feeds the "tokens saved" stat: ~4 characters per token, no tokenizer pass over every payload
+        raw_tokens = sum(len(str(point.payload["metadata"])) for point in retrieved_data or []) // 4
+        context_tokens = count_tokens(context)
+        stats = {
+            "rows_in": len(retrieved_data or []),
+            "rows_unique": len(rows),
+            "rows_used": len(selected),
+            "trend_series": len(used_series),
+            "trend_tokens": trend_tokens,
+            "raw_tokens": raw_tokens,
+            "context_tokens": context_tokens,
+            "tokens_saved": raw_tokens - context_tokens
+        }
+        return context, stats
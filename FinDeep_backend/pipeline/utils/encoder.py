@@ -0,0 +1,116 @@
+import os, threading
+
+ENCODER_BACKENDS = ["torch", "onnx", "onnx-int8"]
+
+# File suffixes used by sentence-transformers (and the hub) for dynamically quantized ONNX exports
+QUANTIZED_FILE_SUFFIXES = {
+    "arm64": "qint8_arm64",
+    "avx2": "quint8_avx2",
+    "avx512": "qint8_avx512",
+    "avx512_vnni": "qint8_avx512_vnni"
+}
+
+# Encoders already loaded in this process, so a model preloaded before forking workers is reused, not reloaded
+_ENCODERS = {}
+_ENCODERS_LOCK = threading.Lock()
+
+def load_encoder(embedding_model: str, backend: str = "torch", num_threads: int = None):
+    key = (embedding_model, backend, num_threads)
+    with _ENCODERS_LOCK:
+        if key not in _ENCODERS:
+            _ENCODERS[key] = Encoder(embedding_model, backend = backend, num_threads = num_threads)
+        return _ENCODERS[key]
+
+class Encoder:
+    def __init__(
+            self,
+            embedding_model: str,
+            backend: str = "torch",
+            num_threads: int = None,
+            device: str = None,
+            quantization_config: str = "avx2",
+            export_dir: str = None
+        ):
+        if backend not in ENCODER_BACKENDS:
+            raise ValueError(f"Unknown encoder backend {backend!r}, expected one of {ENCODER_BACKENDS}")
+        self.backend = backend
+        self.__embedding_model = embedding_model
+        self.__num_threads = num_threads
+        self.__quantization_config = quantization_config
+        self.__export_dir = export_dir or os.path.join(
+            os.path.expanduser("~"), ".cache", "findeep", embedding_model.replace("/", "__")
+        )
+
+        # Imported here so processes that never encode do not pay for torch at startup
+        from sentence_transformers import SentenceTransformer
+        if backend == "torch":
+            if num_threads:
+                import torch
+                torch.set_num_threads(num_threads)
+            self.__model = SentenceTransformer(embedding_model, device = device)
+        elif backend == "onnx":
+            self.__model = SentenceTransformer(
+                embedding_model,
+                backend = "onnx",
+                model_kwargs = self.__onnx_model_kwargs()
+            )
+        else:
+            self.__model = self.__load_quantized()
+        print(f"Encoder {embedding_model} loaded with {backend} backend")
+
+    def __onnx_model_kwargs(self, file_name: str = None):
+        model_kwargs = {"provider": "CPUExecutionProvider"}
+        if file_name:
+            model_kwargs["file_name"] = file_name
+        if self.__num_threads:
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = self.__num_threads
+            session_options.inter_op_num_threads = 1
+            model_kwargs["session_options"] = session_options
+        return model_kwargs
+
+    def __load_quantized(self):
+        from sentence_transformers import SentenceTransformer
+        file_suffix = QUANTIZED_FILE_SUFFIXES[self.__quantization_config]
+        file_name = f"onnx/model_{file_suffix}.onnx"
+        # Prefer a previously exported local copy, then the hub, and export one ourselves as a last resort
+        if os.path.exists(os.path.join(self.__export_dir, file_name)):
+            return SentenceTransformer(
+                self.__export_dir,
+                backend = "onnx",
+                model_kwargs = self.__onnx_model_kwargs(file_name)
+            )
+        try:
+            return SentenceTransformer(
+                self.__embedding_model,
+                backend = "onnx",
+                model_kwargs = self.__onnx_model_kwargs(file_name)
+            )
+        except Exception as e:
+            print(f"No prebuilt int8 model ({e}), exporting to {self.__export_dir}")
+
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        model = SentenceTransformer(self.__embedding_model, backend = "onnx", model_kwargs = self.__onnx_model_kwargs())
+        model.save(self.__export_dir)
+        export_dynamic_quantized_onnx_model(
+            model,
+            self.__quantization_config,
+            self.__export_dir,
+            file_suffix = file_suffix
+        )
+        return SentenceTransformer(
+            self.__export_dir,
+            backend = "onnx",
+            model_kwargs = self.__onnx_model_kwargs(file_name)
+        )
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs):
+        return self.__model.encode(sentences, batch_size = batch_size, **kwargs)
+
+    def warm_up(self):
+        # The first encode initializes thread pools and kernels; do it before taking traffic
+        self.__model.encode(["warm up"], batch_size = 1)
+
+    def get_sentence_embedding_dimension(self):
+        return self.__model.get_sentence_embedding_dimension()
@@ -0,0 +1,219 @@
+import re, itertools
+from FinDeep_backend.pipeline.constant.schema import FinancialSchema
+from FinDeep_backend.pipeline.store.snapshot import load_snapshot
+
+# Everyday phrasing for XBRL metric names that the camel-case split alone does not cover
+METRIC_SYNONYMS = {
+    "net income": "NetIncomeLoss",
+    "net loss": "NetIncomeLoss",
+    "net profit": "NetIncomeLoss",
+    "earnings": "NetIncomeLoss",
+    "operating income": "OperatingIncomeLoss",
+    "operating profit": "OperatingIncomeLoss",
+    "operating loss": "OperatingIncomeLoss",
+    "revenue": "Revenues",
+    "revenues": "Revenues",
+    "sales": "Revenues",
+    "cost of revenue": "CostOfRevenue",
+    "cost of sales": "CostOfGoodsAndServicesSold",
+    "cost of goods sold": "CostOfGoodsAndServicesSold",
+    "cogs": "CostOfGoodsAndServicesSold",
+    "r&d": "ResearchAndDevelopmentExpense",
+    "research and development": "ResearchAndDevelopmentExpense",
+    "sg&a": "SellingGeneralAndAdministrativeExpense",
+    "capex": "PaymentsToAcquirePropertyPlantAndEquipment",
+    "capital expenditure": "PaymentsToAcquirePropertyPlantAndEquipment",
+    "capital expenditures": "PaymentsToAcquirePropertyPlantAndEquipment",
+    "operating cash flow": "NetCashProvidedByUsedInOperatingActivities",
+    "cash from operations": "NetCashProvidedByUsedInOperatingActivities",
+    "investing cash flow": "NetCashProvidedByUsedInInvestingActivities",
+    "financing cash flow": "NetCashProvidedByUsedInFinancingActivities",
+    "income tax": "IncomeTaxExpenseBenefit",
+    "income taxes": "IncomeTaxExpenseBenefit",
+    "d&a": "DepreciationAndAmortization",
+    "depreciation and amortization": "DepreciationAndAmortization",
+    "opex": "OperatingExpenses",
+    "dividends": "DividendsCommonStock",
+    "restructuring": "RestructuringCharges",
+    "comprehensive income": "ComprehensiveIncomeNetOfTax"
+}
+
+# Trailing words dropped to derive short company aliases ("CVS Health" -> "cvs")
+COMPANY_SUFFIXES = {
+    "inc", "corp", "corporation", "co", "company", "group", "holdings", "technologies",
+    "financial", "services", "health", "healthcare", "international", "communications",
+    "software", "motor", "laboratories", "interactive", "sciences", "energy"
+}
+
+# Short aliases that are ordinary words in a financial question ("progressive trend", "block of shares"):
+# they only count when capitalized, and are left for the LLM to confirm unless a metric sits right next to them
+COMMON_WORD_ALIASES = {"american", "block", "discover", "progressive", "snap", "travelers", "unity"}
+
+# Figures the dataset does not have, whose wording contains one of its metric aliases ("earnings per share"
+# is not NetIncomeLoss); a question asking for one goes to the LLM
+UNSUPPORTED_METRIC_PHRASES = [
+    "earnings per share", "diluted earnings", "basic earnings", "earnings before", "ebitda", "ebit", "eps",
+    "earnings call", "earnings guidance", "price to earnings", "p/e", "revenue per share", "sales per share"
+]
+
+QUARTER_WORDS = {
+    "first": "Q1",
+    "second": "Q2",
+    "third": "Q3",
+    "fourth": "Q4"
+}
+
+class EntityExtractor:
+    def __init__(self, csv_path: str, threshold: float = 0.9):
+        self.__threshold = threshold
+        df = load_snapshot(csv_path).frame(columns = ["metric", "CIK", "CompanyName"]).drop_duplicates()
+
+        self.__company_aliases = {}
+        ambiguous = set()
+        for name in df["CompanyName"].unique():
+            for alias in self.__company_alias_variants(name):
+                if self.__company_aliases.get(alias, name) != name:
+                    ambiguous.add(alias)
+                self.__company_aliases[alias] = name
+        for alias in ambiguous:
+            del self.__company_aliases[alias]
+
+        self.__metric_aliases = {}
+        for metric in df["metric"].unique():
+            self.__metric_aliases[metric.lower()] = metric
+            self.__metric_aliases[" ".join(re.findall(r"[A-Z][a-z]*", metric)).lower()] = metric
+        for alias, metric in METRIC_SYNONYMS.items():
+            if metric in self.__metric_aliases.values():
+                self.__metric_aliases.setdefault(alias, metric)
+
+        # One alternation per vocabulary, longest alias first so "net income loss" beats "net income"
+        self.__company_pattern = self.__compile_vocabulary(self.__company_aliases)
+        self.__metric_pattern = self.__compile_vocabulary(self.__metric_aliases)
+        self.__unsupported_pattern = self.__compile_vocabulary(UNSUPPORTED_METRIC_PHRASES)
+        # "Block revenue", "net income of Progressive"
+        self.__adjacent_gap = re.compile(r"\s*|\s+(?:of|for|at|by|from)\s+")
+        self.__fy_pattern = re.compile(r"\b(?:fy\s*)?(20\d{2})\b")
+        self.__fp_pattern = re.compile(r"\bq([1-4])\b|\b(first|second|third|fourth) quarter\b")
+        self.__annual_pattern = re.compile(r"\b(?:full[- ]year|annual|fiscal year)\b")
+        self.__form_pattern = re.compile(r"\b10-?([kq])\b")
+        self.__accn_pattern = re.compile(r"\b\d{10}-\d{2}-\d{6}\b")
+        self.__cik_pattern = re.compile(r"\bcik\s*:?\s*(\d{1,10})\b")
+        self.__date_pattern = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+        print(f"EntityExtractor loaded {len(self.__company_aliases)} company and {len(self.__metric_aliases)} metric aliases")
+
+    @staticmethod
+    def __company_alias_variants(name):
+        base = name.lower()
+        variants = {base, base.replace("-", " "), re.sub(r"[^\w\s&]", "", base)}
+        words = base.replace("-", " ").split()
+        while len(words) > 1 and words[-1].strip(".,") in COMPANY_SUFFIXES:
+            words = words[:-1]
+            variants.add(" ".join(words))
+        return variants
+
+    @staticmethod
+    def __compile_vocabulary(aliases):
+        alternation = "|".join(re.escape(alias) for alias in sorted(aliases, key = len, reverse = True))
+        return re.compile(rf"(?<![\w&])(?:{alternation})(?![\w&])")
+
+    def __next_to_metric(self, text: str, match, metric_matches):
+        for metric in metric_matches:
+            if metric.start() >= match.end():
+                gap = text[match.end():metric.start()]
+            elif metric.end() <= match.start():
+                gap = text[metric.end():match.start()]
+            else:
+                continue
+            if self.__adjacent_gap.fullmatch(gap):
+                return True
+        return False
+
+    def __match_companies(self, original: str, text: str, metric_matches):
+        # (companies, companies only named through a common-word alias)
+        companies, weak = set(), set()
+        for match in self.__company_pattern.finditer(text):
+            alias = match.group(0)
+            name = self.__company_aliases[alias]
+            if alias in COMMON_WORD_ALIASES:
+                # Offsets only line up while lower() kept the length
+                if len(original) != len(text) or not original[match.start()].isupper():
+                    continue
+                if not self.__next_to_metric(text, match, metric_matches):
+                    weak.add(name)
+                    continue
+            companies.add(name)
+        return companies | weak, weak - companies
+
+    def __parse(self, message: str):
+        original = re.sub(r"['’]s\b", "", message, flags = re.IGNORECASE)
+        text = original.lower()
+        unsupported = [match.span() for match in self.__unsupported_pattern.finditer(text)]
+        metric_matches = [
+            match for match in self.__metric_pattern.finditer(text)
+            if not any(start < match.end() and match.start() < end for start, end in unsupported)
+        ]
+        companies, weak_companies = self.__match_companies(original, text, metric_matches)
+        fps = {
+            f"Q{number}" if number else QUARTER_WORDS[word]
+            for number, word in self.__fp_pattern.findall(text)
+        }
+        if not fps and self.__annual_pattern.search(text):
+            fps = {"FY"}
+        return {
+            "companies": companies,
+            "weak_companies": weak_companies,
+            "metrics": {self.__metric_aliases[match.group(0)] for match in metric_matches},
+            "unsupported_metrics": len(unsupported),
+            "dates": self.__date_pattern.findall(text),
+            "accns": set(self.__accn_pattern.findall(text)),
+            "fys": set(self.__fy_pattern.findall(self.__accn_pattern.sub(" ", self.__date_pattern.sub(" ", text)))),
+            "fps": fps,
+            "forms": {f"10-{letter.upper()}" for letter in self.__form_pattern.findall(text)},
+            "ciks": set(self.__cik_pattern.findall(text))
+        }
+
+    @staticmethod
+    def __confidence(has_company, has_metric, has_fy, has_fp, weak_company = False):
+        # A company named only through a common-word alias counts half, which keeps the score under the threshold
+        company = 0.2 if has_company and weak_company else 0.4 * has_company
+        return round(company + 0.4 * has_metric + 0.1 * has_fy + 0.1 * has_fp, 2)
+
+    def extract_all(self, message: str, max_queries: int = 16):
+        # Comparison questions: one FinancialSchema per company x metric x fiscal year x period mentioned.
+        # Returns ([FinancialSchema], confidence); conflicting filings, forms or CIKs are left to the LLM
+        parsed = self.__parse(message)
+        if parsed["unsupported_metrics"]:
+            # A figure the dataset does not hold; a confident wrong metric would be worse than the LLM call
+            return [], 0.0
+        if any(len(parsed[key]) > 1 for key in ("accns", "forms", "ciks")):
+            return [], 0.0
+        combinations = list(itertools.product(
+            sorted(parsed["companies"]) or [""],
+            sorted(parsed["metrics"]) or [""],
+            sorted(parsed["fys"]) or [""],
+            sorted(parsed["fps"]) or [""]
+        ))
+        if len(combinations) > max_queries:
+            return [], 0.0
+
+        dates = parsed["dates"]
+        shared = dict(
+            start = dates[0] if len(dates) == 2 else "",
+            end = dates[1] if len(dates) == 2 else "",
+            value = "",
+            accn = next(iter(parsed["accns"]), ""),
+            form = next(iter(parsed["forms"]), ""),
+            cik = next(iter(parsed["ciks"]), "") if len(parsed["companies"]) <= 1 else ""
+        )
+        queries = [
+            FinancialSchema(companyname = company, metric = metric, fy = fy, fp = fp, **shared)
+            for company, metric, fy, fp in combinations
+        ]
+        confidence = self.__confidence(
+            bool(parsed["companies"] or parsed["ciks"]), bool(parsed["metrics"]), bool(parsed["fys"]), bool(parsed["fps"]),
+            weak_company = bool(parsed["weak_companies"]) and not parsed["ciks"]
+        )
+        return queries, confidence
+
+    def is_confident(self, confidence: float):
+        return confidence >= self.__threshold
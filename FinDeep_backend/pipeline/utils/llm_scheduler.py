@@ -0,0 +1,372 @@
+from FinDeep_backend.pipeline.utils.metrics import record, LLM_QUEUE_WAIT, LLM_SHED, LLM_RATE_LIMITED
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os, time, heapq, random, asyncio, itertools, threading, contextvars
+from contextlib import contextmanager
+
+# Lower runs first: interactive chats ahead of batch jobs
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Absolute deadline (time.monotonic) and priority of the request being served; set by the API layer
+_request_deadline = contextvars.ContextVar("request_deadline", default = None)
+_request_priority = contextvars.ContextVar("request_priority", default = PRIORITY_INTERACTIVE)
+# Set instead of the two above inside single-flight work, which serves several requests at once
+_shared_request = contextvars.ContextVar("shared_request", default = None)
+
+@contextmanager
+def request_deadline(timeout: float = None, priority: int = PRIORITY_INTERACTIVE):
+    deadline_token = _request_deadline.set(time.monotonic() + timeout if timeout else None)
+    priority_token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(deadline_token)
+        _request_priority.reset(priority_token)
+
+class SharedRequest:
+    # Deadline and priority of work run once for several requests: it is as urgent as the most urgent
+    # request waiting on it and may run until the last of them would give up
+    def __init__(self):
+        self.__waiters = []
+
+    def join(self):
+        # Adds the calling request (or the shared work it is part of); returns the handle for leave()
+        waiter = _shared_request.get() or (_request_deadline.get(), _request_priority.get())
+        self.__waiters.append(waiter)
+        return waiter
+
+    def leave(self, waiter):
+        # The last waiter stays, so work nobody waits for any more still finishes on its deadline
+        if len(self.__waiters) > 1:
+            self.__waiters.remove(waiter)
+
+    def deadline(self):
+        # None (the scheduler's default timeout) as soon as one waiter has no deadline of its own
+        deadlines = [waiter.deadline() if isinstance(waiter, SharedRequest) else waiter[0] for waiter in self.__waiters]
+        return None if None in deadlines else max(deadlines)
+
+    def priority(self):
+        return min(waiter.priority() if isinstance(waiter, SharedRequest) else waiter[1] for waiter in self.__waiters)
+
+def bind_shared_request(shared: SharedRequest):
+    # For a fresh contextvars.Context (see SingleFlight)
+    _shared_request.set(shared)
+
+class LLMOverloaded(Exception):
+    # Raised instead of calling (or waiting on) the provider; status_code is what the API answers with
+    def __init__(self, message: str, status_code: int = 503, retry_after: float = 1.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def is_rate_limit(error: Exception):
+    # openai.RateLimitError and anything else that carries an HTTP 429
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+def retry_after_of(error: Exception):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def usage_tokens(message):
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens") or (usage.get("input_tokens", 0) + usage.get("output_tokens", 0)) or None
+
+class TokenBucket:
+    def __init__(self, per_minute: float = None):
+        # None or 0 means unlimited
+        self.per_minute = per_minute or None
+        self.__rate = (per_minute or 0) / 60
+        # Providers budget per minute, so up to a minute's worth may go out at once
+        self.__capacity = per_minute or 0
+        self.__tokens = self.__capacity
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated) * self.__rate)
+        self.__updated = now
+
+    def wait_time(self, amount: float):
+        if not self.per_minute:
+            return 0.0
+        with self.__lock:
+            self.__refill()
+            return max(0.0, (min(amount, self.__capacity) - self.__tokens) / self.__rate)
+
+    def take(self, amount: float):
+        # May go negative: an underestimated call is paid back by the calls after it
+        if not self.per_minute:
+            return
+        with self.__lock:
+            self.__refill()
+            self.__tokens -= amount
+
+    def pause(self, seconds: float):
+        # After a provider 429 nothing is released for the next `seconds`
+        if not self.per_minute:
+            return
+        with self.__lock:
+            self.__refill()
+            self.__tokens = min(self.__tokens, 0) - seconds * self.__rate
+
+class LLMScheduler:
+    def __init__(
+            self,
+            requests_per_minute: float = None,
+            tokens_per_minute: float = None,
+            max_concurrency: int = None,
+            max_queue: int = None,
+            default_timeout: float = None,
+            max_retries: int = None
+        ):
+        # Shared by every LLM-calling agent of the process; settings fall back to LLM_* environment variables
+        self.__requests = TokenBucket(requests_per_minute or float(os.getenv("LLM_RPM", 0)))
+        self.__tokens = TokenBucket(tokens_per_minute or float(os.getenv("LLM_TPM", 0)))
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+        self.max_queue = max_queue or int(os.getenv("LLM_MAX_QUEUE", 256))
+        self.default_timeout = default_timeout or float(os.getenv("LLM_TIMEOUT", 30))
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", 2)) if max_retries is None else max_retries
+
+        # Waiting calls: [priority, sequence, estimated tokens, future, priority_of (shared work) or None]
+        self.__queue = []
+        self.__sequence = itertools.count()
+        self.__active = 0
+        self.__timer = None
+        self.__timer_loop = None
+        # Moving average of a call's duration, for the expected-wait estimate; 0 (admit everything) until measured
+        self.__service_time = 0.0
+        self.__sync_slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.completed = 0
+        self.shed = 0
+        self.rate_limited = 0
+
+    def __deadline(self):
+        # Returns deadline_of(): shared work follows its waiters, whose latest deadline moves as they join and leave
+        fallback = time.monotonic() + self.default_timeout
+        shared = _shared_request.get()
+        if shared is not None:
+            return lambda: shared.deadline() or fallback
+        deadline = _request_deadline.get() or fallback
+        return lambda: deadline
+
+    def __priority(self):
+        # priority_of() for shared work, None when the request's priority is fixed
+        shared = _shared_request.get()
+        return shared.priority if shared is not None else None
+
+    @staticmethod
+    async def __wait_until(awaitable, deadline_of):
+        # asyncio.wait_for against a deadline that may move later while waiting
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout = max(deadline_of() - time.monotonic(), 0))
+                if done:
+                    return task.result()
+                if deadline_of() <= time.monotonic():
+                    task.cancel()
+                    await asyncio.wait({task})
+                    raise asyncio.TimeoutError
+        finally:
+            if not task.done():
+                task.cancel()
+
+    def __expected_wait(self, estimated_tokens: int):
+        # (seconds until a new call would start, which limit causes it)
+        ahead = len(self.__queue)
+        busy = self.__active + ahead - self.max_concurrency
+        slot_wait = (busy // self.max_concurrency + 1) * self.__service_time if busy >= 0 else 0.0
+        queued_tokens = sum(entry[2] for entry in self.__queue)
+        rate_wait = max(
+            self.__requests.wait_time(ahead + 1),
+            self.__tokens.wait_time(queued_tokens + estimated_tokens)
+        )
+        return (rate_wait, "rate_limit") if rate_wait > slot_wait else (slot_wait, "queue")
+
+    def __shed(self, node: str, reason: str, message: str, status_code: int, retry_after: float):
+        self.shed += 1
+        LLM_SHED.inc(node, reason)
+        record(f"{node}_shed", reason)
+        return LLMOverloaded(message, status_code = status_code, retry_after = max(retry_after, 0.1))
+
+    def __admit(self, node: str, estimated_tokens: int, deadline: float):
+        # Fast rejection: a call that cannot start and finish before the deadline is not queued at all
+        if len(self.__queue) >= self.max_queue:
+            raise self.__shed(node, "queue_full", f"LLM queue is full ({self.max_queue} waiting)", 503, self.__service_time)
+        wait, limiter = self.__expected_wait(estimated_tokens)
+        if time.monotonic() + wait + self.__service_time > deadline:
+            status_code = 429 if limiter == "rate_limit" else 503
+            raise self.__shed(
+                node, limiter,
+                f"LLM {'rate limit' if status_code == 429 else 'queue'} wait of {wait:.1f}s exceeds the request deadline",
+                status_code, wait
+            )
+
+    def __dispatch(self):
+        # Hands free slots to the best-priority waiters while the request and token budgets allow
+        loop = asyncio.get_running_loop()
+        if self.__timer_loop is not loop:
+            self.__timer, self.__timer_loop = None, loop
+        # Shared work takes the priority of its most urgent waiter, which may have joined while it queued
+        reordered = False
+        for entry in self.__queue:
+            if entry[4] is not None and entry[4]() != entry[0]:
+                entry[0] = entry[4]()
+                reordered = True
+        if reordered:
+            heapq.heapify(self.__queue)
+        while self.__queue and self.__active < self.max_concurrency:
+            _, _, tokens, waiter, _ = self.__queue[0]
+            if waiter.done():
+                heapq.heappop(self.__queue)
+                continue
+            wait = max(self.__requests.wait_time(1), self.__tokens.wait_time(tokens))
+            if wait > 0:
+                if self.__timer is None:
+                    self.__timer = loop.call_later(wait, self.__on_timer)
+                return
+            heapq.heappop(self.__queue)
+            self.__requests.take(1)
+            self.__tokens.take(tokens)
+            self.__active += 1
+            waiter.set_result(None)
+
+    def __on_timer(self):
+        self.__timer = None
+        self.__dispatch()
+
+    def __release(self, elapsed: float = None):
+        self.__active -= 1
+        if elapsed is not None:
+            self.__service_time = 0.8 * self.__service_time + 0.2 * elapsed if self.__service_time else elapsed
+        self.__dispatch()
+
+    async def __acquire(self, node: str, estimated_tokens: int, deadline_of, priority_of):
+        waiter = asyncio.get_running_loop().create_future()
+        priority = priority_of() if priority_of else _request_priority.get()
+        entry = [priority, next(self.__sequence), estimated_tokens, waiter, priority_of]
+        heapq.heappush(self.__queue, entry)
+        self.__dispatch()
+        try:
+            await self.__wait_until(asyncio.shield(waiter), deadline_of)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted at the same moment: keep the slot on timeout, give it back on cancellation
+                if isinstance(e, asyncio.TimeoutError):
+                    return
+                self.__release()
+                raise
+            waiter.cancel()
+            if entry in self.__queue:
+                self.__queue.remove(entry)
+                heapq.heapify(self.__queue)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self.__shed(node, "deadline", "Request deadline passed while waiting for the LLM", 503, self.__service_time)
+
+    def __backoff(self, error: Exception, attempt: int):
+        return retry_after_of(error) or min(0.5 * 2 ** attempt, 8.0) * random.uniform(0.5, 1.0)
+
+    def __on_rate_limit(self, node: str, error: Exception, attempt: int, deadline: float):
+        # Returns the backoff before retrying, or raises a 429 when there is no time (or retry) left
+        self.rate_limited += 1
+        LLM_RATE_LIMITED.inc(node)
+        backoff = self.__backoff(error, attempt)
+        self.__requests.pause(backoff)
+        if attempt >= self.max_retries or time.monotonic() + backoff + self.__service_time > deadline:
+            raise LLMOverloaded("LLM provider rate limit", status_code = 429, retry_after = backoff) from error
+        return backoff
+
+    async def run(self, node: str, factory, estimated_tokens: int = 0, usage = None):
+        # factory() -> awaitable of one LLM call; usage(result) -> tokens actually spent, to correct the estimate
+        deadline_of = self.__deadline()
+        priority_of = self.__priority()
+        self.__admit(node, estimated_tokens, deadline_of())
+        attempt = 0
+        while True:
+            start_time = time.monotonic()
+            await self.__acquire(node, estimated_tokens, deadline_of, priority_of)
+            if time.monotonic() + self.__service_time > deadline_of():
+                # Waited too long to still finish in time: not worth spending the provider's budget on
+                self.__release()
+                raise self.__shed(node, "deadline", "Request deadline too close to start the LLM call", 503, self.__service_time)
+            LLM_QUEUE_WAIT.observe(time.monotonic() - start_time, node)
+            record(f"{node}_queue_ms", round((time.monotonic() - start_time) * 1e3, 2))
+
+            call_start = time.monotonic()
+            try:
+                result = await self.__wait_until(factory(), deadline_of)
+            except asyncio.TimeoutError:
+                # Failed calls do not feed the service time: their durations are cut short
+                self.__release()
+                raise self.__shed(node, "timeout", "LLM call did not finish before the request deadline", 504, self.__service_time)
+            except Exception as e:
+                self.__release()
+                if not is_rate_limit(e):
+                    raise
+                await asyncio.sleep(self.__on_rate_limit(node, e, attempt, deadline_of()))
+                attempt += 1
+                continue
+            except BaseException:
+                self.__release()
+                raise
+            self.__release(time.monotonic() - call_start)
+            self.completed += 1
+            spent = usage(result) if usage else None
+            if spent is not None:
+                self.__tokens.take(spent - estimated_tokens)
+            return result
+
+    def run_sync(self, node: str, fn, estimated_tokens: int = 0, usage = None):
+        # Blocking counterpart for the sync invoke() paths: same budgets and deadline, a thread semaphore for the slots
+        deadline = self.__deadline()()
+        attempt = 0
+        while True:
+            start_time = time.monotonic()
+            if not self.__sync_slots.acquire(timeout = max(deadline - start_time, 0)):
+                raise self.__shed(node, "deadline", "Request deadline passed while waiting for the LLM", 503, self.__service_time)
+            try:
+                wait = max(self.__requests.wait_time(1), self.__tokens.wait_time(estimated_tokens))
+                if time.monotonic() + wait + self.__service_time > deadline:
+                    raise self.__shed(node, "rate_limit", f"LLM rate limit wait of {wait:.1f}s exceeds the request deadline", 429, wait)
+                time.sleep(wait)
+                self.__requests.take(1)
+                self.__tokens.take(estimated_tokens)
+                LLM_QUEUE_WAIT.observe(time.monotonic() - start_time, node)
+                try:
+                    result = fn()
+                except Exception as e:
+                    if not is_rate_limit(e):
+                        raise
+                    backoff = self.__on_rate_limit(node, e, attempt, deadline)
+                else:
+                    self.completed += 1
+                    spent = usage(result) if usage else None
+                    if spent is not None:
+                        self.__tokens.take(spent - estimated_tokens)
+                    return result
+            finally:
+                self.__sync_slots.release()
+            time.sleep(backoff)
+            attempt += 1
+
+    def stats(self):
+        return {
+            "queued": len(self.__queue),
+            "active": self.__active,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "requests_per_minute": self.__requests.per_minute,
+            "tokens_per_minute": self.__tokens.per_minute,
+            "service_time_sec": self.__service_time,
+            "completed": self.completed,
+            "shed": self.shed,
+            "rate_limited": self.rate_limited
+        }
@@ -0,0 +1,194 @@
+import time, bisect, threading, contextvars
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from an in-process cache hit up to a slow LLM call
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Timing breakdown of the request being served; set by the API layer, filled in by the agents
+_request_timings = contextvars.ContextVar("request_timings", default = None)
+
+def _format_labels(label_names, label_values, extra: dict = None):
+    pairs = list(zip(label_names, label_values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self.__lock:
+            self.__values[label_values] = self.__values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.__lock:
+            for label_values, value in sorted(self.__values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self.__lock:
+            series = self.__values.setdefault(label_values, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.__lock:
+            for label_values, (bucket_counts, total, count) in sorted(self.__values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), bucket_counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.label_names, label_values, {"le": bound})
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.__metrics = []
+        # Callables returning (name, type, documentation, [(labels dict, value)]) for values owned elsewhere
+        self.__collectors = []
+
+    def counter(self, name: str, documentation: str, label_names: tuple = ()):
+        metric = Counter(name, documentation, label_names)
+        self.__metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, label_names, buckets)
+        self.__metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self.__collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.__metrics:
+            lines.extend(metric.render())
+        for collector in self.__collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {value}")
+        return "\n".join(lines) + "\n"
+
+# Process-wide registry; every worker process exposes its own values on /metrics
+REGISTRY = MetricsRegistry()
+
+REQUEST_LATENCY = REGISTRY.histogram("findeep_request_latency_seconds", "End-to-end latency per API endpoint", ("endpoint",))
+REQUEST_ERRORS = REGISTRY.counter("findeep_request_errors_total", "Failed requests per API endpoint", ("endpoint",))
+NODE_LATENCY = REGISTRY.histogram("findeep_node_latency_seconds", "Wall time per graph node", ("node",))
+LLM_LATENCY = REGISTRY.histogram("findeep_llm_latency_seconds", "LLM call latency", ("node",))
+LLM_TOKENS = REGISTRY.counter("findeep_llm_tokens_total", "LLM tokens by node and kind (prompt/completion)", ("node", "kind"))
+ENCODE_LATENCY = REGISTRY.histogram("findeep_encode_latency_seconds", "Query embedding encode time", ("backend",))
+SEARCH_LATENCY = REGISTRY.histogram("findeep_search_latency_seconds", "Vector search latency; filtered counts are labelled qdrant_count", ("backend",))
+SEARCH_RESULTS = REGISTRY.histogram("findeep_search_results", "Points returned per retrieval", ("path",), buckets = COUNT_BUCKETS)
+PAYLOAD_BYTES = REGISTRY.histogram("findeep_payload_bytes", "Approximate payload bytes returned per retrieval", ("path",), buckets = BYTES_BUCKETS)
+RETRIEVAL_PATH = REGISTRY.counter("findeep_retrieval_path_total", "Retrievals by path (fact_store/qdrant/faiss)", ("path",))
+ANALYSIS_PATH = REGISTRY.counter("findeep_analysis_path_total", "Message analyses by path (rules/llm)", ("path",))
+QDRANT_CALLS = REGISTRY.counter("findeep_qdrant_calls_total", "Qdrant calls by method and outcome (ok/retry/hedge/error/rejected)", ("method", "outcome"))
+COALESCED = REGISTRY.counter("findeep_coalesced_total", "Single-flight calls by stage and role (leader ran it, follower shared it)", ("stage", "role"))
+LLM_QUEUE_WAIT = REGISTRY.histogram("findeep_llm_queue_wait_seconds", "Time LLM calls waited for a slot and rate-limit budget", ("node",))
+LLM_SHED = REGISTRY.counter("findeep_llm_shed_total", "LLM calls rejected by admission control, by reason (queue/rate_limit/queue_full/deadline/timeout)", ("node", "reason"))
+LLM_RATE_LIMITED = REGISTRY.counter("findeep_llm_rate_limited_total", "429 responses from the LLM provider", ("node",))
+
+@contextmanager
+def request_timings():
+    # Collects the breakdown of one request; the yielded dict is what ends up in the structured log
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+class SharedTimings:
+    # Breakdown of work run once for several requests (single-flight): whatever it records lands in the
+    # timings of every request waiting on it, including what was recorded before a request joined
+    def __init__(self):
+        self.__recorded = []
+        self.__targets = []
+
+    def attach(self, timings):
+        if timings is None:
+            return
+        for key, value in self.__recorded:
+            _record_into(timings, key, value)
+        self.__targets.append(timings)
+
+    def record(self, key: str, value):
+        self.__recorded.append((key, value))
+        for timings in self.__targets:
+            _record_into(timings, key, value)
+
+def current_timings():
+    return _request_timings.get()
+
+def bind_request_timings(timings):
+    # For a fresh contextvars.Context (see SingleFlight); request_timings() is the scoped version
+    _request_timings.set(timings)
+
+def _record_into(timings, key: str, value):
+    if isinstance(timings, SharedTimings):
+        timings.record(key, value)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool) and key in timings:
+        # Several calls in one request (e.g. one retrieval per comparison branch) add up
+        timings[key] += value
+    else:
+        timings[key] = value
+
+def record(key: str, value):
+    timings = _request_timings.get()
+    if timings is None:
+        return
+    _record_into(timings, key, value)
+
+@contextmanager
+def timed(histogram: Histogram, *label_values, key: str = None):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        histogram.observe(elapsed, *label_values)
+        if key:
+            record(key, round(elapsed * 1e3, 2))
+
+def record_llm_usage(node: str, message):
+    # usage_metadata is filled in by ChatOpenAI, also when streaming with stream_usage
+    usage = getattr(message, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens", 0)
+    completion_tokens = usage.get("output_tokens", 0)
+    LLM_TOKENS.inc(node, "prompt", amount = prompt_tokens)
+    LLM_TOKENS.inc(node, "completion", amount = completion_tokens)
+    record(f"{node}_prompt_tokens", prompt_tokens)
+    record(f"{node}_completion_tokens", completion_tokens)
+
+def payload_bytes(points):
+    # Approximate size of what the search shipped back, without serializing it again
+    return sum(len(str(point.payload)) for point in points or [])
@@ -0,0 +1,271 @@
+from FinDeep_backend.pipeline.utils.metrics import QDRANT_CALLS
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os, time, random, asyncio, threading
+import httpx
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http.exceptions import UnexpectedResponse, ResponseHandlingException
+
+# HTTP statuses worth another attempt; anything else (bad filter, missing collection) fails immediately
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_GRPC_CODES = {"UNAVAILABLE", "DEADLINE_EXCEEDED", "RESOURCE_EXHAUSTED", "ABORTED"}
+
+class QdrantUnavailable(Exception):
+    pass
+
+def is_transient(error: Exception):
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code in RETRYABLE_STATUS
+    if isinstance(error, (ResponseHandlingException, httpx.TransportError, asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    # grpc.RpcError, without importing grpc when the HTTP transport is used
+    code = getattr(error, "code", None)
+    if callable(code):
+        try:
+            return code().name in RETRYABLE_GRPC_CODES
+        except Exception:
+            return False
+    return False
+
+def _env_flag(name: str, default: str = "0"):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__failures = 0
+        self.__opened_at = None
+        self.__probing = False
+        self.__lock = threading.Lock()
+        self.opened = 0
+
+    @property
+    def state(self):
+        if self.__opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.__opened_at >= self.__reset_timeout else "open"
+
+    def allow(self):
+        # Open: fail fast. After reset_timeout one probe call is let through (half-open)
+        with self.__lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.__probing:
+                self.__probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.__lock:
+            self.__failures = 0
+            self.__opened_at = None
+            self.__probing = False
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            self.__probing = False
+            if self.__opened_at is not None or self.__failures >= self.__failure_threshold:
+                if self.__opened_at is None:
+                    self.opened += 1
+                self.__opened_at = time.monotonic()
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self.__failures, "opened": self.opened}
+
+# One client pair (and so one connection pool) per connection setting, shared by every user in the process:
+# key -> [client, async client, open transports]. The last transport to close() closes the pair
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+class QdrantTransport:
+    def __init__(
+            self,
+            url: str = None,
+            api_key: str = None,
+            prefer_grpc: bool = None,
+            grpc_port: int = None,
+            timeout: float = None,
+            pool_size: int = None,
+            retries: int = None,
+            backoff: float = None,
+            max_backoff: float = 2.0,
+            hedge_after: float = None,
+            breaker_threshold: int = None,
+            breaker_reset: float = None
+        ):
+        # Every setting falls back to its QDRANT_* environment variable, so the API and the ingestion job agree
+        self.url = url or os.getenv("QDRANT_URL")
+        self.api_key = api_key or os.getenv("QDRANT_API_KEY")
+        self.prefer_grpc = _env_flag("QDRANT_PREFER_GRPC") if prefer_grpc is None else prefer_grpc
+        self.grpc_port = grpc_port or int(os.getenv("QDRANT_GRPC_PORT", 6334))
+        self.timeout = timeout or float(os.getenv("QDRANT_TIMEOUT", 5))
+        self.pool_size = pool_size or int(os.getenv("QDRANT_POOL_SIZE", 32))
+        self.retries = int(os.getenv("QDRANT_RETRIES", 2)) if retries is None else retries
+        self.backoff = float(os.getenv("QDRANT_BACKOFF", 0.1)) if backoff is None else backoff
+        self.max_backoff = max_backoff
+        # A second, identical read is sent when the first has not answered after this many seconds (0 disables)
+        self.hedge_after = float(os.getenv("QDRANT_HEDGE_AFTER", 0)) if hedge_after is None else hedge_after
+        self.breaker = CircuitBreaker(
+            failure_threshold = breaker_threshold or int(os.getenv("QDRANT_BREAKER_THRESHOLD", 5)),
+            reset_timeout = breaker_reset or float(os.getenv("QDRANT_BREAKER_RESET", 30))
+        )
+        self.__key = (self.url, self.api_key, self.prefer_grpc, self.grpc_port, self.timeout, self.pool_size)
+        self.__closed = False
+        self.client, self.async_client = self.__clients()
+
+    def __client_kwargs(self):
+        kwargs = dict(
+            url = self.url,
+            api_key = self.api_key,
+            prefer_grpc = self.prefer_grpc,
+            grpc_port = self.grpc_port,
+            # Client-side deadline of every HTTP request / gRPC call
+            timeout = max(int(round(self.timeout)), 1)
+        )
+        if self.prefer_grpc:
+            # A single HTTP/2 channel multiplexes the calls; keepalive stops idle load balancers from dropping it
+            kwargs["grpc_options"] = {
+                "grpc.keepalive_time_ms": 30000,
+                "grpc.keepalive_timeout_ms": 10000,
+                "grpc.keepalive_permit_without_calls": 1
+            }
+        else:
+            kwargs["limits"] = httpx.Limits(max_connections = self.pool_size, max_keepalive_connections = self.pool_size)
+        return kwargs
+
+    def __clients(self):
+        with _CLIENTS_LOCK:
+            if self.__key not in _CLIENTS:
+                kwargs = self.__client_kwargs()
+                _CLIENTS[self.__key] = [QdrantClient(**kwargs), AsyncQdrantClient(**kwargs), 0]
+            entry = _CLIENTS[self.__key]
+            entry[2] += 1
+            return entry[0], entry[1]
+
+    def __release(self):
+        # The clients to close, once no other transport in the process still uses them
+        with _CLIENTS_LOCK:
+            if self.__closed:
+                return None
+            self.__closed = True
+            entry = _CLIENTS[self.__key]
+            entry[2] -= 1
+            if entry[2] > 0:
+                return None
+            del _CLIENTS[self.__key]
+            return entry[0], entry[1]
+
+    def close(self):
+        # Callers close their transport, never the shared clients directly
+        clients = self.__release()
+        if clients is None:
+            return
+        client, async_client = clients
+        client.close()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(async_client.close())
+        else:
+            asyncio.ensure_future(async_client.close())
+
+    async def aclose(self):
+        clients = self.__release()
+        if clients is None:
+            return
+        client, async_client = clients
+        client.close()
+        await async_client.close()
+
+    def __delay(self, attempt: int):
+        # Full jitter: spreads the retries of many workers hitting the same hiccup
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def __before_call(self, method: str):
+        if not self.breaker.allow():
+            QDRANT_CALLS.inc(method, "rejected")
+            raise QdrantUnavailable(f"Qdrant circuit is open, {method} rejected")
+
+    def __after_failure(self, method: str, error: Exception, attempt: int):
+        # True when the call should be attempted again
+        if not is_transient(error):
+            # Qdrant answered (e.g. a bad request), so the connection itself is healthy
+            self.breaker.record_success()
+            QDRANT_CALLS.inc(method, "error")
+            raise error
+        if attempt < self.retries:
+            QDRANT_CALLS.inc(method, "retry")
+            return True
+        QDRANT_CALLS.inc(method, "error")
+        self.breaker.record_failure()
+        raise QdrantUnavailable(f"Qdrant {method} failed after {attempt + 1} attempts: {error!r}") from error
+
+    def call(self, method: str, **kwargs):
+        self.__before_call(method)
+        attempt = 0
+        while True:
+            try:
+                result = getattr(self.client, method)(**kwargs)
+                self.breaker.record_success()
+                QDRANT_CALLS.inc(method, "ok")
+                return result
+            except Exception as e:
+                self.__after_failure(method, e, attempt)
+            time.sleep(self.__delay(attempt))
+            attempt += 1
+
+    async def __attempt(self, method: str, kwargs: dict):
+        return await asyncio.wait_for(getattr(self.async_client, method)(**kwargs), timeout = self.timeout)
+
+    async def __hedged(self, method: str, kwargs: dict):
+        # Tail latency: if the first attempt is slow, race an identical second one and keep whichever answers first
+        first = asyncio.ensure_future(self.__attempt(method, kwargs))
+        done, _ = await asyncio.wait({first}, timeout = self.hedge_after)
+        if done:
+            return first.result()
+        QDRANT_CALLS.inc(method, "hedge")
+        pending = {first, asyncio.ensure_future(self.__attempt(method, kwargs))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def acall(self, method: str, hedge: bool = False, **kwargs):
+        # hedge is for idempotent reads only (search, count, ...)
+        self.__before_call(method)
+        attempt = 0
+        while True:
+            try:
+                if hedge and self.hedge_after > 0:
+                    result = await self.__hedged(method, kwargs)
+                else:
+                    result = await self.__attempt(method, kwargs)
+                self.breaker.record_success()
+                QDRANT_CALLS.inc(method, "ok")
+                return result
+            except Exception as e:
+                self.__after_failure(method, e, attempt)
+            await asyncio.sleep(self.__delay(attempt))
+            attempt += 1
+
+    def stats(self):
+        return {
+            "transport": "grpc" if self.prefer_grpc else "http",
+            "timeout": self.timeout,
+            "retries": self.retries,
+            "hedge_after": self.hedge_after,
+            "circuit": self.breaker.stats()
+        }
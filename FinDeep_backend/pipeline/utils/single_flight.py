@@ -0,0 +1,60 @@
+from FinDeep_backend.pipeline.utils.metrics import record, current_timings, bind_request_timings, SharedTimings, COALESCED
+from FinDeep_backend.pipeline.utils.llm_scheduler import SharedRequest, bind_shared_request
+
+import re, asyncio, contextvars
+
+def normalize_message(message: str):
+    # Case, whitespace and trailing punctuation do not change what is being asked
+    return re.sub(r"\s+", " ", message).strip().rstrip("?!. ").lower()
+
+class SingleFlight:
+    def __init__(self, stage: str):
+        self.stage = stage
+        # key -> (task, SharedRequest, SharedTimings) of the call currently running for it
+        self.__in_flight = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def run(self, key, factory):
+        # Concurrent callers with the same key share one execution and all get its result (or its exception)
+        in_flight = self.__in_flight.get(key)
+        if in_flight is None:
+            self.leaders += 1
+            COALESCED.inc(self.stage, "leader")
+            record(f"{self.stage}_coalesced", False)
+            # A task of its own, so a leader whose client disconnects does not cancel the followers' result.
+            # It runs in a fresh context rather than the leader's: its deadline and priority come from every
+            # waiter and what it records is added to every waiter's timings
+            shared, timings = SharedRequest(), SharedTimings()
+            context = contextvars.Context()
+            context.run(bind_shared_request, shared)
+            context.run(bind_request_timings, timings)
+            task = asyncio.get_running_loop().create_task(factory(), context = context)
+            in_flight = self.__in_flight[key] = (task, shared, timings)
+            task.add_done_callback(lambda done: self.__finish(key, done))
+        else:
+            self.followers += 1
+            COALESCED.inc(self.stage, "follower")
+            record(f"{self.stage}_coalesced", True)
+        task, shared, timings = in_flight
+        waiter = shared.join()
+        timings.attach(current_timings())
+        try:
+            return await asyncio.shield(task)
+        finally:
+            shared.leave(waiter)
+
+    def __finish(self, key, task):
+        self.__in_flight.pop(key, None)
+        # Marks a failure as retrieved even when every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        total = self.leaders + self.followers
+        return {
+            "in_flight": len(self.__in_flight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "coalesce_ratio": self.followers / total if total else 0.0
+        }
@@ -2,35 +2,100 @@ from FinDeep_backend.pipeline.constant.schema import GraphState
 from FinDeep_backend.pipeline.agents.message_analysis import MessageAnalysis
 from FinDeep_backend.pipeline.agents.message_systhesis import MessageSynthesis
 from FinDeep_backend.pipeline.agents.qdrant_retrieval import QdrantRetrieval
+from FinDeep_backend.pipeline.agents.retrieval_fanout import RetrievalBranch, MergeRetrieval, route_retrieval
+from FinDeep_backend.pipeline.store.fact_store import FactStore
+from FinDeep_backend.pipeline.store.time_series import TimeSeriesStore
+from FinDeep_backend.pipeline.utils.entity_extractor import EntityExtractor
+from FinDeep_backend.pipeline.utils.llm_scheduler import LLMScheduler
+from FinDeep_backend.pipeline.utils.cache import GenerationMarker
 
 from dotenv import load_dotenv
 load_dotenv()
 
 from langgraph.graph import END, START, StateGraph
-from langgraph.checkpoint.memory import MemorySaver
+from FinDeep_backend.pipeline.utils.checkpointer import BoundedMemorySaver
 
 class GraphBuilder:
     def __init__(
             self,
             embedding_model:str,
-            model_name:str
+            model_name:str,
+            data_path:str = None,
+            embedding_backend:str = "torch",
+            retrieval_backend:str = "qdrant",
+            embeddings_path:str = None,
+            faiss_index_path:str = None,
+            cache_generation_path:str = None,
+            chat_model = None,
+            llm_scheduler = None
         ):
         self.builder = StateGraph(GraphState)
         self.embedding_model = embedding_model
         self.model_name = model_name
+        self.data_path = data_path
+        self.embedding_backend = embedding_backend
+        self.retrieval_backend = retrieval_backend
+        self.embeddings_path = embeddings_path
+        self.faiss_index_path = faiss_index_path
+        # Marker file every worker watches, so a cache invalidation reaches all of them
+        self.generation_marker = GenerationMarker(cache_generation_path) if cache_generation_path else None
+        self.chat_model = chat_model
+        # One scheduler for every LLM call of the process, so the provider's rate limits are shared
+        self.llm_scheduler = llm_scheduler or LLMScheduler()
 
     def build_graph(self):
-        self.message_analysis = MessageAnalysis(model_name = self.model_name)
-        self.qdrant_retrieval = QdrantRetrieval(embedding_model = self.embedding_model)
-        self.message_synthesis = MessageSynthesis(model_name = self.model_name)
+        self.entity_extractor = EntityExtractor(csv_path = self.data_path) if self.data_path else None
+        self.message_analysis = MessageAnalysis(
+            model_name = self.model_name,
+            entity_extractor = self.entity_extractor,
+            chat_model = self.chat_model,
+            llm_scheduler = self.llm_scheduler
+        )
+        self.fact_store = FactStore(csv_path = self.data_path) if self.data_path else None
+        self.time_series_store = TimeSeriesStore(csv_path = self.data_path) if self.data_path else None
+        if self.retrieval_backend == "faiss":
+            # In-process vector search over the memory-mapped embeddings, no Qdrant server needed
+            from FinDeep_backend.pipeline.agents.faiss_retrieval import FaissRetrieval
+            self.qdrant_retrieval = FaissRetrieval(
+                embedding_model = self.embedding_model,
+                csv_path = self.data_path,
+                embeddings_path = self.embeddings_path,
+                index_path = self.faiss_index_path,
+                fact_store = self.fact_store,
+                time_series_store = self.time_series_store,
+                encoder_backend = self.embedding_backend,
+                generation_marker = self.generation_marker
+            )
+        elif self.retrieval_backend == "qdrant":
+            self.qdrant_retrieval = QdrantRetrieval(
+                embedding_model = self.embedding_model,
+                fact_store = self.fact_store,
+                time_series_store = self.time_series_store,
+                encoder_backend = self.embedding_backend,
+                generation_marker = self.generation_marker
+            )
+        else:
+            raise ValueError(f"Unknown retrieval backend {self.retrieval_backend!r}, expected 'qdrant' or 'faiss'")
+        self.merge_retrieval = MergeRetrieval(time_series_store = self.time_series_store)
+        self.retrieval_branch = RetrievalBranch(self.qdrant_retrieval, merge_retrieval = self.merge_retrieval)
+        self.message_synthesis = MessageSynthesis(
+            model_name = self.model_name,
+            chat_model = self.chat_model,
+            llm_scheduler = self.llm_scheduler
+        )
 
         self.builder.add_node("message_analysis", self.message_analysis)
         self.builder.add_node("qdrant_retrieval", self.qdrant_retrieval)
+        self.builder.add_node("retrieval_branch", self.retrieval_branch)
+        self.builder.add_node("merge_retrieval", self.merge_retrieval)
         self.builder.add_node("message_synthesis", self.message_synthesis)
 
         self.builder.add_edge(START, "message_analysis")
-        self.builder.add_edge("message_analysis", "qdrant_retrieval")
+        # Single lookups go straight to retrieval; comparison questions fan out one branch per sub-query
+        self.builder.add_conditional_edges("message_analysis", route_retrieval, ["qdrant_retrieval", "retrieval_branch"])
         self.builder.add_edge("qdrant_retrieval", "message_synthesis")
+        self.builder.add_edge("retrieval_branch", "merge_retrieval")
+        self.builder.add_edge("merge_retrieval", "message_synthesis")
         self.builder.add_edge("message_synthesis", END)
 
         return self.builder
@@ -39,23 +104,66 @@ class Graph:
     @staticmethod
     def compile(
         embedding_model:str,
-        model_name:str
+        model_name:str,
+        data_path:str = None,
+        embedding_backend:str = "torch",
+        retrieval_backend:str = "qdrant",
+        embeddings_path:str = None,
+        faiss_index_path:str = None,
+        checkpoint_path:str = None,
+        cache_generation_path:str = None,
+        chat_model = None,
+        llm_scheduler = None
     ):
         builder = GraphBuilder(
             embedding_model = embedding_model,
             model_name = model_name, 
+            data_path = data_path,
+            embedding_backend = embedding_backend,
+            retrieval_backend = retrieval_backend,
+            embeddings_path = embeddings_path,
+            faiss_index_path = faiss_index_path,
+            cache_generation_path = cache_generation_path,
+            chat_model = chat_model,
+            llm_scheduler = llm_scheduler
         )
-        memory = MemorySaver()
-        return builder.build_graph().compile(checkpointer = memory)
+        # Bounded, evicting session memory; checkpoint_path adds a durable SQLite copy
+        memory = BoundedMemorySaver(sqlite_path = checkpoint_path)
+        graph = builder.build_graph().compile(checkpointer = memory)
+        # Keep handles on the agents so the API can manage caches and run batch jobs stage by stage
+        graph.message_analysis = builder.message_analysis
+        graph.qdrant_retrieval = builder.qdrant_retrieval
+        graph.retrieval_branch = builder.retrieval_branch
+        graph.message_synthesis = builder.message_synthesis
+        graph.llm_scheduler = builder.llm_scheduler
+        return graph
 
 def build_graph(
         embedding_model:str,
         model_name:str, 
+        data_path:str = None,
+        embedding_backend:str = "torch",
+        retrieval_backend:str = "qdrant",
+        embeddings_path:str = None,
+        faiss_index_path:str = None,
+        checkpoint_path:str = None,
+        cache_generation_path:str = None,
+        chat_model = None,
+        llm_scheduler = None,
         save_graph:bool = False
     ):
     graph = Graph.compile(
         embedding_model = embedding_model,
-        model_name = model_name
+        model_name = model_name,
+        data_path = data_path,
+        embedding_backend = embedding_backend,
+        retrieval_backend = retrieval_backend,
+        embeddings_path = embeddings_path,
+        faiss_index_path = faiss_index_path,
+        checkpoint_path = checkpoint_path,
+        cache_generation_path = cache_generation_path,
+        chat_model = chat_model,
+        llm_scheduler = llm_scheduler
     )
     if save_graph:
         with open("pipeline/assets/chatbot_pipeline.png", "wb") as f:
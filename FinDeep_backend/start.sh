@@ -17,7 +17,30 @@ OPENAI_API_KEY=your-openai-api-key-here
 
 # Optional: Other AI model configurations
 # MODEL_NAME=gpt-4o-mini
-# EMBEDDING_MODEL=sentence-transformers/all-MiniLM-L6-v2" > .env
+# EMBEDDING_MODEL=sentence-transformers/all-MiniLM-L6-v2
+# EMBEDDING_BACKEND=torch  # torch | onnx | onnx-int8
+# FINDEEP_DATA_PATH=data_setup/sources/FinDeep_data (cleaned).csv
+# RETRIEVAL_BACKEND=qdrant  # qdrant | faiss
+# FINDEEP_EMBEDDINGS_PATH=data_setup/sources/financial_embeddings.npy
+# FAISS_INDEX_PATH=data_setup/sources/financial_embeddings.faiss
+# FINDEEP_CHECKPOINT_PATH=data_setup/sources/sessions.sqlite
+# FINDEEP_CACHE_INVALIDATE_URL=http://localhost:8001/cache/invalidate
+# CACHE_INVALIDATE_TOKEN=  # X-Admin-Token for /cache/invalidate; unset = endpoint disabled
+# FINDEEP_CACHE_GENERATION_PATH=data_setup/sources/financial_embeddings.npy.generation  # marker file all workers watch
+# WEB_CONCURRENCY=2  # gunicorn workers for ./start.sh --production
+# QDRANT_PREFER_GRPC=0  # 1 = gRPC transport on QDRANT_GRPC_PORT (6334)
+# QDRANT_TIMEOUT=5  # per-call deadline in seconds
+# QDRANT_RETRIES=2
+# QDRANT_HEDGE_AFTER=0  # seconds before a duplicate read is sent, 0 = no hedging
+# QDRANT_BREAKER_THRESHOLD=5
+# QDRANT_BREAKER_RESET=30
+# QDRANT_COLLECTION_PROFILE=float32  # float32 | float32-disk | int8 | int8-disk | binary | binary-disk, same value for ingestion and serving
+# QDRANT_HNSW_EF=128  # search-time HNSW ef (default: Qdrant's)
+# LLM_RPM=500  # provider requests/min limit, 0 = unlimited
+# LLM_TPM=200000  # provider tokens/min limit, 0 = unlimited
+# LLM_MAX_CONCURRENCY=16
+# LLM_MAX_QUEUE=256
+# CHAT_REQUEST_TIMEOUT=30  # seconds per /chat request; X-Request-Timeout can only shorten it" > .env
     echo "📝 Please edit .env file and add your OpenAI API key"
 fi
 
@@ -37,7 +60,12 @@ pip install -r requirements.txt
 
 # Start the server
 echo "🌟 Starting FinDeep Backend server..."
-uvicorn app.chatbot_api:app --host 0.0.0.0 --port 8001 --reload
+if [ "$1" = "--production" ]; then
+    # Model preloaded once in the gunicorn master, shared by the forked workers
+    (cd .. && gunicorn -c FinDeep_backend/app/gunicorn_conf.py FinDeep_backend.app.chatbot_api:app)
+else
+    (cd .. && uvicorn FinDeep_backend.app.chatbot_api:app --host 0.0.0.0 --port 8001 --reload)
+fi
 
 echo "✅ FinDeep Backend is running on http://localhost:8001"
 echo "📖 API Documentation: http://localhost:8001/"